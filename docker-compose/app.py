@@ -8,11 +8,14 @@ import datetime
 from pytz import timezone
 from pathlib import Path
 import statistics
+import billiard
+import numpy as np
 
 import game_env.hidenseek_gym
 from game_env.hidenseek_gym.config import config as default_config
 
-from helpers import Helpers
+from helpers import Helpers, ProgressPublisher
+from rl import ActorLearner
 
 app = Flask(__name__)
 celery = Celery(broker='redis://redis:6379/0', backend='redis://redis:6379/0')
@@ -24,13 +27,19 @@ def train(self, core_id, config_data, start_date):
     start = time.time()
     cfg = Helpers.prepare_config(config_data)
 
-    walls, seeker, hiding, width, height = Helpers.prepare_map(cfg)
+    walls, walls_index, seeker, hiding, width, height = Helpers.prepare_map(cfg)
+
+    if cfg['game']['workers'] > 1 and cfg['game']['actor_learner']:
+        return train_actor_learner(self, core_id, cfg, start, walls, walls_index, seeker, hiding, width, height)
+    if cfg['game']['workers'] > 1:
+        return train_workers(self, core_id, cfg, start, walls, walls_index, seeker, hiding, width, height)
 
     env, step_img_path, fps_batch, render_mode, wins_l = Helpers.create_env(
         config=cfg,
         width=width,
         height=height,
         walls=walls,
+        walls_index=walls_index,
         seeker=seeker,
         hiding=hiding,
         start_date=start_date,
@@ -41,77 +50,294 @@ def train(self, core_id, config_data, start_date):
     algorithm = Helpers.pick_algorithm(cfg, env=env, agents=AGENTS)
     algorithm.prepare_model()
 
-    for i in range(cfg['game']['episodes']):
-        algorithm.before_episode()
-        metadata = Helpers.update_celery_metadata(
-            core_id=core_id,
-            curr=i + 1,
-            total=cfg['game']['episodes'],
-            ep_iter=cfg['game']['duration'],
-            fps=None,
-            itera=0,
-            iter_perc=0,
-            time_elap=round(time.time() - start),
-            img_path=step_img_path,
-            eta=None,
-            rewards=[0, 0],
-            wins=[0, 0],
-            wins_moving=[0, 0],
-        )
-        self.update_state(state='PROGRESS', meta=metadata)
-
-        obs_n, reward_n, rewards_ep, done, fps_episode = Helpers.new_ep(env)
-
-        while True:
-            rewards_ep = [rewards_ep[0] + reward_n[0],
-                          rewards_ep[1] + reward_n[1]]
-            metadata['status'] = Helpers.update_metadata_status(
-                fps=env.clock.get_fps(),
-                itera=int(cfg['game']['duration']) - env.duration,
-                iter_perc=round(
-                    ((int(cfg['game']['duration']) - env.duration) / int(cfg['game']['duration'])) * 100, 2),
+    with progress_publisher(self, cfg, start, step_img_path) as publisher:
+        for i in range(cfg['game']['episodes']):
+            algorithm.before_episode()
+            metadata = episode_metadata(core_id, cfg, i + 1, start, step_img_path, wins_l)
+            publisher.update(metadata, None, 0, [0, 0])
+            publisher.flush()
+
+            obs_n, reward_n, rewards_ep, done, fps_episode = Helpers.new_ep(env)
+
+            while True:
+                rewards_ep = [rewards_ep[0] + reward_n[0],
+                              rewards_ep[1] + reward_n[1]]
+                fps = env.get_fps()
+
+                fps_episode.append(fps)
+
+                algorithm.before_action(obs_n=obs_n)
+
+                action_n = algorithm.take_action(obs_n=obs_n)
+                obs_old_n=copy.deepcopy(obs_n)
+
+                algorithm.before_step(action_n=action_n)
+                obs_n, reward_n, done, _ = env.step(action_n)
+                algorithm.after_step(
+                    reward_n=reward_n,
+                    obs_old_n=obs_old_n,
+                    obs_n=obs_n,
+                    done=done
+                )
+
+
+                Helpers.update_img_status(
+                    env, cfg['video']['monitoring'], step_img_path, render_mode)
+                publisher.update(metadata, fps, int(cfg['game']['duration']) - env.duration, rewards_ep)
+
+                if done[0]:
+                    algorithm.handle_gameover(
+                        obs_n=obs_n,
+                        reward_n=reward_n,
+                        ep_length=int(cfg['game']['duration']) - env.duration,
+                    )
+                    Helpers.handle_gameover(done[1], wins_l)
+                    publisher.flush()
+                    break
+
+            algorithm.after_episode()
+
+            fps_batch.append(statistics.fmean(fps_episode))
+
+    algorithm.before_cleanup()
+    Helpers.cleanup(env, core_id)
+
+    return Helpers.get_celery_success(
+        core_id=core_id,
+        time_elap=round(time.time() - start, 4),
+        fps_batch=fps_batch,
+        wins=[sum(w) for w in wins_l],
+    )
+
+
+def progress_publisher(task, cfg, start, step_img_path):
+    # progress is sent from background thread, which has no Celery request context, so task id is passed explicitly
+    task_id = task.request.id
+    return ProgressPublisher(
+        publish=lambda metadata: task.update_state(task_id=task_id, state='PROGRESS', meta=metadata),
+        build=lambda metadata, fps, itera, rewards: {
+            **metadata,
+            'status': Helpers.update_metadata_status(
+                fps=fps,
+                itera=itera,
+                iter_perc=round((itera / int(cfg['game']['duration'])) * 100, 2),
                 time_elap=round(time.time() - start),
-                eta=round((env.duration / env.clock.get_fps()) + int(cfg['game']['duration']) / env.clock.get_fps(
-                ) * cfg['game']['episodes']) if env.clock.get_fps() else None,
+                eta=round(((int(cfg['game']['duration']) - itera) / fps) + int(cfg['game']['duration']) / fps * cfg['game']['episodes']) if fps else None,
                 img_path=step_img_path[8:],
-                rewards=rewards_ep,
-                wins=[sum(w) for w in wins_l],
-                wins_moving=[sum(w[-10:]) for w in wins_l],
-            )
-
-            fps_episode.append(env.clock.get_fps())
+                rewards=rewards,
+                wins=metadata['status']['wins'],
+                wins_moving=metadata['status']['wins_moving'],
+            ),
+        },
+        interval=cfg['video']['progress_interval'],
+    )
 
-            algorithm.before_action(obs_n=obs_n)
 
-            action_n = algorithm.take_action(obs_n=obs_n)
-            obs_old_n=copy.deepcopy(obs_n)
+def episode_metadata(core_id, cfg, curr, start, step_img_path, wins_l):
+    return Helpers.update_celery_metadata(
+        core_id=core_id,
+        curr=curr,
+        total=cfg['game']['episodes'],
+        ep_iter=cfg['game']['duration'],
+        fps=None,
+        itera=0,
+        iter_perc=0,
+        time_elap=round(time.time() - start),
+        img_path=step_img_path,
+        eta=None,
+        rewards=[0, 0],
+        wins=[sum(w) for w in wins_l],
+        wins_moving=[sum(w[-10:]) for w in wins_l],
+    )
 
-            algorithm.before_step(action_n=action_n)
-            obs_n, reward_n, done, _ = env.step(action_n)
-            algorithm.after_step(
-                reward_n=reward_n,
-                obs_old_n=obs_old_n,
-                obs_n=obs_n,
-                done=done
-            )
 
+def train_workers(task, core_id, cfg, start, walls, walls_index, seeker, hiding, width, height):
+    """
+    Trains one model on `game.workers` games stepped in parallel worker processes; observations & actions
+    are exchanged through shared memory. Algorithm hooks get agent-major batches, same layout as obs_n:
+    after_step gets every game, handle_gameover, after_episode & before_episode get only games finished
+    in this step (with their `env_indices`), so episode hooks are still called once per game.
+    Status shows the first game, episodes are counted over all games
+
+    Parameters
+    ----------
+        task : celery.Task
+            bound train task
+        core_id : int
+            Celery task core id
+        cfg : dict
+            game config
+        start : float
+            training start timestamp
+        walls, walls_index, seeker, hiding, width, height :
+            prepared map, see Helpers.prepare_map
+
+    Returns
+    -------
+        result : dict
+            Celery success metadata
+    """
+
+    num_envs = cfg['game']['workers']
+    # Celery pool processes are daemonic, only billiard allows them to start worker processes
+    env, step_img_path, fps_batch, render_mode, wins_l = Helpers.create_vec_env(
+        config=cfg,
+        width=width,
+        height=height,
+        walls=walls,
+        walls_index=walls_index,
+        seeker=seeker,
+        hiding=hiding,
+        core_id=core_id,
+        num_envs=num_envs,
+        context=billiard.get_context('fork'),
+    )
 
-            Helpers.update_img_status(
-                env, cfg['video']['monitoring'], step_img_path, render_mode)
-            self.update_state(state='PROGRESS', meta=metadata)
+    AGENTS = 2
+    algorithm = Helpers.pick_algorithm(cfg, env=env, agents=AGENTS, num_envs=num_envs)
+    algorithm.prepare_model()
 
-            if done[0]:
-                algorithm.handle_gameover(
+    episodes = 0
+    ep_length = np.zeros(num_envs, dtype=np.int64)
+    rewards_ep = np.zeros((num_envs, AGENTS))
+    fps_episode = []
+
+    # worker processes are stopped even if training fails, Celery pool process lives on
+    try:
+        with progress_publisher(task, cfg, start, step_img_path) as publisher:
+            metadata = episode_metadata(core_id, cfg, 1, start, step_img_path, wins_l)
+            publisher.update(metadata, None, 0, [0, 0])
+            publisher.flush()
+
+            algorithm.before_episode(env_indices=np.arange(num_envs))
+            obs_n = env.reset()
+
+            while episodes < cfg['game']['episodes']:
+                algorithm.before_action(obs_n=obs_n)
+
+                action_n = algorithm.take_action(obs_n=obs_n)
+                obs_old_n = [obs.copy() for obs in obs_n]  # obs_n are views of shared memory, overwritten by step
+
+                algorithm.before_step(action_n=action_n)
+                obs_n, reward_n, done, info = env.step(action_n)
+                # agent-major batches, same layout as obs_n: reward_n[j] & done[0] have shape (num_envs, )
+                algorithm.after_step(
+                    reward_n=reward_n.T,
+                    obs_old_n=obs_old_n,
                     obs_n=obs_n,
-                    reward_n=reward_n,
-                    ep_length=int(cfg['game']['duration']) - env.duration,
+                    done=(done, info['winner']),
                 )
-                Helpers.handle_gameover(done[1], wins_l)
-                break
 
-        algorithm.after_episode()
+                ep_length += 1
+                rewards_ep += reward_n
+                fps = env.get_fps()
+                fps_episode.append(fps)
+
+                Helpers.update_img_status(
+                    env, cfg['video']['monitoring'], step_img_path, render_mode)
+                publisher.update(metadata, fps, int(ep_length[0]), rewards_ep[0].tolist())
+
+                finished = np.flatnonzero(done)
+                if finished.size:
+                    # finished games only, agent-major like after_step: obs_n[j] & reward_n[j] have shape (finished, ...)
+                    algorithm.handle_gameover(
+                        obs_n=[obs[finished] for obs in info['terminal_obs_n']],
+                        reward_n=reward_n[finished].T,
+                        ep_length=ep_length[finished],
+                        env_indices=finished,
+                    )
+                    algorithm.after_episode(env_indices=finished)
+                    algorithm.before_episode(env_indices=finished)
+
+                for i in finished:
+                    Helpers.handle_gameover(info['winner'][i], wins_l)
+                    fps_batch.append(statistics.fmean(fps_episode))
+
+                    episodes += 1
+                    ep_length[i] = 0
+                    rewards_ep[i] = 0
+                    metadata = episode_metadata(
+                        core_id, cfg, min(episodes + 1, cfg['game']['episodes']), start, step_img_path, wins_l)
+                    publisher.update(metadata, fps, int(ep_length[0]), rewards_ep[0].tolist())
+                    publisher.flush()
+                if finished.size:
+                    fps_episode = []
+    finally:
+        env.close()
+
+    algorithm.before_cleanup()
+    Helpers.cleanup(env, core_id)
+
+    return Helpers.get_celery_success(
+        core_id=core_id,
+        time_elap=round(time.time() - start, 4),
+        fps_batch=fps_batch,
+        wins=[sum(w) for w in wins_l],
+    )
+
+
+def train_actor_learner(task, core_id, cfg, start, walls, walls_index, seeker, hiding, width, height):
+    """
+    Trains one model in Actor-Learner topology: `game.workers` actor processes play games, one inference
+    process runs the policy for all of them in batches, this process learns on streamed trajectories
+    and broadcasts new weights. Progress is updated after every finished game
+
+    Parameters
+    ----------
+        task : celery.Task
+            bound train task
+        core_id : int
+            Celery task core id
+        cfg : dict
+            game config
+        start : float
+            training start timestamp
+        walls, walls_index, seeker, hiding, width, height :
+            prepared map, see Helpers.prepare_map
+
+    Returns
+    -------
+        result : dict
+            Celery success metadata
+    """
+
+    env_fn = Helpers.env_fn(cfg, width, height, hiding, seeker, walls, walls_index)
+    env = env_fn()  # only describes spaces for the model, games are played by actors
+    step_img_path = '/opt/app/static/images/core-' + str(core_id) + '/last_frame.jpg'
+    fps_batch, wins_l = [], [[], []]
+
+    AGENTS = 2
+    algorithm = Helpers.pick_algorithm(cfg, env=env, agents=AGENTS, actor_learner=True)
+    algorithm.prepare_model()
 
-        fps_batch.append(statistics.fmean(fps_episode))
+    frames = 0
+    with progress_publisher(task, cfg, start, step_img_path) as publisher:
+        metadata = episode_metadata(core_id, cfg, 1, start, step_img_path, wins_l)
+        publisher.update(metadata, None, 0, [0, 0])
+        publisher.flush()
+        run_start = time.time()
+
+        def on_episode(winner, length, rewards):
+            nonlocal frames
+            frames += length
+            # throughput of all actors together
+            fps = frames / (time.time() - run_start)
+            fps_batch.append(fps)
+
+            Helpers.handle_gameover(winner, wins_l)
+            metadata = episode_metadata(
+                core_id, cfg, min(len(wins_l[0]) + 1, cfg['game']['episodes']), start, step_img_path, wins_l)
+            publisher.update(metadata, fps, length, rewards)
+            publisher.flush()
+
+        # Celery pool processes are daemonic, only billiard allows them to start actor & inference processes
+        with ActorLearner(
+            algorithm,
+            [env_fn] * cfg['game']['workers'],
+            unroll_length=algorithm.update_timestep,
+            context=billiard.get_context('fork'),
+        ) as topology:
+            topology.run(cfg['game']['episodes'], on_episode=on_episode)
 
     algorithm.before_cleanup()
     Helpers.cleanup(env, core_id)
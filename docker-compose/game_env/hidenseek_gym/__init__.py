@@ -4,3 +4,8 @@ register(
     id='hidenseek-v1',
     entry_point='game_env.hidenseek_gym.envs:HideNSeekEnv',
 )
+
+register(
+    id='hidenseek-vec-v1',
+    entry_point='game_env.hidenseek_gym.envs:HideNSeekVecEnv',
+)
@@ -1,17 +1,16 @@
 import pygame
-from game_env.hidenseek_gym.supportive import Point, Collision
+from game_env.hidenseek_gym.supportive import Point, PointArray, Collision, AssetCache, Versioned
 from game_env.hidenseek_gym.fixed import Wall
 import copy
 import random
 import json
 import math
 import numpy as np
-import os
 
 
-class Player(pygame.sprite.Sprite):
+class Player(Versioned):
     """
-    Parent Player Class for Hide'n'Seek Game, inherits from pygame.sprite.Sprite.
+    Parent Player Class for Hide'n'Seek Game. Pure geometry, sprites are loaded lazily, only when rendering.
     Shouldn't be used because it doesn't have implementation of few methods
 
     Attributes
@@ -48,23 +47,25 @@ class Player(pygame.sprite.Sprite):
             POV angle in radians (Z = 2 * PI)
         image_index : int
             determines which image should be drawn
-        images : list of pygame.Surface
-            objects with sprite/images from which the proper one will be drawn
-        image : pygame.Surface
-            object with sprite/image, chosen by 'image_index'
-        rect : pygame.Rect
-            object Rectangle, to be drawn
-        polygon_points : list of tuples
+        sprites : list of pygame.Surface
+            objects with sprite/images from which the proper one will be drawn, loaded on first access
+        sprites_count : int
+            number of sprite/images, known without loading them
+        polygon_points : PointArray
             Agent vertices, used for collision check in SAT
         actions : list of dict
             contains all possible Player actions
+        version : int
+            incremented whenever pos, width, height or direction is set, invalidates cached vertices
 
     Methods
     -------
         _rotate(turn, local_env):
             rotates the object, accordingly to the value, along its axis
         get_abs_vertices():
-            returns absolute vertices coordinates (in game screen coordinates system)
+            returns absolute vertices coordinates (in game screen coordinates system), cached
+        get_rect_vertices():
+            returns absolute Player Rectangle vertices coordinates, cached
         _move_action(new_pos):
             algorithm which moves the Player object to given poisition
         update_vision(local_env):
@@ -92,7 +93,9 @@ class Player(pygame.sprite.Sprite):
                 height of the game window
         """
 
-        super().__init__()
+        self.version = 0
+        self._cache = {}
+
         self.width = size[0]
         self.height = size[1]
 
@@ -147,7 +150,7 @@ class Player(pygame.sprite.Sprite):
             ........---------........
 
         """
-        self.polygon_points = [
+        self.polygon_points = PointArray([
             Point((self.width * .355, self.height * .15)),
             Point((self.width * .645, self.height * .15)),
             Point((self.width * .85, self.height * .355)),
@@ -156,17 +159,29 @@ class Player(pygame.sprite.Sprite):
             Point((self.width * .355, self.height * .85)),
             Point((self.width * .15, self.height * .645)),
             Point((self.width * .15, self.height * .355)),
-        ]
+        ])
 
-        self.sprites = [pygame.image.load(os.path.join(cfg['graphics_path'], file_)) for file_ in os.listdir(cfg['graphics_path'])]
+        self._sprites = None
+        self.sprites_count = len(AssetCache.list_files(cfg['graphics_path']))
+        self.image_index = 0
 
-        surface = pygame.Surface((self.width, self.height))
-        surface.set_colorkey((0, 0, 0))
+    @property
+    def sprites(self):
+        """
+        Player sprites, loaded on first access (i.e. first render), shared through AssetCache
 
-        self.image_index = 0
-        self.image = surface
-        self.rect = self.image.get_rect()
-        self.rect.center = (self.pos.x, self.pos.y)
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            sprites : list of pygame.Surface
+        """
+
+        if self._sprites is None:
+            self._sprites = AssetCache.load_images(self.cfg['graphics_path'])
+        return self._sprites
 
     def act(self, obs, reward, game_end, action_space):
         """
@@ -200,15 +215,20 @@ class Player(pygame.sprite.Sprite):
 
         Returns
         -------
-            points : list of hidenseek.ext.supportive.Point
-                self.pylogon_points mapped to the absolute coordinates system
+            points : hidenseek.ext.supportive.PointArray
+                self.pylogon_points mapped to the absolute coordinates system, shared until Player moves
         """
 
-        return [Point((polygon_point.x + self.rect.left, polygon_point.y + self.rect.top)) for polygon_point in self.polygon_points]
+        return self._cached('abs_vertices', self._abs_vertices)
 
-    def _determine_new_ray_points(self, wall_edges):
+    def _abs_vertices(self):
+        """Computes Player.get_abs_vertices, without cache"""
+
+        return self.polygon_points + Point.from_xy(self.pos.x - self.width / 2, self.pos.y - self.height / 2)
+
+    def get_rect_vertices(self):
         """
-        Algorithm which calculates new possible ray points based on the current Agent Position and Agent Direction
+        Returns absolute coordinates of Player Rectangle vertices
 
         Parameters
         ----------
@@ -216,38 +236,23 @@ class Player(pygame.sprite.Sprite):
 
         Returns
         -------
-            ray_points : list of Point
-                list of new, standard Ray Points
+            points : hidenseek.ext.supportive.PointArray
+                top left, top right, bottom right & bottom left vertex, shared until Player moves
         """
 
-        ray_points = []
-        dir_t = self.direction - 2*math.pi if self.direction > math.pi else self.direction
-        point_angle_0 = self.pos + Point((self.vision_radius, 0))
-        angles = np.linspace(dir_t - self.vision_rad / 2, dir_t + self.vision_rad / 2, num=11,
-                             endpoint=True)  # counter-clockwise
-        angles_min, angles_max = min(angles), max(angles)
-
-        for p in [pnt for wall_edge in wall_edges for pnt in wall_edge]:
-            delta = p - self.pos
-            theta_radians = math.atan2(delta.y, delta.x)
-
-            # 3rd quartet (2nd in math, 3rd in Y being from top to bottom), fixes 2nd; from [-PI; PI] to [-2PI; 0]
-            if angles_min < -math.pi and theta_radians > 0:
-                theta_radians = theta_radians - 2*math.pi
-            # 2nd quartet (3rd in math, 2nd in Y being from top to bottom), fixes 3rd; from [-PI; PI] to [0; 2PI]
-            elif angles_max > math.pi and theta_radians < 0:
-                theta_radians = theta_radians + 2*math.pi
+        return self._cached('rect_vertices', self._rect_vertices)
 
-            if theta_radians not in angles and theta_radians > angles_min and theta_radians < angles_max:
-                angles = np.append(angles, theta_radians)
-        angles = np.sort(angles)
+    def _rect_vertices(self):
+        """Computes Player.get_rect_vertices, without cache"""
 
-        for angle in angles:
-            ray_point = Point.triangle_unit_circle_relative(
-                angle, self.pos, point_angle_0)
-            ray_points.append(ray_point)
-
-        return ray_points
+        half_width = self.width / 2
+        half_height = self.height / 2
+        return PointArray(np.array([
+            (self.pos.x - half_width, self.pos.y - half_height),
+            (self.pos.x + half_width, self.pos.y - half_height),
+            (self.pos.x + half_width, self.pos.y + half_height),
+            (self.pos.x - half_width, self.pos.y + half_height),
+        ]))
 
     def reduce_wall_edges(self, walls):
         """
@@ -264,65 +269,22 @@ class Player(pygame.sprite.Sprite):
                 list of closest wall edges
         """
 
-        walls_lines = [[[wall.get_abs_vertices()[i % 4], wall.get_abs_vertices()[
-            (i + 1) % 4]] for i in range(4)] for wall in walls]
-
         # get only closer parallel wall edge, reduces computation by half
         proper_walls_lines = []
-        for wall_lines in walls_lines:
-            if self.pos.distance(wall_lines[0][0] + (wall_lines[0][1] - wall_lines[0][0]) / 2) < self.pos.distance(wall_lines[2][0] + (wall_lines[2][1] - wall_lines[2][0]) / 2):
+        for wall in walls:
+            wall_lines = wall.get_edges()
+            midpoints = wall.get_edges_midpoints()
+            if self.pos.distance(midpoints[0]) < self.pos.distance(midpoints[2]):
                 proper_walls_lines.append(wall_lines[0])
             else:
                 proper_walls_lines.append(wall_lines[2])
 
-            if self.pos.distance(wall_lines[1][0] + (wall_lines[1][1] - wall_lines[1][0]) / 2) < self.pos.distance(wall_lines[3][0] + (wall_lines[3][1] - wall_lines[3][0]) / 2):
+            if self.pos.distance(midpoints[1]) < self.pos.distance(midpoints[3]):
                 proper_walls_lines.append(wall_lines[1])
             else:
                 proper_walls_lines.append(wall_lines[3])
         return proper_walls_lines
 
-    def _find_intersections(self, wall_edges):
-        """
-        Algorithm which looks for new Ray Points, which are closer to the Agent Center than radius-distance Ray Points
-
-        Parameters
-        ----------
-            wall_edges : list of [Point, Point]
-                list of Wall Edges in Agent Local Environment
-
-        Returns
-        -------
-            temp_ray_points : list of Point
-                list of new Ray Points
-        """
-
-        edges_bounding_boxes = [
-            {
-                'center': (edge[0] + edge[1]) / 2,
-                'size': (abs(edge[1].x - edge[0].x), abs(edge[1].y - edge[0].y))
-            } for edge in wall_edges
-        ]
-
-        temp_ray_points = [Point(self.rect.center)]
-        for vertex in self.ray_points:
-            # first must be the center point
-            line_segment = [self.pos.round(4), vertex.round(4)]
-            new_point = copy.deepcopy(vertex.round(4))
-            new_point_dist = self.pos.distance(new_point)
-            bounding_box = {
-                'center': (line_segment[0] + line_segment[1]) / 2,
-                'size': (abs(line_segment[1].x - line_segment[0].x), abs(line_segment[1].y - line_segment[0].y))
-            }
-            for edge, edge_bounding_box in zip(wall_edges, edges_bounding_boxes):
-                if not Collision.aabb(bounding_box['center'], bounding_box['size'], edge_bounding_box['center'], edge_bounding_box['size']):
-                    continue
-                p = Collision.line_intersection(line_segment, edge)
-                if p and self.pos.distance(p) <= new_point_dist:
-                    new_point = p
-                    new_point_dist = self.pos.distance(p)
-            temp_ray_points.append(new_point)
-        return temp_ray_points
-
     def update_vision(self, local_env):
         """
         Updates Agent Vision
@@ -341,39 +303,25 @@ class Player(pygame.sprite.Sprite):
             self.direction, side_size=self.vision_radius)
         self.vision_top = self.pos + new_point
 
-        wall_edges = self.reduce_wall_edges(local_env['walls'])
-        self.ray_points = self._determine_new_ray_points(
-            wall_edges)
-
         # without center
-        self.ray_points = self._find_intersections(wall_edges)[1:]
+        wall_edges = self.reduce_wall_edges(local_env['walls'])
+        self.ray_points = Collision.visibility_polygon(
+            self.pos, self.vision_radius, self.direction - self.vision_rad / 2, self.vision_rad, wall_edges)
 
         # creates triangles
         self.ray_objects = [[self.pos, self.ray_points[i], self.ray_points[i + 1]]
                             for i in range(len(self.ray_points) - 1) if self.ray_points[i] != self.ray_points[i + 1]]
 
         # adds Agent Rectangle to Agent Ray Objects
-        self.ray_objects.append([
-            Point((self.rect.topleft)),
-            Point((self.rect.topright)),
-            Point((self.rect.bottomright)),
-            Point((self.rect.bottomleft)),
-        ])
+        self.ray_objects.append(self.get_rect_vertices())
 
     def reset(self):
-        self.pos = copy.deepcopy(self.pos_init)
+        self.pos = self.pos_init.copy()
         self.wall_timer = copy.deepcopy(self.wall_timer_init)
         self.vision_top = None
         self.ray_objects = None
         self.direction = 0
-
-        surface = pygame.Surface((self.width, self.height))
-        surface.set_colorkey((0, 0, 0))
-
         self.image_index = 0
-        self.image = surface
-        self.rect = self.image.get_rect()
-        self.rect.center = (self.pos.x, self.pos.y)
 
 class Hiding(Player):
     """
@@ -413,13 +361,11 @@ class Hiding(Player):
             POV angle in radians (Z = 2 * PI)
         image_index : int
             determines which image should be drawn
-        images : list of pygame.Surface
-            objects with sprite/images from which the proper one will be drawn
-        image : pygame.Surface
-            object with sprite/image, chosen by 'image_index'
-        rect : pygame.Rect
-            object Rectangle, to be drawn
-        polygon_points : list of tuples
+        sprites : list of pygame.Surface
+            objects with sprite/images from which the proper one will be drawn, loaded on first access
+        sprites_count : int
+            number of sprite/images, known without loading them
+        polygon_points : PointArray
             Agent vertices, used for collision check in SAT
         actions : list of dict
             contains all possible Player actions
@@ -434,6 +380,8 @@ class Hiding(Player):
             rotates the object, accordingly to the value, along its axis
         get_abs_vertices():
             returns absolute vertices coordinates (in game screen coordinates system)
+        get_rect_vertices():
+            returns absolute Player Rectangle vertices coordinates
         _move_action(new_pos):
             algorithm which moves the Player object to given poisition
         update_vision(local_env):
@@ -514,13 +462,11 @@ class Seeker(Player):
             POV angle in radians (Z = 2 * PI)
         image_index : int
             determines which image should be drawn
-        images : list of pygame.Surface
-            objects with sprite/images from which the proper one will be drawn
-        image : pygame.Surface
-            object with sprite/image, chosen by 'image_index'
-        rect : pygame.Rect
-            object Rectangle, to be drawn
-        polygon_points : list of tuples
+        sprites : list of pygame.Surface
+            objects with sprite/images from which the proper one will be drawn, loaded on first access
+        sprites_count : int
+            number of sprite/images, known without loading them
+        polygon_points : PointArray
             Agent vertices, used for collision check in SAT
         actions : list of dict
             contains all possible Player actions
@@ -531,6 +477,8 @@ class Seeker(Player):
             rotates the object, accordingly to the value, along its axis
         get_abs_vertices():
             returns absolute vertices coordinates (in game screen coordinates system)
+        get_rect_vertices():
+            returns absolute Player Rectangle vertices coordinates
         _move_action(new_pos):
             algorithm which moves the Player object to given poisition
         update_vision(local_env):
@@ -1 +1,3 @@
 from game_env.hidenseek_gym.envs.hidenseek_env import HideNSeekEnv
+from game_env.hidenseek_gym.envs.hidenseek_vec_env import HideNSeekVecEnv
+from game_env.hidenseek_gym.envs.hidenseek_subproc_env import HideNSeekSubprocVecEnv
@@ -1,7 +1,7 @@
 import gym
 from gym import error, spaces, utils
 from gym.utils import seeding
-from gym.spaces.utils import flatten_space, flatten
+from gym.spaces.utils import flatten_space
 
 import pygame
 import math
@@ -13,36 +13,38 @@ import numpy as np
 
 from game_env.hidenseek_gym.controllable import Hiding, Seeker
 from game_env.hidenseek_gym.fixed import Wall
-from game_env.hidenseek_gym.supportive import Point, Collision
+from game_env.hidenseek_gym.supportive import Point, Collision, FrameCounter, SpatialHash, ObservationEncoder
 
 
 class HideNSeekEnv(gym.Env):
     metadata = {'render.modes': ['human', 'rgb_array', 'console']}
 
-    def __init__(self, config, width, height, seeker, hiding, walls):
+    def __init__(self, config, width, height, seeker, hiding, walls, walls_index=None):
         self.default_cfg = config
 
         self.map_path = config['game']['map']
         self.fps = config['game']['fps']
-        self.clock = pygame.time.Clock()
+        # frame limiter only if game should be played in real time, otherwise just count simulation throughput
+        self.realtime = config['game']['realtime']
+        self.clock = pygame.time.Clock() if self.realtime else FrameCounter()
         self.screen = None
 
-        self.dt = self.clock.tick_busy_loop(self.fps)
+        self.dt = self._tick()
         self.cfg = config['game']
         self.duration = config['game']['duration']
 
         self.width = width
         self.height = height
 
-        self.walls_group = pygame.sprite.Group()
         self.env_walls = walls
-        self.walls_group.add(walls)
+        self.walls_group = list(walls)
 
         self.player_seek = seeker
         self.player_hide = hiding
-        self.players_group = pygame.sprite.Group()
-        self.players_group.add(self.player_seek)
-        self.players_group.add(self.player_hide)
+
+        # spatial index of walls_group, so only walls near the Agent are checked
+        self.walls_index = walls_index if walls_index is not None else SpatialHash(
+            max(seeker.vision_radius, hiding.vision_radius), walls)
 
         self.p_hide_cfg = config['hiding']
         self.p_seek_cfg = config['seeker']
@@ -57,7 +59,50 @@ class HideNSeekEnv(gym.Env):
         5 - SPECIAL (ADD/DELETE WALL)
         '''
 
-        self.observation_space_n = [
+        self.observation_space_n = HideNSeekEnv._create_observation_space_n()
+
+        self.flatten_observation_space_n = [flatten_space(
+            space) for space in self.observation_space_n]
+        # writes flat observations without building nested dicts
+        self.obs_encoder_n = [ObservationEncoder(
+            space, width, height) for space in self.observation_space_n]
+
+        # preallocated arrays (e.g. shared memory) observations are written to, see `set_observation_buffers`
+        self.obs_buffer_n = None
+
+    def set_observation_buffers(self, obs_buffer_n):
+        """
+        Makes every observation to be written into given arrays instead of new ones;
+        returned observations are these arrays, overwritten by the next step or reset
+
+        Parameters
+        ----------
+            obs_buffer_n : list of np.array or None
+                Seeker buffer, shape (9, ) & Hiding buffer, shape (10, ); None brings back new arrays for every observation
+
+        Returns
+        -------
+            None
+        """
+
+        self.obs_buffer_n = obs_buffer_n
+
+    @staticmethod
+    def _create_observation_space_n():
+        """
+        Creates observation spaces for both Agents, Seeker first
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            observation_space_n : list of gym.spaces.Dict
+                Seeker & Hiding observation spaces
+        """
+
+        return [
             spaces.Dict({
                 'agent': spaces.Dict({
                     # position, assuming width=height
@@ -99,17 +144,16 @@ class HideNSeekEnv(gym.Env):
                 }),
             }),
         ]
-        
-        self.flatten_observation_space_n = [flatten_space(
-            space) for space in self.observation_space_n]
 
     def reset(self):
         self.duration = self.cfg['duration']
         self.screen = None
         self.agent_env = {}
 
-        self.walls_group = pygame.sprite.Group()
-        self.walls_group.add(self.env_walls)
+        for wall in self.walls_group:
+            if wall.owner:
+                self.walls_index.remove(wall)
+        self.walls_group = list(self.env_walls)
 
         self.player_seek.reset()
         self.player_hide.reset()
@@ -122,15 +166,44 @@ class HideNSeekEnv(gym.Env):
         self.player_seek.update_vision(self.agent_env['p_seek'])
         self.player_hide.update_vision(self.agent_env['p_hide'])
 
-        self.players_group = pygame.sprite.Group()
-        self.players_group.add(self.player_seek)
-        self.players_group.add(self.player_hide)
-
         return [
             self._get_agent_obs(self.player_seek, self.agent_env['p_seek']),
             self._get_agent_obs(self.player_hide, self.agent_env['p_hide'])
         ]
 
+    def _tick(self):
+        """
+        Registers new frame, waits (busy loop) only in realtime mode to keep FPS limit
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            dt : int
+                milliseconds since previous frame
+        """
+
+        if self.realtime:
+            return self.clock.tick_busy_loop(self.fps)
+        return self.clock.tick()
+
+    def get_fps(self):
+        """
+        Returns current FPS; in realtime mode it's capped by config, otherwise it's real simulation throughput
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            fps : float
+        """
+
+        return self.clock.get_fps()
+
     def game_over(self):
         if self.duration <= 0:
             return True, "HIDING"
@@ -169,7 +242,7 @@ class HideNSeekEnv(gym.Env):
 
     def _add_wall(self):
         if self.player_hide.walls_counter < self.player_hide.walls_max and not self.player_hide.wall_timer:
-            wall_pos = copy.deepcopy(self.player_hide.pos)
+            wall_pos = self.player_hide.pos.copy()
             wall_size = (max(int(self.player_hide.width / 10), 2),
                          max(int(self.player_hide.height / 2), 2))  # minimum 2x2 Wall
             vision_arc_range = np.sqrt((self.player_hide.vision_top.x - self.player_hide.pos.x) * (self.player_hide.vision_top.x - self.player_hide.pos.x) + (
@@ -185,7 +258,8 @@ class HideNSeekEnv(gym.Env):
             wall._rotate(self.player_hide.direction, wall_pos)
             if self._can_create_wall(wall, self.agent_env['p_hide']['enemy']):
                 self.player_hide.walls_counter += 1
-                self.walls_group.add(wall)
+                self.walls_group.append(wall)
+                self.walls_index.add(wall)
                 self.player_hide.wall_timer = copy.deepcopy(
                     self.player_hide.wall_timer_init)
                 return True
@@ -202,6 +276,7 @@ class HideNSeekEnv(gym.Env):
             if delete_wall.owner:
                 delete_wall.owner.walls_counter -= 1
                 self.walls_group.remove(delete_wall)
+                self.walls_index.remove(delete_wall)
                 del delete_wall
                 return True
 
@@ -213,13 +288,17 @@ class HideNSeekEnv(gym.Env):
         # for negative it's 0, for positive - higher than 0, needed if time-based cooldown (i.e. 5s) instead of frame-based (i.e. 500 frames)
         agent.wall_timer = max(agent.wall_timer, 0)
 
+    def _get_walls_near(self, agent):
+        # bounding box of the vision square rotated by any angle is at most radius * sqrt(2) from the center
+        return self.walls_index.query_radius(agent.pos, agent.vision_radius * math.sqrt(2))
+
     def _calc_local_env(self):
         self.agent_env['p_seek'] = {
-            'walls': Collision.get_objects_in_local_env(self.walls_group, self.player_seek.pos, self.player_seek.vision_radius, self.player_seek.direction, self.player_seek.ray_objects),
+            'walls': Collision.get_objects_in_local_env(self._get_walls_near(self.player_seek), self.player_seek.pos, self.player_seek.vision_radius, self.player_seek.direction, self.player_seek.ray_objects),
             'enemy': self.player_hide if Collision.get_objects_in_local_env([self.player_hide], self.player_seek.pos, self.player_seek.vision_radius, self.player_seek.direction, self.player_seek.ray_objects) else None,
         }
         self.agent_env['p_hide'] = {
-            'walls': Collision.get_objects_in_local_env(self.walls_group, self.player_hide.pos, self.player_hide.vision_radius, self.player_hide.direction, self.player_hide.ray_objects),
+            'walls': Collision.get_objects_in_local_env(self._get_walls_near(self.player_hide), self.player_hide.pos, self.player_hide.vision_radius, self.player_hide.direction, self.player_hide.ray_objects),
             'enemy': self.player_seek if Collision.get_objects_in_local_env([self.player_seek], self.player_hide.pos, self.player_hide.vision_radius, self.player_hide.direction, self.player_hide.ray_objects) else None,
         }
 
@@ -232,53 +311,22 @@ class HideNSeekEnv(gym.Env):
         #     'owner': 1 if wall.owner else 0,
         # } for wall in local_env['walls']]
 
-        next_obs = {
-            'agent': {
-                'position': np.array([
-                    (agent.pos.x - self.width / 2) / (self.width / 2), 
-                    (agent.pos.y - self.height / 2) / (self.height / 2), 
-                    ]),
-                'direction': np.array(agent.direction / (2*math.pi)),
-                'action_cooldown': np.array(agent.wall_timer / agent.wall_timer_init),
-            },
-            # 'walls': {
-            #     'positions': tuple(wall_data['position'] for wall_data in walls_data),
-            #     'sizes': tuple(wall_data['size'] for wall_data in walls_data),
-            #     'directions': tuple(wall_data['direction'] for wall_data in walls_data),
-            #     'distances': tuple(wall_data['distance'] for wall_data in walls_data),
-            #     'owners': tuple(wall_data['owner'] for wall_data in walls_data),
-            # },
-        }
-
+        # flat observation is written straight into buffer, layout of `flatten(observation_space, dict_obs)`
         if isinstance(agent, Hiding):
-            next_obs['agent']['walls_available'] = np.array((agent.walls_max - agent.walls_counter) / agent.walls_max)
-            next_obs['enemy'] = {
-                'position': np.array([
-                    (self.player_seek.pos.x - self.width / 2) / (self.width / 2), 
-                    (self.player_seek.pos.y - self.height / 2) / (self.height / 2), 
-                    ]),
-                'direction': np.array(self.player_seek.direction / (2*math.pi)),
-                'distance': np.array([
-                    (self.player_seek.pos.x - agent.pos.x) / (self.width / 2),
-                    (self.player_seek.pos.y - agent.pos.y) / (self.height / 2),
-                ])
-            }
-            next_obs = flatten(self.observation_space_n[1], next_obs)
+            j, enemy = 1, self.player_seek
+            walls_available = (agent.walls_max - agent.walls_counter) / agent.walls_max
         else:
-            next_obs['enemy'] = {
-                'position': np.array([
-                    (self.player_hide.pos.x - self.width / 2) / (self.width / 2), 
-                    (self.player_hide.pos.y - self.height / 2) / (self.height / 2), 
-                    ]),
-                'direction': np.array(self.player_hide.direction / (2*math.pi)),
-                'distance': np.array([
-                    (self.player_hide.pos.x - agent.pos.x) / (self.width / 2),
-                    (self.player_hide.pos.y - agent.pos.y) / (self.height / 2),
-                ])
-            }
-            next_obs = flatten(self.observation_space_n[0], next_obs)
-
-        return next_obs
+            j, enemy = 0, self.player_hide
+            walls_available = None
+        encoder = self.obs_encoder_n[j]
+        out = self.obs_buffer_n[j] if self.obs_buffer_n is not None else encoder.empty()
+
+        return encoder.encode(
+            out,
+            agent.pos.x, agent.pos.y, agent.direction, agent.wall_timer / agent.wall_timer_init,
+            enemy.pos.x, enemy.pos.y, enemy.direction,
+            walls_available=walls_available,
+        )
 
     def _rotate_agent(self, agent, turn):
         """
@@ -328,7 +376,7 @@ class HideNSeekEnv(gym.Env):
             # (1 - 1.5) * 2 = -1, so for Forward it needs to be * (-1)
             y = math.sin(agent.direction) * agent.speed * \
                 (action - 1.5) * 2 * (-1)
-            old_pos = copy.deepcopy(agent.pos)
+            old_pos = agent.pos.copy()
             new_pos = agent.pos + Point((x, y))
 
             self._move_agent(agent, new_pos)
@@ -367,25 +415,23 @@ class HideNSeekEnv(gym.Env):
             None
         """
 
-        old_pos = copy.deepcopy(agent.pos)
+        old_pos = agent.pos.copy()
         agent.pos = new_pos
 
+        # only sprite index is updated, sprites are used (and loaded) only when rendering
         if old_pos != agent.pos:  # if moving
-            agent.image_index = (agent.image_index + 1) % len(agent.sprites)
+            agent.image_index = (agent.image_index + 1) % agent.sprites_count
             if not agent.image_index:
                 agent.image_index += 1
-            agent.rect.center = (agent.pos.x, agent.pos.y)
         else:  # if not moving
             agent.image_index = 0
 
-        agent.image = agent.sprites[agent.image_index]
-
     def step(self, action_n):
         obs_n = list()
         reward_n = list()
         info_n = {'n': []}
 
-        self.dt = self.clock.tick_busy_loop(self.fps)
+        self.dt = self._tick()
 
         self._reduce_agent_cooldown(self.player_seek)
         self._reduce_agent_cooldown(self.player_hide)
@@ -487,9 +533,6 @@ class HideNSeekEnv(gym.Env):
         copied_sprite_rect.center = (agent.pos.x, agent.pos.y)
         screen.blit(copied_sprite, copied_sprite_rect)
 
-        agent.image = pygame.Surface((agent.width, agent.height))
-        agent.image.set_colorkey((0, 0, 0))
-
     def render(self, mode='human', close=False):
         """
         Renders game based on the mode. Raises Exception if unexpected render mode.
@@ -518,7 +561,8 @@ class HideNSeekEnv(gym.Env):
 
             self.screen.fill((0, 0, 0))
             if self.walls_group:
-                self.walls_group.draw(self.screen)
+                # pygame sprites are created only here, simulation doesn't need them
+                pygame.sprite.Group([wall.get_sprite() for wall in self.walls_group]).draw(self.screen)
 
             if self.player_hide and self.player_seek:
                 if self.default_cfg['video']['draw_pov']:
@@ -527,9 +571,6 @@ class HideNSeekEnv(gym.Env):
                 self._draw_agent(self.player_hide, self.screen)
                 self._draw_agent(self.player_seek, self.screen)
 
-            if self.players_group:
-                self.players_group.draw(self.screen)
-
             pygame.display.update()
             img = self._get_state()
             return img
@@ -0,0 +1,395 @@
+import gym
+from gym import spaces
+
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing.connection import wait
+import random
+import time
+import numpy as np
+
+from game_env.hidenseek_gym.envs.hidenseek_env import HideNSeekEnv
+from game_env.hidenseek_gym.supportive import FrameCounter
+
+
+# commands sent to workers as one byte, workers answer with one byte when results are in shared memory
+STEP, RESET, RENDER, CLOSE = 1, 2, 3, 4
+DONE = b'\x00'
+# winners are stored as codes, so nothing has to be pickled
+WINNERS = (None, 'SEEKER', 'HIDING')
+
+
+def _shared_layout(shapes, alignment=64):
+    """
+    Computes where every array is placed in one shared memory block
+
+    Parameters
+    ----------
+        shapes : dict
+            name -> (shape, dtype) of every array
+        alignment : int, default=64
+            every array starts at multiple of alignment (cache line)
+
+    Returns
+    -------
+        offsets : dict
+            name -> offset (in bytes) of every array
+        size : int
+            size of the whole block (in bytes)
+    """
+
+    offsets, size = {}, 0
+    for name, (shape, dtype) in shapes.items():
+        offsets[name] = size
+        size += int(np.prod(shape)) * np.dtype(dtype).itemsize
+        size = -(-size // alignment) * alignment
+
+    return offsets, max(size, alignment)
+
+
+def _shared_views(buffer, shapes, offsets):
+    """
+    NumPy views of arrays in shared memory block, no data is copied
+
+    Parameters
+    ----------
+        buffer : memoryview
+            shared memory block
+        shapes : dict
+            name -> (shape, dtype) of every array
+        offsets : dict
+            name -> offset (in bytes) of every array
+
+    Returns
+    -------
+        arrays : dict
+            name -> np.array backed by shared memory
+    """
+
+    return {name: np.ndarray(shape, dtype=dtype, buffer=buffer, offset=offsets[name])
+            for name, (shape, dtype) in shapes.items()}
+
+
+def _worker(index, remote, parent_remote, env_fn, memory, shapes, offsets):
+    """
+    Worker process loop, steps one HideNSeekEnv. Command byte is received through the pipe, actions are read
+    from shared memory, observations, rewards, dones & winner are written there (HideNSeekEnv writes observations
+    straight into shared rows) and one byte is sent back. Rendered frames are the only data sent through the pipe.
+    Worker which fails just exits, parent notices it by process sentinel
+
+    Parameters
+    ----------
+        index : int
+            worker index, row of shared arrays owned by this worker
+        remote : multiprocessing.connection.Connection
+            worker end of the pipe
+        parent_remote : multiprocessing.connection.Connection
+            parent end of the pipe, closed in worker
+        env_fn : callable
+            creates HideNSeekEnv
+        memory : multiprocessing.shared_memory.SharedMemory
+            shared block with every array
+        shapes : dict
+            name -> (shape, dtype) of every shared array
+        offsets : dict
+            name -> offset of every shared array
+
+    Returns
+    -------
+        None
+    """
+
+    parent_remote.close()
+    # forked workers inherit parent random state, every one should play its own game
+    random.seed()
+    np.random.seed()
+
+    arrays = _shared_views(memory.buf, shapes, offsets)
+    obs_n = [arrays[f'obs_{j}'][index] for j in range(len(WINNERS) - 1)]
+    terminal_obs_n = [arrays[f'terminal_obs_{j}'][index] for j in range(len(WINNERS) - 1)]
+
+    try:
+        env = env_fn()
+        env.unwrapped.set_observation_buffers(obs_n)
+
+        while True:
+            command = remote.recv_bytes()[0]
+            if command == STEP:
+                _, reward_n, done, _ = env.step(arrays['actions'][index].tolist())
+                arrays['rewards'][index] = reward_n
+                arrays['dones'][index] = done[0]
+                arrays['winners'][index] = WINNERS.index(done[1])
+                if done[0]:
+                    for obs, terminal_obs in zip(obs_n, terminal_obs_n):
+                        terminal_obs[:] = obs
+                    env.reset()
+                remote.send_bytes(DONE)
+            elif command == RESET:
+                env.reset()
+                remote.send_bytes(DONE)
+            elif command == RENDER:
+                remote.send(env.render('rgb_array'))
+            elif command == CLOSE:
+                env.close()
+                break
+            else:
+                raise NotImplementedError(f"Unknown worker command `{command}`")
+    except EOFError:
+        pass  # parent is gone
+    finally:
+        remote.close()
+        del arrays, obs_n, terminal_obs_n
+
+
+class HideNSeekSubprocVecEnv(gym.Env):
+    """
+    Vectorized Hide'n'Seek Environment, steps N HideNSeekEnv games, every one in its own worker process.
+    Actions, observations, rewards, dones & winners live in one `multiprocessing.shared_memory` block:
+    workers write observations straight into their rows, every worker is synchronized by one command byte
+    & one answer byte in its own pipe, nothing is pickled while stepping. Parent waits on pipes together with
+    process sentinels, so worker which has died (even killed by a signal) raises exception instead of hanging.
+    Returned observations, rewards & dones are zero-copy views of shared memory, valid until the next `step`
+    or `reset` (copy them to keep them longer).
+    Same interface as HideNSeekVecEnv, finished games are reset automatically, their last observations are in `info`.
+
+    Attributes
+    ----------
+        num_envs : int
+            number of games (worker processes) stepped at once
+        actions : np.array of int, shape (N, 2)
+            shared actions, Seeker first
+        rewards : np.array, shape (N, 2)
+            shared rewards, Seeker first
+        dones : np.array of bool, shape (N, )
+            shared game over flags
+        winners : np.array of int, shape (N, )
+            shared winner codes, indices of WINNERS
+        obs_n : list of np.array
+            shared Seeker observations, shape (N, 9) & Hiding observations, shape (N, 10)
+        terminal_obs_n : list of np.array
+            shared observations before reset, same format as obs_n; valid only for finished games
+
+    Methods
+    -------
+        reset():
+            resets all games, returns observations
+        step(action_n):
+            performs actions in all games, returns observations, rewards, dones & info
+        render(mode='rgb_array', index=0):
+            renders one of the games
+        get_fps():
+            returns frames per second summed over all games
+        close():
+            stops worker processes, frees shared memory
+    """
+
+    metadata = {'render.modes': ['rgb_array', 'console']}
+
+    def __init__(self, env_fns, context=None, timeout=None):
+        """
+        Constructs all neccesary attributes for the Subprocess Vectorized Environment and starts worker processes
+
+        Parameters
+        ----------
+            env_fns : list of callable
+                every callable creates one HideNSeekEnv, called in worker process
+            context : multiprocessing context, optional
+                context used to create processes & synchronization, 'fork' by default (env_fns don't need to be picklable);
+                inside Celery task it should be `billiard` context, as Celery workers can't have `multiprocessing` children
+            timeout : float, optional
+                maximal time (in seconds) of waiting for workers, no limit by default;
+                dead workers are detected anyway
+        """
+
+        self.num_envs = len(env_fns)
+        self.context = context if context is not None else multiprocessing.get_context('fork')
+        self.timeout = timeout
+        self.closed = False
+
+        self.action_space = spaces.Discrete(6)  # for both agents, see HideNSeekEnv
+        self.observation_space_n = HideNSeekEnv._create_observation_space_n()
+        self.flatten_observation_space_n = [gym.spaces.utils.flatten_space(
+            space) for space in self.observation_space_n]
+
+        shapes = {
+            'actions': ((self.num_envs, 2), np.int64),
+            'rewards': ((self.num_envs, 2), np.float64),
+            'dones': ((self.num_envs, ), np.bool_),
+            'winners': ((self.num_envs, ), np.int8),
+        }
+        for j, space in enumerate(self.flatten_observation_space_n):
+            shapes[f'obs_{j}'] = ((self.num_envs, space.shape[0]), np.float32)
+            shapes[f'terminal_obs_{j}'] = ((self.num_envs, space.shape[0]), np.float32)
+
+        offsets, size = _shared_layout(shapes)
+        self.memory = shared_memory.SharedMemory(create=True, size=size)
+        arrays = _shared_views(self.memory.buf, shapes, offsets)
+
+        self.actions = arrays['actions']
+        self.rewards = arrays['rewards']
+        self.dones = arrays['dones']
+        self.winners = arrays['winners']
+        self.obs_n = [arrays[f'obs_{j}'] for j in range(len(self.observation_space_n))]
+        self.terminal_obs_n = [arrays[f'terminal_obs_{j}'] for j in range(len(self.observation_space_n))]
+
+        self.remotes, self.processes = [], []
+        for index, env_fn in enumerate(env_fns):
+            remote, worker_remote = self.context.Pipe()
+            process = self.context.Process(
+                target=_worker,
+                args=(index, worker_remote, remote, env_fn, self.memory, shapes, offsets),
+                daemon=True,
+            )
+            process.start()
+            worker_remote.close()
+            self.remotes.append(remote)
+            self.processes.append(process)
+
+        self.clock = FrameCounter()
+
+    def _send(self, command, indices):
+        """
+        Sends command byte to given workers
+
+        Parameters
+        ----------
+            command : int
+                one of STEP, RESET, RENDER, CLOSE
+            indices : list of int
+                workers which should run the command
+
+        Returns
+        -------
+            None
+        """
+
+        try:
+            for index in indices:
+                self.remotes[index].send_bytes(bytes([command]))
+        except OSError:  # i.e. BrokenPipeError
+            raise Exception("Worker process of HideNSeekSubprocVecEnv has failed or didn't respond in time")
+
+    def _receive(self, indices, receive=lambda remote: remote.recv_bytes()):
+        """
+        Waits for answers of given workers, together with their process sentinels, so worker which has died
+        (i.e. killed by OOM killer) is noticed immediately, and with timeout for the ones which are stuck
+
+        Parameters
+        ----------
+            indices : list of int
+                workers which answers are awaited
+            receive : callable, default reads one message as bytes
+                reads answer from the pipe
+
+        Returns
+        -------
+            answers : dict
+                worker index -> answer
+        """
+
+        pending = {self.remotes[index]: index for index in indices}
+        deadline = time.monotonic() + self.timeout if self.timeout is not None else None
+        answers = {}
+        try:
+            while pending:
+                sentinels = {self.processes[index].sentinel: index for index in pending.values()}
+                timeout = max(deadline - time.monotonic(), 0) if deadline is not None else None
+                ready = wait(list(pending) + list(sentinels), timeout)
+                if not ready:
+                    raise TimeoutError
+                # answer sent right before worker's death is still read
+                for remote in [remote for remote in ready if remote in pending]:
+                    answers[pending.pop(remote)] = receive(remote)
+                if any(sentinels.get(sentinel) in pending.values() for sentinel in ready):
+                    raise EOFError  # worker has died without answer
+        except (EOFError, OSError):  # incl. TimeoutError
+            raise Exception("Worker process of HideNSeekSubprocVecEnv has failed or didn't respond in time")
+
+        return answers
+
+    def _run(self, command):
+        indices = range(self.num_envs)
+        self._send(command, indices)
+        self._receive(indices)
+
+    def reset(self):
+        self._run(RESET)
+        return self.obs_n
+
+    def step(self, action_n):
+        """
+        Performs one frame in every game, in parallel. Finished games are reset automatically.
+
+        Parameters
+        ----------
+            action_n : np.array of int, shape (N, 2)
+                actions for every game, Seeker first
+
+        Returns
+        -------
+            obs_n : list of np.array
+                Seeker observations, shape (N, 9) & Hiding observations, shape (N, 10); views of shared memory
+            reward_n : np.array, shape (N, 2)
+                rewards, Seeker first; view of shared memory
+            done : np.array of bool, shape (N, )
+                which games have finished in this frame; view of shared memory
+            info : dict
+                'winner' - np.array of str/None, shape (N, ), 'SEEKER' or 'HIDING' for finished games
+                'terminal_obs_n' - observations before reset, same format as obs_n; views of shared memory
+        """
+
+        self.actions[:] = np.asarray(action_n, dtype=np.int64).reshape(self.num_envs, 2)
+        self._run(STEP)
+        self.clock.tick()
+
+        info = {'winner': np.array(WINNERS, dtype=object)[self.winners], 'terminal_obs_n': self.terminal_obs_n}
+
+        return self.obs_n, self.rewards, self.dones, info
+
+    def render(self, mode='rgb_array', index=0):
+        if mode == 'console':
+            pass
+        elif mode == 'rgb_array':
+            self._send(RENDER, [index])
+            return self._receive([index], receive=lambda remote: remote.recv())[index]
+        else:
+            raise Exception(
+                "Unexpected render mode, available: 'rgb_array', 'console'")
+
+    def get_fps(self):
+        """
+        Returns simulation throughput, frames per second summed over all games
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            fps : float
+        """
+
+        return self.clock.get_fps() * self.num_envs
+
+    def close(self):
+        if self.closed:
+            return
+
+        for remote in self.remotes:
+            try:
+                remote.send_bytes(bytes([CLOSE]))
+            except OSError:
+                pass  # worker is gone already
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        for remote in self.remotes:
+            remote.close()
+
+        # views have to be released before shared memory is closed
+        self.actions = self.rewards = self.dones = self.winners = None
+        self.obs_n = self.terminal_obs_n = None
+        self.memory.close()
+        self.memory.unlink()
+        self.closed = True
@@ -0,0 +1,560 @@
+import gym
+from gym import spaces
+from gym.utils import seeding
+from gym.spaces.utils import flatten_space
+
+import math
+import numpy as np
+
+from game_env.hidenseek_gym.envs.hidenseek_env import HideNSeekEnv
+from game_env.hidenseek_gym.supportive import Collision, ObservationEncoder
+
+
+SEEKER = 0
+HIDING = 1
+VISION_RAYS = 11
+
+
+class HideNSeekVecEnv(gym.Env):
+    """
+    Vectorized Hide'n'Seek Environment, steps N games at once. Whole state is stored as
+    struct-of-arrays (agents positions, directions, cooldowns, walls), so one step call
+    advances every game by using NumPy operations instead of per-object Python code.
+    Finished games are reset automatically, their last observations are in `info`.
+    Used only through its Gym registration (`hidenseek-vec-v1`), training runs on HideNSeekSubprocVecEnv.
+
+    Differences from the HideNSeekEnv:
+        > Agent Local Environment doesn't take occlusion into account, every Wall overlapping
+          Agent vision arc (or Agent itself) is in Local Environment
+        > Movement collision is checked against every Wall on the map
+        > no rendering
+
+    Attributes
+    ----------
+        num_envs : int
+            number of games stepped at once
+        pos : np.array, shape (N, 2, 2)
+            agents positions, Seeker first
+        direction : np.array, shape (N, 2)
+            agents directions in radians
+        wall_timer : np.array, shape (N, 2)
+            agents cooldowns (in frames) for any wall-specific action
+        duration : np.array, shape (N, )
+            frames left in every game
+        walls_vertices : np.array, shape (N, W + M, 4, 2)
+            map walls (first W) and walls created by Hiding Agent (last M slots)
+        walls_active : np.array of bool, shape (N, W + M)
+            which walls exist in the game
+        walls_visible : np.array of bool, shape (N, 2, W + M)
+            walls in agents Local Environment
+        enemy_visible : np.array of bool, shape (N, 2)
+            if enemy is in agents Local Environment
+
+    Methods
+    -------
+        reset():
+            resets all games, returns observations
+        step(action_n):
+            performs actions in all games, returns observations, rewards, dones & info
+    """
+
+    metadata = {'render.modes': ['console']}
+
+    def __init__(self, config, width, height, seeker, hiding, walls, num_envs=1):
+        """
+        Constructs all neccesary attributes for the Vectorized Environment
+
+        Parameters
+        ----------
+            config : dict
+                game config
+            width : int
+                map width
+            height : int
+                map height
+            seeker : hidenseek_gym.controllable.Seeker
+                Seeker template, used to get its size, speed & initial position
+            hiding : hidenseek_gym.controllable.Hiding
+                Hiding template, used to get its size, speed & initial position
+            walls : list of hidenseek_gym.fixed.Wall
+                map walls
+            num_envs : int
+                number of games stepped at once
+        """
+
+        self.default_cfg = config
+        self.cfg = config['game']
+        self.num_envs = num_envs
+
+        self.width = width
+        self.height = height
+
+        self.action_space = spaces.Discrete(6)  # for both agents, see HideNSeekEnv
+        self.observation_space_n = HideNSeekEnv._create_observation_space_n()
+        self.flatten_observation_space_n = [flatten_space(
+            space) for space in self.observation_space_n]
+        self.obs_encoder_n = [ObservationEncoder(
+            space, width, height) for space in self.observation_space_n]
+
+        agents = [seeker, hiding]
+        self.agent_size = np.array(
+            [[agent.width, agent.height] for agent in agents], dtype=np.float64)
+        self.pos_init = np.array(
+            [[agent.pos_init.x, agent.pos_init.y] for agent in agents], dtype=np.float64)
+        self.speed = np.array([agent.speed for agent in agents], dtype=np.float64)
+        self.speed_rotate = np.array(
+            [agent.speed_rotate for agent in agents], dtype=np.float64)
+        self.wall_timer_init = np.array(
+            [agent.wall_timer_init for agent in agents], dtype=np.int64)
+        self.vision_radius = np.array(
+            [agent.vision_radius for agent in agents], dtype=np.float64)
+        self.vision_rad = np.array(
+            [agent.vision_rad for agent in agents], dtype=np.float64)
+        # octagon relative to the Agent center
+        self.agent_polygon = np.array([
+            np.asarray(agent.polygon_points) - (agent.width / 2, agent.height / 2)
+            for agent in agents], dtype=np.float64)
+
+        # rewards for every action, indexed by action
+        self.action_rewards = np.array([[
+            config[agent_str]['rewards']['noop'],
+            config[agent_str]['rewards']['move'],
+            config[agent_str]['rewards']['move'],
+            config[agent_str]['rewards']['rotate'],
+            config[agent_str]['rewards']['rotate'],
+            config[agent_str]['rewards']['special'],
+        ] for agent_str in ['seeker', 'hiding']], dtype=np.float64)
+
+        self.walls_max = hiding.walls_max
+        self.hiding_wall_size = (max(int(hiding.width / 10), 2),
+                                 max(int(hiding.height / 2), 2))  # minimum 2x2 Wall
+
+        self.map_walls_count = len(walls)
+        walls_count = self.map_walls_count + self.walls_max
+        self.walls_vertices = np.zeros(
+            (num_envs, walls_count, 4, 2), dtype=np.float64)
+        if walls:
+            self.walls_vertices[:, :self.map_walls_count] = np.array([
+                np.asarray(wall.get_abs_vertices()) for wall in walls], dtype=np.float64)
+        self.walls_active = np.zeros((num_envs, walls_count), dtype=bool)
+        self.walls_aabb_min = self.walls_vertices.min(axis=2)
+        self.walls_aabb_max = self.walls_vertices.max(axis=2)
+
+        self.pos = np.zeros((num_envs, 2, 2), dtype=np.float64)
+        self.direction = np.zeros((num_envs, 2), dtype=np.float64)
+        self.wall_timer = np.zeros((num_envs, 2), dtype=np.int64)
+        self.duration = np.zeros(num_envs, dtype=np.int64)
+        self.walls_visible = np.zeros((num_envs, 2, walls_count), dtype=bool)
+        self.enemy_visible = np.zeros((num_envs, 2), dtype=bool)
+
+        self.np_random = None
+        self.seed()
+
+    def seed(self, seed=None):
+        self.np_random, seed = seeding.np_random(seed)
+        return [seed]
+
+    @property
+    def walls_counter(self):
+        return self.walls_active[:, self.map_walls_count:].sum(axis=1)
+
+    def reset(self):
+        self._reset_envs(np.ones(self.num_envs, dtype=bool))
+        return self._get_obs()
+
+    def _reset_envs(self, mask):
+        """
+        Resets chosen games to its initial state
+
+        Parameters
+        ----------
+            mask : np.array of bool, shape (N, )
+                which games should be reset
+
+        Returns
+        -------
+            None
+        """
+
+        self.duration[mask] = self.cfg['duration']
+        self.pos[mask] = self.pos_init
+        self.direction[mask] = 0
+        self.wall_timer[mask] = self.wall_timer_init
+        self.walls_active[mask, :self.map_walls_count] = True
+        self.walls_active[mask, self.map_walls_count:] = False
+        self._calc_local_env(mask)
+
+    def _agent_vertices(self, agent, pos=None):
+        pos = self.pos[:, agent] if pos is None else pos
+        return pos[:, None, :] + self.agent_polygon[agent]
+
+    def _vision_polygons(self, agent):
+        """
+        Creates Agent POV polygons, without occlusion: triangles of the vision arc and Agent Rectangle.
+        Triangles have duplicated last vertex, so every polygon has 4 vertices
+
+        Parameters
+        ----------
+            agent : int
+                agent index, 0 - Seeker, 1 - Hiding
+
+        Returns
+        -------
+            polygons : np.array, shape (N, VISION_RAYS, 4, 2)
+        """
+
+        pos = self.pos[:, agent]
+        angles = self.direction[:, agent, None] + np.linspace(
+            -self.vision_rad[agent] / 2, self.vision_rad[agent] / 2, num=VISION_RAYS)
+        ray_points = pos[:, None, :] + self.vision_radius[agent] * np.stack(
+            (np.cos(angles), np.sin(angles)), axis=-1)
+
+        triangles = np.stack((
+            np.broadcast_to(pos[:, None, :], ray_points[:, :-1].shape),
+            ray_points[:, :-1],
+            ray_points[:, 1:],
+            ray_points[:, 1:],
+        ), axis=2)
+
+        half_size = self.agent_size[agent] / 2
+        rect = pos[:, None, :] + np.array([
+            [-half_size[0], -half_size[1]],
+            [half_size[0], -half_size[1]],
+            [half_size[0], half_size[1]],
+            [-half_size[0], half_size[1]],
+        ])
+        return np.concatenate((triangles, rect[:, None]), axis=1)
+
+    def _calc_local_env(self, mask):
+        """
+        Calculates which Walls and enemies are in agents Local Environment
+
+        Parameters
+        ----------
+            mask : np.array of bool, shape (N, )
+                which games should be updated
+
+        Returns
+        -------
+            None
+        """
+
+        env_ids = np.nonzero(mask)[0]
+        if not env_ids.size:
+            return
+
+        for agent in [SEEKER, HIDING]:
+            enemy = 1 - agent
+            vision = self._vision_polygons(agent)[env_ids]
+            pos = self.pos[env_ids, agent]
+            radius = self.vision_radius[agent]
+
+            # pre-selection, Walls in vision circle bounding box
+            candidates = self.walls_active[env_ids] \
+                & np.all(self.walls_aabb_min[env_ids] < pos[:, None, :] + radius, axis=-1) \
+                & np.all(self.walls_aabb_max[env_ids] > pos[:, None, :] - radius, axis=-1)
+            idx_env, idx_wall = np.nonzero(candidates)
+            visible = np.zeros_like(candidates)
+            visible[idx_env, idx_wall] = Collision.sat_batch(
+                self.walls_vertices[env_ids[idx_env], idx_wall][:, None],
+                vision[idx_env]).any(axis=-1)
+            self.walls_visible[env_ids, agent] = visible
+
+            enemy_vertices = self._agent_vertices(enemy)[env_ids]
+            self.enemy_visible[env_ids, agent] = Collision.sat_batch(
+                enemy_vertices[:, None], vision).any(axis=-1)
+
+    def _collides_with_walls(self, env_ids, vertices, walls_mask):
+        """
+        Checks if polygons collide with any Wall from the mask
+
+        Parameters
+        ----------
+            env_ids : np.array of int, shape (C, )
+                games in which collision should be checked
+            vertices : np.array, shape (C, k, 2)
+                polygon for every game
+            walls_mask : np.array of bool, shape (C, W + M)
+                walls to check collision with
+
+        Returns
+        -------
+            collide : np.array of bool, shape (C, )
+        """
+
+        candidates = walls_mask \
+            & np.all(self.walls_aabb_min[env_ids] <= vertices.max(axis=1)[:, None, :], axis=-1) \
+            & np.all(self.walls_aabb_max[env_ids] >= vertices.min(axis=1)[:, None, :], axis=-1)
+        idx_env, idx_wall = np.nonzero(candidates)
+
+        collide = np.zeros(len(env_ids), dtype=bool)
+        hits = Collision.sat_batch(vertices[idx_env],
+                    self.walls_vertices[env_ids[idx_env], idx_wall])
+        collide[idx_env[hits]] = True
+        return collide
+
+    def _move_agents(self, agent, env_ids, action):
+        forward = (action - 1.5) * 2 * (-1)
+        direction = self.direction[env_ids, agent]
+        new_pos = self.pos[env_ids, agent] + self.speed[agent] * forward[:, None] * np.stack(
+            (np.cos(direction), np.sin(direction)), axis=-1)
+
+        blocked = self._collides_with_walls(
+            env_ids, self._agent_vertices(agent, new_pos), self.walls_active[env_ids])
+        self.pos[env_ids[~blocked], agent] = new_pos[~blocked]
+        return ~blocked
+
+    def _rotate_agents(self, agent, env_ids, action):
+        turn = (action - 3.5) * 2 * (-1)
+        self.direction[env_ids, agent] = (
+            self.direction[env_ids, agent] + self.speed_rotate[agent] * turn) % (2 * math.pi)
+        return np.ones(len(env_ids), dtype=bool)
+
+    def _remove_walls(self, env_ids):
+        visible = self.walls_visible[env_ids,
+                                     SEEKER] & self.walls_active[env_ids]
+        can_remove = visible.any(axis=1) & (
+            self.wall_timer[env_ids, SEEKER] == 0)
+
+        # remove randomly selected wall in local env
+        scores = np.where(visible, self.np_random.random_sample(visible.shape), -1)
+        chosen = scores.argmax(axis=1)
+        self.wall_timer[env_ids[can_remove],
+                        SEEKER] = self.wall_timer_init[SEEKER]
+
+        # only Walls created by Hiding Agent may be removed
+        did_remove = can_remove & (chosen >= self.map_walls_count)
+        self.walls_active[env_ids[did_remove], chosen[did_remove]] = False
+        return did_remove
+
+    def _add_walls(self, env_ids):
+        can_add = (self.walls_counter[env_ids] < self.walls_max) & (
+            self.wall_timer[env_ids, HIDING] == 0)
+        env_ids = env_ids[can_add]
+        did_add = np.zeros(len(can_add), dtype=bool)
+        if not env_ids.size:
+            return did_add
+
+        pos = self.pos[env_ids, HIDING]
+        direction = self.direction[env_ids, HIDING]
+        cos, sin = np.cos(direction), np.sin(direction)
+        rotation = np.stack((np.stack((cos, -sin), axis=-1),
+                             np.stack((sin, cos), axis=-1)), axis=-2)
+
+        # vision arc range - 1.5 wall width, so the wall is always created inside PoV.
+        wall_w, wall_h = self.hiding_wall_size
+        wall_pos = pos + (self.vision_radius[HIDING] - 1.5 * wall_w) * \
+            np.stack((cos, sin), axis=-1)
+        wall_rect = np.array([
+            [-wall_w / 2, -wall_h / 2],
+            [wall_w / 2, -wall_h / 2],
+            [wall_w / 2, wall_h / 2],
+            [-wall_w / 2, wall_h / 2],
+        ])
+        wall_vertices = wall_pos[:, None, :] + \
+            np.einsum('nij,vj->nvi', rotation, wall_rect)
+
+        # POV lines to closer edges, center & vision top can't be blocked by any Wall in Local Environment
+        vision_top = pos + self.vision_radius[HIDING] * \
+            np.stack((cos, sin), axis=-1)
+        targets = np.stack(
+            (wall_vertices[:, 0], wall_pos, wall_vertices[:, 3], vision_top), axis=1)
+        visible = self.walls_visible[env_ids,
+                                     HIDING] & self.walls_active[env_ids]
+
+        possible = np.ones(len(env_ids), dtype=bool)
+        for i in range(targets.shape[1]):
+            ray = np.stack((pos, targets[:, i]), axis=1)
+            possible &= ~self._collides_with_walls(env_ids, ray, visible)
+        possible &= ~self._collides_with_walls(env_ids, wall_vertices, visible)
+        # same rule as HideNSeekEnv._can_create_wall: Wall can't be created next to the visible Seeker
+        # while Hiding Agent touches it
+        seeker_pos = self.pos[env_ids, SEEKER]
+        seeker_half_size = self.agent_size[SEEKER] / 2
+        near_seeker = np.all(wall_vertices.min(axis=1) < seeker_pos + seeker_half_size, axis=-1) \
+            & np.all(wall_vertices.max(axis=1) > seeker_pos - seeker_half_size, axis=-1)
+        possible &= ~(self.enemy_visible[env_ids, HIDING] & near_seeker & Collision.sat_batch(
+            self._agent_vertices(HIDING)[env_ids], self._agent_vertices(SEEKER)[env_ids]))
+
+        env_ids = env_ids[possible]
+        wall_vertices = wall_vertices[possible]
+        # first free slot for a new Wall
+        free_slot = self.map_walls_count + np.argmin(
+            self.walls_active[env_ids, self.map_walls_count:], axis=1)
+        self.walls_vertices[env_ids, free_slot] = wall_vertices
+        self.walls_aabb_min[env_ids, free_slot] = wall_vertices.min(axis=1)
+        self.walls_aabb_max[env_ids, free_slot] = wall_vertices.max(axis=1)
+        self.walls_active[env_ids, free_slot] = True
+        self.wall_timer[env_ids, HIDING] = self.wall_timer_init[HIDING]
+
+        did_add[np.nonzero(can_add)[0][possible]] = True
+        return did_add
+
+    def _perform_agent_action(self, agent, action):
+        """
+        Performs given actions for the Agent in every game
+
+        Parameters
+        ----------
+            agent : int
+                agent index, 0 - Seeker, 1 - Hiding
+            action : np.array of int, shape (N, )
+                action for every game, see HideNSeekEnv.action_space
+
+        Returns
+        -------
+            reward : np.array, shape (N, )
+                reward for the action, negative if action failed
+        """
+
+        if np.any((action < 0) | (action >= self.action_space.n)):
+            raise Exception(
+                f"Unknown action, available action space: {self.action_space}")
+
+        success = np.ones(self.num_envs, dtype=bool)
+
+        env_ids = np.nonzero((action == 1) | (action == 2))[0]
+        if env_ids.size:
+            success[env_ids] = self._move_agents(agent, env_ids, action[env_ids])
+
+        env_ids = np.nonzero((action == 3) | (action == 4))[0]
+        if env_ids.size:
+            success[env_ids] = self._rotate_agents(
+                agent, env_ids, action[env_ids])
+
+        env_ids = np.nonzero(action == 5)[0]
+        if env_ids.size:
+            if agent == SEEKER:
+                success[env_ids] = self._remove_walls(env_ids)
+            else:
+                success[env_ids] = self._add_walls(env_ids)
+
+        reward = self.action_rewards[agent][action]
+        return np.where(success, reward, -reward)
+
+    def _game_over(self):
+        """
+        Checks which games are finished
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            done : np.array of bool, shape (N, )
+            seeker_won : np.array of bool, shape (N, )
+        """
+
+        time_out = self.duration <= 0
+        caught = Collision.sat_batch(self._agent_vertices(SEEKER),
+                      self._agent_vertices(HIDING))
+        seeker_won = ~time_out & caught
+        return time_out | seeker_won, seeker_won
+
+    def _end_game_scores(self, seeker_won):
+        duration = self.cfg['duration']
+        seeker_rewards = self.default_cfg['seeker']['rewards']
+        hiding_rewards = self.default_cfg['hiding']['rewards']
+
+        hiding_won_score = np.array([
+            -max(seeker_rewards['lose'], duration / 2),
+            max(hiding_rewards['win'], duration / 2),
+        ])
+        if self.cfg['continuous_reward']:
+            frames = duration - self.duration[:, None]
+            seeker_won_score = np.array(
+                [seeker_rewards['win'], -hiding_rewards['lose']]) + frames * np.array([1, -1])
+        else:
+            seeker_won_score = np.broadcast_to(np.array([
+                max(seeker_rewards['win'], duration / 2),
+                -max(hiding_rewards['lose'], duration / 2),
+            ]), (self.num_envs, 2))
+
+        return np.where(seeker_won[:, None], seeker_won_score, hiding_won_score)
+
+    def _get_obs(self):
+        """
+        Creates flat observations for both agents in every game, same layout as
+        `gym.spaces.utils.flatten` used in HideNSeekEnv; every field is written straight into the result
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            obs_n : list of np.array
+                Seeker observations, shape (N, 9) & Hiding observations, shape (N, 10)
+        """
+
+        cooldown = self.wall_timer / self.wall_timer_init
+        walls_available = (self.walls_max - self.walls_counter) / self.walls_max
+
+        obs_n = []
+        for agent, encoder in zip([SEEKER, HIDING], self.obs_encoder_n):
+            enemy = 1 - agent
+            obs_n.append(encoder.encode_batch(
+                encoder.empty(self.num_envs),
+                self.pos[:, agent], self.direction[:, agent], cooldown[:, agent],
+                self.pos[:, enemy], self.direction[:, enemy],
+                walls_available=walls_available if agent == HIDING else None,
+            ))
+
+        return obs_n
+
+    def step(self, action_n):
+        """
+        Performs one frame in every game. Finished games are reset automatically.
+
+        Parameters
+        ----------
+            action_n : np.array of int, shape (N, 2)
+                actions for every game, Seeker first
+
+        Returns
+        -------
+            obs_n : list of np.array
+                Seeker observations, shape (N, 9) & Hiding observations, shape (N, 10)
+            reward_n : np.array, shape (N, 2)
+                rewards, Seeker first
+            done : np.array of bool, shape (N, )
+                which games have finished in this frame
+            info : dict
+                'winner' - np.array of str/None, shape (N, ), 'SEEKER' or 'HIDING' for finished games
+                'terminal_obs_n' - observations before reset, same format as obs_n
+        """
+
+        action_n = np.asarray(action_n, dtype=np.int64).reshape(self.num_envs, 2)
+
+        self.wall_timer = np.maximum(self.wall_timer - 1, 0)
+
+        reward_n = np.zeros((self.num_envs, 2), dtype=np.float64)
+        order = [HIDING, SEEKER] if self.cfg['reverse'] else [SEEKER, HIDING]
+        for agent in order:
+            reward_n[:, agent] = self._perform_agent_action(
+                agent, action_n[:, agent])
+
+        self._calc_local_env(np.ones(self.num_envs, dtype=bool))
+
+        done, seeker_won = self._game_over()
+        reward_n[done] += self._end_game_scores(seeker_won)[done]
+        obs_n = self._get_obs()
+
+        winner = np.full(self.num_envs, None, dtype=object)
+        winner[done] = np.where(seeker_won[done], 'SEEKER', 'HIDING')
+        info = {'winner': winner, 'terminal_obs_n': [obs.copy() for obs in obs_n]}
+
+        self.duration -= 1
+        if done.any():
+            self._reset_envs(done)
+            obs_n = self._get_obs()
+
+        return obs_n, reward_n, done, info
+
+    def render(self, mode='console', close=False):
+        if mode == 'console':
+            pass
+        else:
+            raise Exception(
+                "Unexpected render mode, available: 'console'")
@@ -1,40 +1,48 @@
 import math
-import os
 import pygame
-import copy
-from game_env.hidenseek_gym.supportive import Point
+from game_env.hidenseek_gym.supportive import Point, PointArray, AssetCache, Versioned
 
 
-class Wall(pygame.sprite.Sprite):
+class Wall(Versioned):
     """
-    Wall Class for Hide'n'Seek Game, inherits from pygame.sprite.Sprite
+    Wall Class for Hide'n'Seek Game. Pure geometry, pygame sprite is created lazily, only when rendering
 
     Attributes
     ----------
         owner : None, hidenseek.objects.controllable.Hiding, hidenseek.objects.controllable.Seeker
             Wall owner, None for game environment
         width : int
-            width of the Wall
+            width of the Wall bounding box
         height : int
-            height of the Wall
+            height of the Wall bounding box
+        size : tuple
+            Wall size before rotation
         pos : hidenseek.ext.supportive.Point
             object position on the game display
-        image : pygame.Surface
-            object image surface on which image/shape will be drawn
-        rect : pygame.Rect
-            object Rectangle, to be drawn
-        polygon_points : list of tuples
+        img_path : str
+            path to the folder with Wall graphics
+        image_angle : float
+            angle (in radians) by which the Wall has been rotated
+        polygon_points : PointArray
             vertices, used for collision check in SAT
+        version : int
+            incremented whenever pos, width, height or direction is set, invalidates cached edges
 
     Methods
     -------
         get_abs_vertices():
             returns absolute vertices coordinates (in game screen coordinates system)
+        get_edges():
+            returns Wall edges, cached
+        get_edges_midpoints():
+            returns middle points of Wall edges, cached
         _rotate(angle, position):
             rotates the Wall by Angle and moves its center to Position
+        get_sprite():
+            returns pygame sprite used for rendering, creates it if needed
     """
 
-    def __init__(self, owner, x, y, size, img_path, direction=0):
+    def __init__(self, owner, x, y, size, img_path, direction=0, edges=None):
         """
         Constructs all neccesary attributes for the Wall Object
 
@@ -48,46 +56,44 @@ class Wall(pygame.sprite.Sprite):
                 center of the rectangle in 'y' axis for absolute coordinate system (game screen)
             size : tuple
                 Wall size, at least 2x2
+            img_path : str
+                path to the folder with Wall graphics
+            direction : float
+                Wall direction in radians
+            edges : list of [[x, y], [x, y]], optional
+                precomputed edges in Wall.get_edges order (i.e. from compiled map), computed if not given
         """
 
-        super().__init__()
-
         self.owner = owner
+        self.version = 0
+        self._cache = {}
 
         self.width = size[0]
         self.height = size[1]
+        self.size = size
 
         self.pos = Point((x, y))
         self.pos_init = Point((x, y))
 
-        image = pygame.Surface((self.width, self.height))
-        image.fill((0, 0, 0, 0))
-        image.set_colorkey((0, 0, 0))
-
-        self.image = image
-
-        self.filling = [pygame.image.load(os.path.join(img_path, file_))
-                        for file_ in os.listdir(img_path)]
-
-        self.rect = self.image.get_rect()
-        self.rect.center = (self.pos.x, self.pos.y)
-
-        filling_width = self.filling[0].get_width()
-        filling_height = self.filling[0].get_height()
-
-        img_full_size_w = self.width / filling_width
-        img_rounded_size_w = math.ceil(img_full_size_w)
-        img_full_size_h = self.height / filling_height
-        img_rounded_size_h = math.ceil(img_full_size_h)
+        self.img_path = img_path
+        self.image_angle = 0
+        self._sprite = None
 
-        blit_list = [(self.filling[0], (filling_width * i, j * filling_height)) for i in range(0, img_rounded_size_w) for j in range(0, img_rounded_size_h)]
-        image.blits(blit_list)
-        
-        self.polygon_points = [Point((self.rect.left, self.rect.top)), Point((self.rect.right, self.rect.top)), Point(
-            (self.rect.right, self.rect.bottom)), Point((self.rect.left, self.rect.bottom))]
+        self.polygon_points = PointArray([
+            (x - self.width / 2, y - self.height / 2),
+            (x + self.width / 2, y - self.height / 2),
+            (x + self.width / 2, y + self.height / 2),
+            (x - self.width / 2, y + self.height / 2),
+        ])
 
         self.direction = direction
 
+        # map Walls never change, so their edges are ready right after map load
+        if edges is not None:
+            self._cache['edges'] = (self.version, [
+                [Point(edge[0]), Point(edge[1])] for edge in edges])
+        self.get_edges_midpoints()
+
     def __str__(self):
         return str(self.pos)
 
@@ -104,15 +110,58 @@ class Wall(pygame.sprite.Sprite):
 
         Returns
         -------
-            points : list of hidenseek.ext.supportive.Point
+            points : hidenseek.ext.supportive.PointArray
                 self.pylogon_points mapped to the absolute coordinates system
         """
 
         return self.polygon_points
 
+    def get_edges(self):
+        """
+        Returns Wall edges, computed once per Wall version
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            edges : list of [Point, Point]
+                4 edges, i-th edge starts in i-th vertex
+        """
+
+        return self._cached('edges', self._edges)
+
+    def _edges(self):
+        """Computes Wall.get_edges, without cache"""
+
+        vertices = self.get_abs_vertices().to_points()
+        return [[vertices[i], vertices[(i + 1) % 4]] for i in range(4)]
+
+    def get_edges_midpoints(self):
+        """
+        Returns middle points of Wall edges, computed once per Wall version
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            midpoints : list of Point
+                midpoint of every edge, in Wall.get_edges order
+        """
+
+        return self._cached('edges_midpoints', self._edges_midpoints)
+
+    def _edges_midpoints(self):
+        """Computes Wall.get_edges_midpoints, without cache"""
+
+        return [edge[0] + (edge[1] - edge[0]) / 2 for edge in self.get_edges()]
+
     def _rotate(self, angle, position):
         """
-        Rotates the sprite by creating new Rectangle and updates its polygon points
+        Rotates the Wall and updates its polygon points & bounding box size
 
         Parameters
         ----------
@@ -126,18 +175,42 @@ class Wall(pygame.sprite.Sprite):
             None
         """
         self.direction = angle
-        # Copy and then rotate the original image.
-        copied_image = self.image.copy()
-        self.image = pygame.transform.rotozoom(
-            copied_image, -angle*180/math.pi, 1)
-        self.image.set_colorkey((0, 0, 0))
-
-        # Create a new rect with the center of the sprite.
-        self.rect = self.image.get_rect()
-        self.rect.center = (position.x, position.y)
-        self.width = self.rect.width
-        self.height = self.rect.height
+        self.image_angle = angle
+        self._sprite = None
+
+        # bounding box of the rotated rectangle
+        self.width = abs(self.size[0] * math.cos(angle)) + \
+            abs(self.size[1] * math.sin(angle))
+        self.height = abs(self.size[0] * math.sin(angle)) + \
+            abs(self.size[1] * math.cos(angle))
 
         # Update the polygon points for collisions
-        self.polygon_points = [Point.triangle_unit_circle_relative(
-            angle, self.pos, polygon_point) for polygon_point in self.polygon_points]
+        self.polygon_points.rotate(angle, self.pos)
+
+    def get_sprite(self):
+        """
+        Returns pygame sprite of the Wall, filled with tiled graphics from img_path and rotated like the Wall.
+        Sprite is created only once, on first call (i.e. first render), graphics come from AssetCache.
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            sprite : pygame.sprite.Sprite
+                sprite with image & rect, ready to be drawn
+        """
+
+        if self._sprite:
+            return self._sprite
+
+        # tiled & rotated surface is shared by all Walls with the same size & angle
+        image = AssetCache.tiled_surface(self.img_path, self.size, self.image_angle)
+
+        self._sprite = pygame.sprite.Sprite()
+        self._sprite.image = image
+        self._sprite.rect = image.get_rect()
+        self._sprite.rect.center = (self.pos.x, self.pos.y)
+
+        return self._sprite
@@ -1,11 +1,23 @@
 import pygame
 import math
+import os
+import io
+import json
+import hashlib
+import tempfile
+import time
+import bisect
+import random
+import numpy as np
+from collections import deque, OrderedDict
 from PIL import Image
+from gym import spaces
 
 
 class Point():
     """
-    Point class, which corrensponds to a point on the coordinate system
+    Point class, which corrensponds to a point on the coordinate system.
+    Uses __slots__ (no per-instance __dict__), because thousands of Points are created every game step
 
     Attributes
     ----------
@@ -14,6 +26,8 @@ class Point():
 
     Methods
     -------
+        copy():
+            returns new Point with the same coordinates
         round(n):
             rounds Objects x & y to the 'n' decimal place, default: 0 (integer)
         orthogonally():
@@ -28,6 +42,9 @@ class Point():
             returns Point square representation (x^2 + y^2)
 
         @staticmethod
+        from_xy(x, y):
+            returns new Point, without packing coordinates into a tuple
+        @staticmethod
         triangle_unit_circle(radians, side_size):
             returns point moved by Radians distant by Side_size in terms of (0, 0) game screen
 
@@ -36,9 +53,52 @@ class Point():
             returns Target point moved by Radians in terms of center Point
     """
 
+    __slots__ = ('x', 'y')
+
     def __init__(self, position):
         self.x, self.y = position
 
+    @staticmethod
+    def from_xy(x, y):
+        """
+        Creates Point from separate coordinates, faster than Point((x, y))
+
+        Parameters
+        ----------
+            x : float
+            y : float
+
+        Returns
+        -------
+            Point : hidenseek.ext.supportive.Point
+                new Point object
+        """
+
+        point = Point.__new__(Point)
+        point.x = x
+        point.y = y
+        return point
+
+    def copy(self):
+        """
+        Returns new Point with the same coordinates, cheap replacement for copy.deepcopy
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            Point : hidenseek.ext.supportive.Point
+                new Point object
+        """
+
+        return Point.from_xy(self.x, self.y)
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
     def __add__(self, obj):
         """
         Adds Point to the 'Point', 'int' or 'float'
@@ -56,9 +116,9 @@ class Point():
         """
 
         if isinstance(obj, Point):
-            return Point((self.x + obj.x, self.y + obj.y))
-        elif isinstance(obj, int) or isinstance(obj, float):
-            return Point((self.x + obj, self.y + obj))
+            return Point.from_xy(self.x + obj.x, self.y + obj.y)
+        elif isinstance(obj, (int, float)):
+            return Point.from_xy(self.x + obj, self.y + obj)
         else:
             raise TypeError(
                 "You can only add Point to the 'Point', 'Integer' and 'Float' value types")
@@ -80,9 +140,9 @@ class Point():
         """
 
         if isinstance(obj, Point):
-            return Point((self.x - obj.x, self.y - obj.y))
-        elif isinstance(obj, int) or isinstance(obj, float):
-            return Point((self.x - obj, self.y - obj))
+            return Point.from_xy(self.x - obj.x, self.y - obj.y)
+        elif isinstance(obj, (int, float)):
+            return Point.from_xy(self.x - obj, self.y - obj)
         else:
             raise TypeError(
                 "You can only sub Point with 'Point', 'Integer' and 'Float' value types")
@@ -107,10 +167,10 @@ class Point():
                 new Point object
         """
 
-        if not (isinstance(obj, int) or isinstance(obj, float)):
+        if not isinstance(obj, (int, float)):
             raise TypeError(
                 "You can only multiply Point by using 'Integer' or 'Float'")
-        return Point((self.x * obj, self.y * obj))
+        return Point.from_xy(self.x * obj, self.y * obj)
 
     def __rmul__(self, obj):
         """
@@ -148,10 +208,10 @@ class Point():
                 new Point object
         """
 
-        if not (isinstance(obj, int) or isinstance(obj, float)):
+        if not isinstance(obj, (int, float)):
             raise TypeError(
                 "You can only divide Point by using 'Integer' or 'Float'")
-        return Point((self.x / obj, self.y / obj))
+        return Point.from_xy(self.x / obj, self.y / obj)
 
     def round(self, n=0):
         """
@@ -168,7 +228,7 @@ class Point():
                 new Point object
         """
 
-        return Point((round(self.x, n), round(self.y, n)))
+        return Point.from_xy(round(self.x, n), round(self.y, n))
 
     def orthogonally(self):
         """
@@ -269,10 +329,7 @@ class Point():
                 Relocation/movement in absolute coordinate system
         """
 
-        x = math.cos(radians) * side_size
-        y = math.sin(radians) * side_size
-
-        return Point((x, y))
+        return Point.from_xy(math.cos(radians) * side_size, math.sin(radians) * side_size)
 
     @staticmethod
     def triangle_unit_circle_relative(radians, center, target):
@@ -296,12 +353,267 @@ class Point():
 
         dist_axes = target - center
 
-        x = center.x + math.cos(radians) * dist_axes.x - \
-            math.sin(radians) * dist_axes.y
-        y = center.y + math.sin(radians) * dist_axes.x + \
-            math.cos(radians) * dist_axes.y
+        cos, sin = math.cos(radians), math.sin(radians)
+        x = center.x + cos * dist_axes.x - sin * dist_axes.y
+        y = center.y + sin * dist_axes.x + cos * dist_axes.y
+
+        return Point.from_xy(x, y)
+
+
+class PointArray():
+    """
+    Compact storage for many Points (i.e. polygon vertices), kept in one NumPy array instead of separate objects.
+    Elements are returned as Points, so PointArray can be used wherever list of Points is expected
+
+    Attributes
+    ----------
+        array : np.array, shape (n, 2)
+            x & y of every Point
+
+    Methods
+    -------
+        tolist():
+            returns list of (x, y) lists, fastest way to loop over coordinates in pure Python
+        to_points():
+            returns list of Points
+        translate(obj):
+            moves all Points by Point, in place
+        rotate(radians, center):
+            rotates all Points by Radians in terms of center Point, in place
+    """
+
+    __slots__ = ('array', )
+
+    def __init__(self, points):
+        if isinstance(points, PointArray):
+            self.array = points.array.copy()
+        elif isinstance(points, np.ndarray):
+            self.array = np.array(points, dtype=np.float64).reshape(-1, 2)
+        else:
+            self.array = np.array([(point[0], point[1]) if not isinstance(point, Point) else (point.x, point.y)
+                                   for point in points], dtype=np.float64).reshape(-1, 2)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return PointArray(self.array[index])
+        x, y = self.array[index].tolist()
+        return Point.from_xy(x, y)
+
+    def __iter__(self):
+        return (Point.from_xy(x, y) for x, y in self.array.tolist())
+
+    def __array__(self, dtype=None):
+        return self.array if dtype is None else self.array.astype(dtype)
+
+    def __add__(self, obj):
+        """
+        Moves all Points by 'Point', 'int' or 'float'
+
+        Parameters
+        ----------
+            obj : hidenseek.ext.supportive.Point, int, float
+
+        Returns
+        -------
+            PointArray : hidenseek.ext.supportive.PointArray
+                new PointArray object
+        """
+
+        if isinstance(obj, Point):
+            return PointArray(self.array + (obj.x, obj.y))
+        elif isinstance(obj, (int, float)):
+            return PointArray(self.array + obj)
+        else:
+            raise TypeError(
+                "You can only add PointArray to the 'Point', 'Integer' and 'Float' value types")
+
+    def __sub__(self, obj):
+        """
+        Moves all Points by negative 'Point', 'int' or 'float'
+
+        Parameters
+        ----------
+            obj : hidenseek.ext.supportive.Point, int, float
+
+        Returns
+        -------
+            PointArray : hidenseek.ext.supportive.PointArray
+                new PointArray object
+        """
+
+        if isinstance(obj, Point):
+            return PointArray(self.array - (obj.x, obj.y))
+        elif isinstance(obj, (int, float)):
+            return PointArray(self.array - obj)
+        else:
+            raise TypeError(
+                "You can only sub PointArray with 'Point', 'Integer' and 'Float' value types")
+
+    def __str__(self):
+        return "PointArray(" + str(self.array.tolist()) + ')'
+
+    def __repr__(self):
+        return self.__str__()
+
+    def tolist(self):
+        """
+        Returns coordinates as list of [x, y] lists
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            coordinates : list of lists
+        """
+
+        return self.array.tolist()
+
+    def to_points(self):
+        """
+        Returns PointArray as list of Points
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            points : list of hidenseek.ext.supportive.Point
+        """
+
+        return list(self)
+
+    def translate(self, obj):
+        """
+        Moves all Points by Point, in place
+
+        Parameters
+        ----------
+            obj : hidenseek.ext.supportive.Point
+
+        Returns
+        -------
+            PointArray : hidenseek.ext.supportive.PointArray
+                caller
+        """
+
+        self.array += (obj.x, obj.y)
+        return self
+
+    def rotate(self, radians, center):
+        """
+        Rotates all Points by Radians in terms of center Point, in place.
+        Vectorized version of Point.triangle_unit_circle_relative
+
+        Parameters
+        ----------
+            radians : float
+                rotation angle in radians
+            center : hidenseek.ext.supportive.Point
+                rotation center
+
+        Returns
+        -------
+            PointArray : hidenseek.ext.supportive.PointArray
+                caller
+        """
+
+        cos, sin = math.cos(radians), math.sin(radians)
+        dist_x = self.array[:, 0] - center.x
+        dist_y = self.array[:, 1] - center.y
+        self.array = np.stack((center.x + cos * dist_x - sin * dist_y,
+                               center.y + sin * dist_x + cos * dist_y), axis=-1)
+        return self
+
+
+class Versioned:
+    """
+    Mixin for game objects with geometry (Player, Wall): setting pos, direction, width or height increments version,
+    values derived from geometry (i.e. vertices, edges) are cached per version. Subclass sets `version = 0`
+    and `_cache = {}` before geometry is assigned
+
+    Attributes
+    ----------
+        version : int
+            incremented whenever pos, width, height or direction is set, invalidates cached values
+        pos : hidenseek.ext.supportive.Point
+            object position; must be replaced (not modified in place), so cached values are invalidated
+        direction : float
+            object direction in radians
+        width : int
+            object width
+        height : int
+            object height
+
+    Methods
+    -------
+        _cached(name, factory):
+            returns value cached for the current version, computes it if needed
+    """
+
+    @property
+    def pos(self):
+        return self._pos
+
+    @pos.setter
+    def pos(self, pos):
+        self._pos = pos
+        self.version += 1
+
+    @property
+    def direction(self):
+        return self._direction
+
+    @direction.setter
+    def direction(self, direction):
+        self._direction = direction
+        self.version += 1
+
+    @property
+    def width(self):
+        return self._width
+
+    @width.setter
+    def width(self, width):
+        self._width = width
+        self.version += 1
+
+    @property
+    def height(self):
+        return self._height
+
+    @height.setter
+    def height(self, height):
+        self._height = height
+        self.version += 1
 
-        return Point((x, y))
+    def _cached(self, name, factory):
+        """
+        Returns cached value if computed for the current object version, otherwise computes it again
+
+        Parameters
+        ----------
+            name : str
+                cache entry name
+            factory : function
+                computes the value, called without arguments
+
+        Returns
+        -------
+            value : object
+                shared value, shouldn't be modified by the caller
+        """
+
+        version, value = self._cache.get(name, (None, None))
+        if version != self.version:
+            value = factory()
+            self._cache[name] = (self.version, value)
+        return value
 
 
 class Collision:
@@ -324,11 +636,23 @@ class Collision:
         sat(vertices_obj1, vertices_obj2):
             returns collision by using Separating Axis Theorem
         @staticmethod
+        sat_batch(vertices_obj1, vertices_obj2):
+            returns collisions of polygons batches (NumPy arrays) by using Separating Axis Theorem
+        @staticmethod
+        polygons_to_array(polygons):
+            returns list of polygons (lists of Points) as one NumPy array
+        @staticmethod
         find_intersection(segment1, segment2)
             if intersection between segment1 & segment2 exists, returns closes Point; if not - returns None
         @staticmethod
         get_objects_in_local_env(objs, center, radius, angle, vertices)
             returns list of objects (from argument objs) which are in given local environment
+        @staticmethod
+        rays_nearest_intersection(origin, ray_ends, segments)
+            returns the nearest intersection with segments for every ray, ray end if there is none
+        @staticmethod
+        visibility_polygon(origin, radius, start_angle, arc, segments, samples)
+            returns visibility polygon (angular sweep) of the vision arc occluded by segments
     """
 
     @staticmethod
@@ -434,6 +758,25 @@ class Collision:
         norm = math.sqrt(point[0]**2 + point[1]**2)
         return (point[0] / norm, point[1] / norm)
 
+    @staticmethod
+    def _vertices_coordinates(vertices):
+        """
+        Converts vertices to the list of (x, y), so SAT doesn't need to create any new Point
+
+        Parameters
+        ----------
+            vertices : hidenseek.ext.supportive.PointArray or list of hidenseek.ext.supportive.Point
+
+        Returns
+        -------
+            coordinates : list
+                list of (x, y) for every vertex
+        """
+
+        if isinstance(vertices, PointArray):
+            return vertices.tolist()
+        return [(vertex.x, vertex.y) for vertex in vertices]
+
     @staticmethod
     def _sat_project_to_axis(vertices, axis):
         """
@@ -441,7 +784,7 @@ class Collision:
 
         Parameters
         ----------
-            vertices : list
+            vertices : list of (x, y)
             axis : tuple
 
         Returns
@@ -450,7 +793,7 @@ class Collision:
                 returns area occupied by vertices projected to an axis
         """
 
-        dots = [vertex.x * axis[0] + vertex.y * axis[1] for vertex in vertices]
+        dots = [x * axis[0] + y * axis[1] for x, y in vertices]
         return [min(dots), max(dots)]
 
     @staticmethod
@@ -460,15 +803,17 @@ class Collision:
 
         Parameters
         ----------
-            vertices_: list
-                list of vertices objects (hidenseek.ext.supportive.Point)
+            vertices_: list of (x, y)
+
         Returns
         -------
             edges : list
-                returns list of edges (hidenseek.ext.supportive.Point)
+                returns list of edges (x, y)
         """
-        return [vertices[(i + 1) % len(vertices)] - vertices[i] for i in
-                range(len(vertices))] if len(vertices) > 2 else [vertices[1] - vertices[0]]
+        if len(vertices) <= 2:
+            return [(vertices[1][0] - vertices[0][0], vertices[1][1] - vertices[0][1])]
+        return [(vertices[(i + 1) % len(vertices)][0] - vertices[i][0], vertices[(i + 1) % len(vertices)][1] - vertices[i][1])
+                for i in range(len(vertices))]
 
     @staticmethod
     def sat(vertices_obj1, vertices_obj2):
@@ -477,9 +822,9 @@ class Collision:
 
         Parameters
         ----------
-            vertices_obj1 : list
+            vertices_obj1 : PointArray or list
                 list of vertices objects (hidenseek.ext.supportive.Point) for first object
-            vertices_obj2 : list
+            vertices_obj2 : PointArray or list
                 list of vertices objects (hidenseek.ext.supportive.Point) for second object
 
         Returns
@@ -487,6 +832,9 @@ class Collision:
             collide : bool
                 returns if objects collide
         """
+        vertices_obj1 = Collision._vertices_coordinates(vertices_obj1)
+        vertices_obj2 = Collision._vertices_coordinates(vertices_obj2)
+
         # edges function
         edges_1 = Collision._get_polygon_edges(vertices_obj1)
         edges_2 = Collision._get_polygon_edges(vertices_obj2)
@@ -496,7 +844,7 @@ class Collision:
 
         # axes
         axes = [Collision._normalize_point_tuple(
-            edge.orthogonally()) for edge in edges]
+            (edge[1], -edge[0])) for edge in edges]
         for axis in axes:
             projection_1 = Collision._sat_project_to_axis(vertices_obj1, axis)
             projection_2 = Collision._sat_project_to_axis(vertices_obj2, axis)
@@ -511,6 +859,125 @@ class Collision:
 
         return True
 
+    @staticmethod
+    def polygons_to_array(polygons):
+        """
+        Converts polygons to one NumPy array. Polygons with less vertices are padded with their last vertex,
+        degenerated (zero-length) edges never separate polygons in Collision.sat_batch
+
+        Parameters
+        ----------
+            polygons : list of PointArray or lists of hidenseek.ext.supportive.Point
+
+        Returns
+        -------
+            vertices : np.array, shape (n, k, 2)
+                k is the biggest number of vertices in polygons
+        """
+
+        polygons = [Collision._vertices_coordinates(polygon) for polygon in polygons]
+        max_vertices = max(len(polygon) for polygon in polygons)
+        return np.array([
+            list(polygon) + [polygon[-1]] * (max_vertices - len(polygon))
+            for polygon in polygons], dtype=np.float64)
+
+    @staticmethod
+    def _get_polygon_axes_array(vertices):
+        """
+        Makes SAT axes (not normalized edges normals) from polygons vertices
+
+        Parameters
+        ----------
+            vertices : np.array, shape (..., k, 2)
+
+        Returns
+        -------
+            axes : np.array, shape (..., k, 2)
+                one axis per polygon edge
+        """
+
+        edges = np.roll(vertices, -1, axis=-2) - vertices
+        return np.stack((edges[..., 1], -edges[..., 0]), axis=-1)
+
+    @staticmethod
+    def _sat_project_to_axes_array(vertices, axes):
+        """
+        Projects polygons vertices to axes. Loops over (few) vertices instead of reducing
+        along the short last dimension, which is much slower in NumPy.
+
+        Parameters
+        ----------
+            vertices : np.array, shape (..., k, 2)
+            axes : np.array, shape (..., a, 2)
+
+        Returns
+        -------
+            projection : tuple of np.array, shape (..., a)
+                minimum and maximum of the projection onto every axis
+        """
+
+        axes_x, axes_y = axes[..., 0], axes[..., 1]
+        projection_min = projection_max = axes_x * vertices[..., 0, None, 0] + \
+            axes_y * vertices[..., 0, None, 1]
+        for i in range(1, vertices.shape[-2]):
+            projection = axes_x * vertices[..., i, None, 0] + \
+                axes_y * vertices[..., i, None, 1]
+            projection_min = np.minimum(projection_min, projection)
+            projection_max = np.maximum(projection_max, projection)
+        return projection_min, projection_max
+
+    @staticmethod
+    def _sat_overlap_on_axes_array(vertices_obj1, vertices_obj2, axes):
+        """
+        Checks if projections of both polygons overlap on every axis
+
+        Parameters
+        ----------
+            vertices_obj1 : np.array, shape (..., k1, 2)
+            vertices_obj2 : np.array, shape (..., k2, 2)
+            axes : np.array, shape (..., a, 2)
+
+        Returns
+        -------
+            overlap : np.array of bool, shape (...)
+                True if there is no separating axis among given axes
+        """
+
+        min_1, max_1 = Collision._sat_project_to_axes_array(vertices_obj1, axes)
+        min_2, max_2 = Collision._sat_project_to_axes_array(vertices_obj2, axes)
+        overlap = (max_1 >= min_2) & (max_2 >= min_1)
+
+        overlap_all = overlap[..., 0]
+        for i in range(1, overlap.shape[-1]):
+            overlap_all = overlap_all & overlap[..., i]
+        return overlap_all
+
+    @staticmethod
+    def sat_batch(vertices_obj1, vertices_obj2):
+        """
+        Checks if polygons collide by using Separating Axis Theorem, vectorized version of Collision.sat.
+        Leading dimensions are broadcasted, so i.e. one polygon (k1, 2) can be tested against
+        M polygons (M, k2, 2) in one call.
+
+        Parameters
+        ----------
+            vertices_obj1 : np.array, shape (..., k1, 2)
+                vertices of first polygons
+            vertices_obj2 : np.array, shape (..., k2, 2)
+                vertices of second polygons
+
+        Returns
+        -------
+            collide : np.array of bool, shape (...)
+                returns if polygons collide
+        """
+
+        vertices_obj1 = np.asarray(vertices_obj1, dtype=np.float64)
+        vertices_obj2 = np.asarray(vertices_obj2, dtype=np.float64)
+
+        return Collision._sat_overlap_on_axes_array(vertices_obj1, vertices_obj2, Collision._get_polygon_axes_array(vertices_obj1)) \
+            & Collision._sat_overlap_on_axes_array(vertices_obj1, vertices_obj2, Collision._get_polygon_axes_array(vertices_obj2))
+
     @staticmethod
     def get_objects_in_local_env(objs, center, radius, angle, vertices):
         """
@@ -518,9 +985,9 @@ class Collision:
 
         Parameters
         ----------
-            objs : list of pygame.Rect
+            objs : list of objects with pos, width, height & get_abs_vertices (i.e. Wall, Player)
                 objects to check if in local
-            center : pygame.Rect
+            center : hidenseek.ext.supportive.Point
                 local environment source (i.e. Agent) center
             radius : int
                 local environment source (i.e. Agent) vision radius
@@ -532,27 +999,31 @@ class Collision:
         Returns
         -------
             in_radius : list
-                list of pygame.Rect objects being in Local Environment
+                list of objects being in Local Environment
         """
 
         in_radius = []
         # width, height for arc w/ 0 radians, don't need an actual arc
         # because of backward movement, we need to find walls also behind the Agent, so we are using whole circle
-        arc_surface = pygame.Surface((2 * radius, 2 * radius))
-        arc_surface = pygame.transform.rotozoom(
-            arc_surface, -angle*180/math.pi, 1)
-
-        # Create a new rect with the center of the sprite.
-        arc_rect = arc_surface.get_rect()
+        # bounding box of the (2 * radius) square rotated by angle
+        arc_size = 2 * radius * (abs(math.cos(angle)) + abs(math.sin(angle)))
+        arc_rect_size = (arc_size, arc_size)
         arc_center = center
-        arc_rect.center = (arc_center.x, arc_center.y)
 
-        for obj in objs:
-            if Collision.aabb(arc_center, arc_rect.size, obj.pos, (obj.width, obj.height)):
-                for vertices_obj in vertices:
-                    if Collision.sat(obj.get_abs_vertices(), vertices_obj):
-                        in_radius.append(obj)
-                        break
+        candidates = [obj for obj in objs if Collision.aabb(
+            arc_center, arc_rect_size, obj.pos, (obj.width, obj.height))]
+        if not candidates or not vertices:
+            return in_radius
+
+        # every candidate against every POV polygon in one call
+        candidates_vertices = Collision.polygons_to_array(
+            [obj.get_abs_vertices() for obj in candidates])
+        pov_vertices = Collision.polygons_to_array(vertices)
+        collide = Collision.sat_batch(
+            candidates_vertices[:, None], pov_vertices[None, :]).any(axis=1)
+
+        in_radius = [obj for obj, obj_collide in zip(
+            candidates, collide) if obj_collide]
 
         return in_radius
 
@@ -589,37 +1060,872 @@ class Collision:
         t = (D_C.x * (segment1[0].y - segment2[0].y) -
              D_C.y * (segment1[0].x - segment2[0].x)) / determinant
         if s >= 0 and s <= 1 and t >= 0 and t <= 1:
-            return Point((segment1[0].x + (t * B_A.x), segment1[0].y + (t * B_A.y)))
+            return Point.from_xy(segment1[0].x + (t * B_A.x), segment1[0].y + (t * B_A.y))
         return None
 
+    @staticmethod
+    def rays_nearest_intersection(origin, ray_ends, segments):
+        """
+        Casts all rays against all segments at once, as one broadcasted (rays x segments) array operation.
+        Vectorized version of Collision.line_intersection (parallel segments never intersect here).
 
-class MapGenerator:
-    """
-    Map Generator class, creating map form a picture
+        Parameters
+        ----------
+            origin : np.array, shape (2, )
+                common start of the rays
+            ray_ends : np.array, shape (R, 2)
+                end of every ray
+            segments : np.array, shape (E, 2, 2)
+                segments (i.e. wall edges) as pairs of points
 
-    Attributes
-    ----------
-        None
+        Returns
+        -------
+            points : np.array, shape (R, 2)
+                the nearest intersection for every ray, ray end if ray doesn't intersect any segment
+        """
 
-    Methods
-    -------
-        @staticmethod
-        open_bmp(filename):
-            returns map from bmp
-        @staticmethod
-        in_object(list_objects, x, y):
-            returns information if point is in object
-        @staticmethod
-        get_objects_coordinates(map, palette):
-            returns objects with their types and positions
-        @staticmethod
-        get_predefined_palette()
-            returns dictionary of types of objects and their colors
+        origin = np.asarray(origin, dtype=np.float64)
+        ray_ends = np.asarray(ray_ends, dtype=np.float64)
+        segments = np.asarray(segments, dtype=np.float64).reshape(-1, 2, 2)
+        if not len(segments) or not len(ray_ends):
+            return ray_ends.copy()
+
+        B_A = ray_ends - origin  # (R, 2)
+        D_C = segments[:, 1] - segments[:, 0]  # (E, 2)
+        A_C = origin - segments[:, 0]  # (E, 2)
+
+        # https://stackoverflow.com/questions/563198/how-do-you-detect-where-two-line-segments-intersect
+        determinant = -D_C[None, :, 0] * B_A[:, None, 1] + \
+            B_A[:, None, 0] * D_C[None, :, 1]  # (R, E)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            s = (-B_A[:, None, 1] * A_C[None, :, 0] +
+                 B_A[:, None, 0] * A_C[None, :, 1]) / determinant
+            t = (D_C[None, :, 0] * A_C[None, :, 1] -
+                 D_C[None, :, 1] * A_C[None, :, 0]) / determinant
+
+        intersect = (np.abs(determinant) >= 1e-20) & (
+            s >= 0) & (s <= 1) & (t >= 0) & (t <= 1)
+        t_nearest = np.where(intersect, t, np.inf).min(axis=1)
+
+        hit = np.isfinite(t_nearest)
+        return np.where(hit[:, None], origin + np.where(hit, t_nearest, 0)[:, None] * B_A, ray_ends)
+
+    @staticmethod
+    def _sweep_segment(origin, radius, start_angle, arc, segment):
+        """
+        Prepares segment for the angular sweep: its angular intervals (relative to start_angle, clipped to the arc)
+        and angles where it crosses the vision circle. Segment crossing the ray at start_angle is split into two parts,
+        one at the end and one at the beginning of the arc (both may be visible if arc is wider than pi)
+
+        Parameters
+        ----------
+            origin : Point
+            radius : float
+            start_angle : float
+                beginning of the vision arc, in radians
+            arc : float
+                vision arc width, in radians
+            segment : [Point, Point]
+
+        Returns
+        -------
+            sweep_segments : list of _SweepSegment
+                visible parts of segment, empty if segment is not visible from origin within the arc
+        """
+
+        p = segment[0] - origin
+        q = segment[1] - origin
+        cross = p.det(q)
+        if abs(cross) < 1e-12:  # seen edge-on, doesn't occlude anything
+            return []
+        if cross < 0:  # sweep goes with increasing angle
+            p, q = q, p
+
+        span = math.atan2(abs(cross), p.dot(q))
+        angle_start = (math.atan2(p.y, p.x) - start_angle) % (2 * math.pi)
+        angle_end = angle_start + span
+
+        # vision circle crossings: |p + u * (q - p)| = radius, u in (0, 1)
+        d = q - p
+        a, b, c = d.square(), 2 * p.dot(d), p.square() - radius * radius
+        delta = b * b - 4 * a * c
+        crossings = []
+        if delta > 0:
+            for u in [(-b - math.sqrt(delta)) / (2 * a), (-b + math.sqrt(delta)) / (2 * a)]:
+                if 0 < u < 1:
+                    crossing = p + d * u
+                    angle = (math.atan2(crossing.y, crossing.x) - start_angle) % (2 * math.pi)
+                    if angle < angle_start:  # behind the ray at start_angle
+                        angle += 2 * math.pi
+                    crossings.append(angle)
+
+        sweep_segments = []
+        # the part before the ray at start_angle & the part after it (shifted by full turn)
+        for shift in [0, 2 * math.pi]:
+            part_start, part_end = max(angle_start - shift, 0), min(angle_end - shift, arc)
+            if part_end - part_start < 1e-12:
+                continue
+            sweep_segments.append(_SweepSegment(p, q, start_angle, part_start, part_end, [
+                angle - shift for angle in crossings if part_start < angle - shift < part_end]))
+
+        return sweep_segments
+
+    @staticmethod
+    def visibility_polygon(origin, radius, start_angle, arc, segments, samples=11):
+        """
+        Calculates visibility polygon of the vision arc occluded by segments (i.e. wall edges), by using angular sweep.
+        Events (segments ends, vision circle crossings & arc samples) are sorted once; active segments are kept
+        ordered by distance from origin, so the nearest one is always first. Complexity: O(E log E) comparisons.
+        The sweep only decides which rays are polygon points: where visible segment changes, two rays are cast
+        (just before & just after the change). All of them are cast at once by Collision.rays_nearest_intersection,
+        so every point is the nearest hit, also for crossing segments (i.e. overlapping walls), just their crossing
+        point itself isn't a polygon point. The polygon is exact besides the vision circle (approximated by samples)
+        and the tiny angle by which rays are moved away from the segments ends.
+
+        Parameters
+        ----------
+            origin : Point
+                vision source (i.e. Agent center)
+            radius : float
+                vision radius
+            start_angle : float
+                beginning of the vision arc, in radians
+            arc : float
+                vision arc width, in radians
+            segments : list of [Point, Point]
+                occluding segments
+            samples : int
+                number of evenly spaced rays used for the vision circle, incl. both arc ends
+
+        Returns
+        -------
+            points : list of Point
+                visibility polygon boundary, in angular order (without origin)
+        """
+
+        # event kinds, in order of processing for the same angle
+        SAMPLE, END, START = 0, 1, 2
+        events = [(arc * i / (samples - 1), SAMPLE, None) for i in range(samples)]
+        for segment in segments:
+            for sweep_segment in Collision._sweep_segment(
+                    origin, radius, start_angle, arc, segment):
+                events.append((sweep_segment.angle_start, START, sweep_segment))
+                events.append((sweep_segment.angle_end, END, sweep_segment))
+                events.extend((angle, SAMPLE, None)
+                              for angle in sweep_segment.crossings)
+        events.sort(key=lambda event: (event[0], event[1]))
+
+        # rays just before & just after the event miss the end of the segment which starts or ends there
+        NUDGE = 1e-9
+
+        def visible_distance(angle, active):
+            return min(active[0].distance(angle), radius) if active else radius
+
+        rays = []  # (angle, distance, nudged angle) of every polygon point
+        active = []  # sorted by distance from origin, the nearest first
+        i = 0
+        while i < len(events):
+            angle = events[i][0]
+            group_end = i
+            while group_end < len(events) and events[group_end][0] - angle < 1e-9:
+                group_end += 1
+
+            before = (angle, visible_distance(angle, active), max(angle - NUDGE, 0))
+            for _, kind, sweep_segment in events[i:group_end]:
+                if kind == END:
+                    active.remove(sweep_segment)
+            for _, kind, sweep_segment in events[i:group_end]:
+                if kind == START:
+                    bisect.insort(active, sweep_segment)
+            after = (angle, visible_distance(angle, active), min(angle + NUDGE, arc))
+
+            if i and (not rays or before[:2] != rays[-1][:2]):
+                rays.append(before)
+            if group_end < len(events) and after[:2] != before[:2] or not i:
+                rays.append(after)
+            i = group_end
+
+        angles = start_angle + np.array([ray[2] for ray in rays])
+        ray_ends = np.stack([origin.x + radius * np.cos(angles), origin.y + radius * np.sin(angles)], axis=1)
+        segments = np.array([[(point.x, point.y) for point in segment] for segment in segments], dtype=np.float64)
+
+        return PointArray(Collision.rays_nearest_intersection((origin.x, origin.y), ray_ends, segments)).to_points()
+
+
+class _SweepSegment:
+    """
+    Segment being swept in Collision.visibility_polygon, relative to the origin.
+    Ordered by distance from origin in the middle of the angular interval common with other segment;
+    non-crossing segments keep that order during whole sweep. Crossing segments (i.e. overlapping walls) change
+    the order at the crossing point, which isn't tracked, so they are assumed not to cross.
+    """
+
+    def __init__(self, p, q, start_angle, angle_start, angle_end, crossings):
+        self.p = p
+        self.d = q - p
+        self.start_angle = start_angle
+        self.angle_start = angle_start
+        self.angle_end = angle_end
+        self.crossings = crossings
+
+    def distance(self, angle):
+        """
+        Returns distance from origin to the segment line along the ray with given (relative) angle
+        """
+
+        ray = Point.triangle_unit_circle(self.start_angle + angle, 1)
+        det = ray.det(self.d)
+        if abs(det) < 1e-12:
+            return math.inf
+        return self.p.det(self.d) / det
+
+    def __lt__(self, other):
+        angle_min = max(self.angle_start, other.angle_start)
+        angle_max = min(self.angle_end, other.angle_end)
+        angle = (angle_min + angle_max) / 2
+        return self.distance(angle) < other.distance(angle)
+
+
+class SpatialHash:
+    """
+    Uniform grid index for objects with position & bounding box (i.e. Walls), answers 'objects near the point' queries
+    without checking every object. Objects are kept in cells overlapped by their bounding box.
+
+    Attributes
+    ----------
+        cell_size : float
+            width & height of the grid cell
+        cells : dict
+            (column, row) -> dict of objects in the cell, by object id
+        order : dict
+            object id -> insertion number, so queries return objects in insertion order
+
+    Methods
+    -------
+        add(obj):
+            adds object to the index
+        remove(obj):
+            removes object from the index
+        query(center, half_width, half_height):
+            returns objects which bounding boxes may overlap given rectangle
+        query_radius(center, radius):
+            returns objects which bounding boxes may overlap square around the circle
+    """
+
+    def __init__(self, cell_size, objs=()):
+        """
+        Constructs all neccesary attributes for the SpatialHash Object
+
+        Parameters
+        ----------
+            cell_size : float
+                width & height of the grid cell, best if close to the typical query radius
+            objs : iterable
+                objects to add at start, each with pos (Point), width & height
+        """
+
+        self.cell_size = max(cell_size, 1)
+        self.cells = {}
+        self.order = {}
+        self._counter = 0
+
+        for obj in objs:
+            self.add(obj)
+
+    def __len__(self):
+        return len(self.order)
+
+    def __contains__(self, obj):
+        return id(obj) in self.order
+
+    def _cells_range(self, center, half_width, half_height):
+        """
+        Returns columns & rows of cells overlapped by rectangle
+
+        Parameters
+        ----------
+            center : Point
+            half_width : float
+            half_height : float
+
+        Returns
+        -------
+            cells_range : tuple
+                (first column, last column, first row, last row)
+        """
+
+        return (
+            int(math.floor((center.x - half_width) / self.cell_size)),
+            int(math.floor((center.x + half_width) / self.cell_size)),
+            int(math.floor((center.y - half_height) / self.cell_size)),
+            int(math.floor((center.y + half_height) / self.cell_size)),
+        )
+
+    def _obj_cells(self, obj):
+        col_min, col_max, row_min, row_max = self._cells_range(
+            obj.pos, obj.width / 2, obj.height / 2)
+        return [(col, row) for col in range(col_min, col_max + 1) for row in range(row_min, row_max + 1)]
+
+    def add(self, obj):
+        """
+        Adds object to the index, object can't change its position nor size while being in the index
+
+        Parameters
+        ----------
+            obj : object with pos (Point), width & height
+
+        Returns
+        -------
+            None
+        """
+
+        if obj in self:
+            return
+
+        self.order[id(obj)] = self._counter
+        self._counter += 1
+        for cell in self._obj_cells(obj):
+            self.cells.setdefault(cell, {})[id(obj)] = obj
+
+    def remove(self, obj):
+        """
+        Removes object from the index, does nothing if it isn't there
+
+        Parameters
+        ----------
+            obj : object with pos (Point), width & height
+
+        Returns
+        -------
+            None
+        """
+
+        if obj not in self:
+            return
+
+        del self.order[id(obj)]
+        for cell in self._obj_cells(obj):
+            cell_objs = self.cells.get(cell)
+            if cell_objs is not None:
+                cell_objs.pop(id(obj), None)
+                if not cell_objs:
+                    del self.cells[cell]
+
+    def query(self, center, half_width, half_height=None):
+        """
+        Returns objects from cells overlapped by given rectangle (candidates, exact check needs to be done separately)
+
+        Parameters
+        ----------
+            center : Point
+                center of the rectangle
+            half_width : float
+            half_height : float
+                default: same as half_width
+
+        Returns
+        -------
+            objs : list
+                objects in insertion order
+        """
+
+        half_height = half_width if half_height is None else half_height
+        col_min, col_max, row_min, row_max = self._cells_range(
+            center, half_width, half_height)
+
+        found = {}
+        for col in range(col_min, col_max + 1):
+            for row in range(row_min, row_max + 1):
+                cell_objs = self.cells.get((col, row))
+                if cell_objs:
+                    found.update(cell_objs)
+
+        return sorted(found.values(), key=lambda obj: self.order[id(obj)])
+
+    def query_radius(self, center, radius):
+        """
+        Returns objects which may be within radius from the center
+
+        Parameters
+        ----------
+            center : Point
+            radius : float
+
+        Returns
+        -------
+            objs : list
+                objects in insertion order
+        """
+
+        return self.query(center, radius, radius)
+
+
+class FrameCounter:
+    """
+    Monotonic step-rate counter, cheap replacement of pygame.time.Clock when frames shouldn't be limited
+
+    Attributes
+    ----------
+        timestamps : collections.deque
+            monotonic timestamps of the last ticks
+
+    Methods
+    -------
+        tick():
+            registers new frame, returns milliseconds since previous one
+        get_fps():
+            returns frames per second averaged over the last ticks
+    """
+
+    def __init__(self, window=100):
+        """
+        Constructs all neccesary attributes for the FrameCounter Object
+
+        Parameters
+        ----------
+            window : int
+                number of last frames used to average FPS
+        """
+
+        self.timestamps = deque(maxlen=window + 1)
+
+    def tick(self):
+        """
+        Registers new frame
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            dt : int
+                milliseconds since previous frame, 0 for the first one
+        """
+
+        now = time.perf_counter()
+        dt = int((now - self.timestamps[-1]) * 1000) if self.timestamps else 0
+        self.timestamps.append(now)
+        return dt
+
+    def get_fps(self):
+        """
+        Calculates frames per second averaged over the last ticks
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            fps : float
+                frames per second, 0 if less than 2 frames were registered
+        """
+
+        if len(self.timestamps) < 2:
+            return 0.0
+        elapsed = self.timestamps[-1] - self.timestamps[0]
+        return (len(self.timestamps) - 1) / elapsed if elapsed > 0 else 0.0
+
+
+class ObservationEncoder:
+    """
+    Writes flat Agent observations straight into preallocated float32 arrays, without building nested dict
+    and calling `gym.spaces.utils.flatten`. Flat layout (field -> position) is computed once from
+    observation space, so result is the same as `flatten` of the dict observation
+
+    Attributes
+    ----------
+        size : int
+            length of flat observation
+        offsets : dict
+            (group, field) -> index of the first value of field in flat observation, e.g. ('agent', 'position')
+        order : np.array of int
+            flat indices of values in `encode` order
+        half_width : float
+            half of the map width, positions are normalized to [-1, 1] by it
+        half_height : float
+            half of the map height
+        half_size : np.array, shape (2, )
+            half_width & half_height
+
+    Methods
+    -------
+        empty(num_envs=None):
+            creates uninitialized float32 buffer for one or many observations
+        encode(out, x, y, direction, cooldown, enemy_x, enemy_y, enemy_direction, walls_available=None):
+            writes one observation into out
+        encode_batch(out, position, direction, cooldown, enemy_position, enemy_direction, walls_available=None):
+            writes observations of many games into out, one row per game
+    """
+
+    # (group, field, number of values) in `encode` order
+    FIELDS = (
+        ('agent', 'position', 2),
+        ('agent', 'direction', 1),
+        ('agent', 'action_cooldown', 1),
+        ('agent', 'walls_available', 1),
+        ('enemy', 'position', 2),
+        ('enemy', 'direction', 1),
+        ('enemy', 'distance', 2),
+    )
+
+    def __init__(self, observation_space, width, height):
+        """
+        Constructs all neccesary attributes for the ObservationEncoder Object
+
+        Parameters
+        ----------
+            observation_space : gym.spaces.Dict
+                Agent observation space, see HideNSeekEnv._create_observation_space_n
+            width : int
+                map width
+            height : int
+                map height
+        """
+
+        self.offsets, self.size = ObservationEncoder._layout(observation_space)
+        self.walls_available = ('agent', 'walls_available') in self.offsets
+        self.order = np.array([
+            self.offsets[group, field] + i
+            for group, field, length in ObservationEncoder.FIELDS
+            if (group, field) in self.offsets
+            for i in range(length)
+        ], dtype=np.int64)
+        if len(self.order) != self.size:
+            raise Exception("Observation space doesn't match ObservationEncoder fields")
+
+        self.half_width = width / 2
+        self.half_height = height / 2
+        self.half_size = np.array([self.half_width, self.half_height])
+
+        # flat indices of every field, used by batched encoding
+        self._position = self.offsets['agent', 'position']
+        self._direction = self.offsets['agent', 'direction']
+        self._cooldown = self.offsets['agent', 'action_cooldown']
+        self._walls_available = self.offsets.get(('agent', 'walls_available'))
+        self._enemy_position = self.offsets['enemy', 'position']
+        self._enemy_direction = self.offsets['enemy', 'direction']
+        self._enemy_distance = self.offsets['enemy', 'distance']
+
+    @staticmethod
+    def _layout(space, key=(), offset=0):
+        """
+        Walks observation space in `gym.spaces.utils.flatten` order
+
+        Parameters
+        ----------
+            space : gym.spaces.Dict or gym.spaces.Box
+                (part of) observation space
+            key : tuple, default=()
+                keys leading to space
+            offset : int, default=0
+                flat index of the first value of space
+
+        Returns
+        -------
+            offsets : dict
+                (group, field) -> flat index of the first value of every Box
+            size : int
+                number of flat values of space
+        """
+
+        if isinstance(space, spaces.Box):
+            return {key[-2:]: offset}, int(np.prod(space.shape))
+        if not isinstance(space, spaces.Dict):
+            raise NotImplementedError(f"ObservationEncoder doesn't support {type(space).__name__} spaces")
+
+        offsets, size = {}, 0
+        for name, subspace in space.spaces.items():
+            sub_offsets, sub_size = ObservationEncoder._layout(subspace, key + (name, ), offset + size)
+            offsets.update(sub_offsets)
+            size += sub_size
+
+        return offsets, size
+
+    def empty(self, num_envs=None):
+        """
+        Creates uninitialized buffer for observations
+
+        Parameters
+        ----------
+            num_envs : int, optional
+                number of observations, single observation by default
+
+        Returns
+        -------
+            buffer : np.array of float32, shape (size, ) or (num_envs, size)
+        """
+
+        return np.empty(self.size if num_envs is None else (num_envs, self.size), dtype=np.float32)
+
+    def encode(self, out, x, y, direction, cooldown, enemy_x, enemy_y, enemy_direction, walls_available=None):
+        """
+        Writes normalized observation of one Agent into out
+
+        Parameters
+        ----------
+            out : np.array of float32, shape (size, )
+                buffer observation is written to
+            x, y : float
+                Agent position
+            direction : float
+                Agent direction, in radians
+            cooldown : float
+                Agent action cooldown, fraction of the initial one
+            enemy_x, enemy_y : float
+                enemy position
+            enemy_direction : float
+                enemy direction, in radians
+            walls_available : float, optional
+                fraction of walls Agent can still add, only if observation space has it
+
+        Returns
+        -------
+            out : np.array of float32, shape (size, )
+        """
+
+        values = (
+            (x - self.half_width) / self.half_width,
+            (y - self.half_height) / self.half_height,
+            direction / (2*math.pi),
+            cooldown,
+        )
+        if self.walls_available:
+            values += (walls_available, )
+        values += (
+            (enemy_x - self.half_width) / self.half_width,
+            (enemy_y - self.half_height) / self.half_height,
+            enemy_direction / (2*math.pi),
+            (enemy_x - x) / self.half_width,
+            (enemy_y - y) / self.half_height,
+        )
+        # one fancy-index assignment is cheaper than setting fields one by one
+        out[self.order] = values
+
+        return out
+
+    def encode_batch(self, out, position, direction, cooldown, enemy_position, enemy_direction, walls_available=None):
+        """
+        Writes normalized observations of one Agent in many games into out, column blocks at once
+
+        Parameters
+        ----------
+            out : np.array of float32, shape (N, size)
+                buffer observations are written to, one row per game
+            position : np.array, shape (N, 2)
+                Agent positions
+            direction : np.array, shape (N, )
+                Agent directions, in radians
+            cooldown : np.array, shape (N, )
+                Agent action cooldowns, fractions of the initial one
+            enemy_position : np.array, shape (N, 2)
+                enemy positions
+            enemy_direction : np.array, shape (N, )
+                enemy directions, in radians
+            walls_available : np.array, shape (N, ), optional
+                fractions of walls Agent can still add, only if observation space has it
+
+        Returns
+        -------
+            out : np.array of float32, shape (N, size)
+        """
+
+        # float64 results are rounded to float32 once, while written into out
+        half_size = self.half_size
+        np.divide(position - half_size, half_size, out=out[:, self._position:self._position + 2], casting='same_kind')
+        np.divide(enemy_position - half_size, half_size,
+                  out=out[:, self._enemy_position:self._enemy_position + 2], casting='same_kind')
+        np.divide(enemy_position - position, half_size,
+                  out=out[:, self._enemy_distance:self._enemy_distance + 2], casting='same_kind')
+        out[:, self._direction] = direction / (2*math.pi)
+        out[:, self._enemy_direction] = enemy_direction / (2*math.pi)
+        out[:, self._cooldown] = cooldown
+        if self.walls_available:
+            out[:, self._walls_available] = walls_available
+
+        return out
+
+
+class AssetCache:
+    """
+    Static, process-wide cache of graphics. Every graphics directory is read from disk only once,
+    surfaces are shared between all Walls & Players, so they shouldn't be modified
+
+    Attributes
+    ----------
+        files : dict
+            graphics directory -> list of file names (os.listdir order)
+        images : dict
+            graphics directory -> list of loaded pygame.Surface
+        tiled : collections.OrderedDict
+            (graphics directory, size, angle in whole degrees) -> pygame.Surface filled with tiled first image & rotated,
+            the least recently used surfaces are evicted above tiled_max entries
+        tiled_max : int
+            maximal number of tiled surfaces kept in cache
+
+    Methods
+    -------
         @staticmethod
-        searcher(x1, y1, objects, map)
+        list_files(path):
+            returns file names in graphics directory
+        @staticmethod
+        load_images(path):
+            returns all images from graphics directory
+        @staticmethod
+        tiled_surface(path, size, angle):
+            returns surface of given size filled with the first image from graphics directory, rotated by angle
+        @staticmethod
+        clear():
+            removes all cached graphics
+    """
+
+    files = {}
+    images = {}
+    tiled = OrderedDict()
+    tiled_max = 256
+
+    @staticmethod
+    def list_files(path):
+        """
+        Returns file names in graphics directory, directory is listed only once
+
+        Parameters
+        ----------
+            path : str
+                graphics directory
+
+        Returns
+        -------
+            files : list of str
+        """
+
+        if path not in AssetCache.files:
+            AssetCache.files[path] = os.listdir(path)
+        return AssetCache.files[path]
+
+    @staticmethod
+    def load_images(path):
+        """
+        Returns all images from graphics directory, in AssetCache.list_files order; loaded only once
+
+        Parameters
+        ----------
+            path : str
+                graphics directory
+
+        Returns
+        -------
+            images : list of pygame.Surface
+                shared surfaces
+        """
+
+        if path not in AssetCache.images:
+            AssetCache.images[path] = [pygame.image.load(os.path.join(path, file_))
+                                       for file_ in AssetCache.list_files(path)]
+        return AssetCache.images[path]
+
+    @staticmethod
+    def tiled_surface(path, size, angle=0):
+        """
+        Returns surface of given size filled (tiled) with the first image from graphics directory & rotated by angle.
+        Memoized by size & rotation rounded to whole degrees, so i.e. Walls created during the game (with any Agent
+        direction) don't need to be drawn from scratch; only tiled_max recently used surfaces are kept
+
+        Parameters
+        ----------
+            path : str
+                graphics directory
+            size : tuple
+                surface size before rotation
+            angle : float
+                rotation angle in radians, rounded to whole degrees
+
+        Returns
+        -------
+            image : pygame.Surface
+                shared surface, with colorkey (0, 0, 0)
+        """
+
+        degrees = round(math.degrees(angle)) % 360
+        key = (path, tuple(size), degrees)
+        if key in AssetCache.tiled:
+            AssetCache.tiled.move_to_end(key)
+            return AssetCache.tiled[key]
+
+        image = pygame.Surface(size)
+        image.fill((0, 0, 0, 0))
+        image.set_colorkey((0, 0, 0))
+
+        filling = AssetCache.load_images(path)[0]
+        filling_width = filling.get_width()
+        filling_height = filling.get_height()
+
+        img_rounded_size_w = math.ceil(size[0] / filling_width)
+        img_rounded_size_h = math.ceil(size[1] / filling_height)
+
+        blit_list = [(filling, (filling_width * i, j * filling_height)) for i in range(0, img_rounded_size_w) for j in range(0, img_rounded_size_h)]
+        image.blits(blit_list)
+
+        if degrees:
+            image = pygame.transform.rotozoom(image, -degrees, 1)
+            image.set_colorkey((0, 0, 0))
+
+        AssetCache.tiled[key] = image
+        if len(AssetCache.tiled) > AssetCache.tiled_max:
+            AssetCache.tiled.popitem(last=False)
+        return image
+
+    @staticmethod
+    def clear():
+        """
+        Removes all cached graphics, i.e. after changing files in graphics directories
+
+        Parameters
+        ----------
+            None
+
+        Returns
+        -------
+            None
+        """
+
+        AssetCache.files.clear()
+        AssetCache.images.clear()
+        AssetCache.tiled.clear()
+
+
+class MapGenerator:
+    """
+    Map Generator class, creating map form a picture
+
+    Attributes
+    ----------
+        COMPILED_MAP_VERSION : int
+            version of compiled map format
+
+    Methods
+    -------
+        @staticmethod
+        open_bmp(filename):
+            returns map from bmp
+        @staticmethod
+        get_compiled_map(filename, cache_path, palette):
+            returns compiled map (objects, size & walls edges), parses bmp only if its content changed
+        @staticmethod
+        get_objects_coordinates(map, palette):
+            returns objects with their types and positions
+        @staticmethod
+        get_predefined_palette()
+            returns dictionary of types of objects and their colors
+        @staticmethod
+        searcher(x1, y1, ids, covered)
             returns the last point from figure
     """
 
+    # incremented whenever compiled map format changes, older compiled maps are then regenerated
+    COMPILED_MAP_VERSION = 1
+
     @staticmethod
     def open_bmp(filename):
         """
@@ -634,43 +1940,126 @@ class MapGenerator:
                 if intersection exists, returns the Point object; else None
         """
 
-        return Image.open(filename + '.bmp' if '.bmp' not in filename else filename)
+        return Image.open(MapGenerator._bmp_filename(filename))
+
+    @staticmethod
+    def _bmp_filename(filename):
+        return filename + '.bmp' if '.bmp' not in filename else filename
+
+    @staticmethod
+    def _rectangle_edges(obj):
+        """"
+        Calculates edges of the object rectangle, the same way as Wall does (top left vertex first, clockwise)
+
+        Parameters
+        ----------
+        obj :   object dictionary, cointains type and vertices
+
+        Returns
+        ----------
+        edges : list of [[x, y], [x, y]]
+        """
+
+        center_x = (obj["vertices"][0]["x"] + obj["vertices"][1]["x"]) / 2
+        center_y = (obj["vertices"][0]["y"] + obj["vertices"][1]["y"]) / 2
+        half_width = (obj["vertices"][1]["x"] - obj["vertices"][0]["x"]) / 2
+        half_height = (obj["vertices"][1]["y"] - obj["vertices"][0]["y"]) / 2
+
+        vertices = [
+            [center_x - half_width, center_y - half_height],
+            [center_x + half_width, center_y - half_height],
+            [center_x + half_width, center_y + half_height],
+            [center_x - half_width, center_y + half_height],
+        ]
+        return [[vertices[i], vertices[(i + 1) % 4]] for i in range(4)]
 
     @staticmethod
-    def in_object(list_objects, x, y):
+    def get_compiled_map(filename, cache_path, palette=None):
         """"
-        Checks if position is NOT in object
+        Returns compiled map. Compiled maps are stored as JSON in cache_path, keyed by the bmp content hash,
+        so bmp is parsed only when it changes; many processes may load (or compile) the same map at once
 
         Parameters
         ----------
-        list_objects : contains list of objects as dictionary
+        filename :      name of the bmp file
+
+        cache_path :    folder with compiled maps, created if needed
 
-        x, y : position of point
+        palette :       colors and types of objects, MapGenerator.get_predefined_palette() if None
 
         Returns
-        -------
-            True or False : if list is empty                - return False
-                            if point is in object           - return True
-                            if point is NOT in any object   - return False
+        ----------
+        compiled_map :  dictionary with map size, objects (like MapGenerator.get_objects_coordinates)
+                        and edges of every wall object (like MapGenerator._rectangle_edges), in objects order
         """
 
-        if not len(list_objects):
-            return False
+        palette = palette or MapGenerator.get_predefined_palette()
+        filename = MapGenerator._bmp_filename(filename)
+        with open(filename, 'rb') as f:
+            content = f.read()
+
+        content_hash = hashlib.sha1(content + json.dumps(
+            palette, sort_keys=True).encode()).hexdigest()
+        compiled_filename = os.path.join(cache_path, '%s-%s.json' % (
+            os.path.splitext(os.path.basename(filename))[0], content_hash))
+
+        if os.path.exists(compiled_filename):
+            with open(compiled_filename) as f:
+                compiled_map = json.load(f)
+            if compiled_map.get('version') == MapGenerator.COMPILED_MAP_VERSION:
+                return compiled_map
+
+        with Image.open(io.BytesIO(content)) as map:
+            objects = MapGenerator.get_objects_coordinates(map, palette)
+            size = list(map.size)
+
+        compiled_map = {
+            "version": MapGenerator.COMPILED_MAP_VERSION,
+            "hash": content_hash,
+            "size": size,
+            "objects": objects,
+            "walls_edges": [MapGenerator._rectangle_edges(obj) for obj in objects if obj["type"] == "wall"],
+        }
+
+        # write & rename, so other processes never read half-written file
+        os.makedirs(cache_path, exist_ok=True)
+        fd, tmp_filename = tempfile.mkstemp(dir=cache_path, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(compiled_map, f)
+        os.replace(tmp_filename, compiled_filename)
 
-        for objects in list_objects:
-            if (
-                x >= objects["vertices"][0]["x"]
-                and x <= objects["vertices"][1]["x"]
-                and y >= objects["vertices"][0]["y"]
-                and y <= objects["vertices"][1]["y"]
-            ):
-                return True
-        return False
+        return compiled_map
+
+    @staticmethod
+    def _colors_to_ids(map):
+        """
+        Maps every pixel color to the id of the color in one pass
+
+        Parameters
+        ----------
+        map : map of the world
+
+        Returns
+        ----------
+        ids :       np.array of int, shape (height, width)
+                    index of pixel color in colors
+
+        colors :    list of str
+                    unique colors, in '#rrggbb' format
+        """
+
+        pixels = np.asarray(map.convert('RGB'), dtype=np.int64)
+        codes = (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+        unique_codes, ids = np.unique(codes, return_inverse=True)
+        colors = ['#%06x' % code for code in unique_codes.tolist()]
+
+        return ids.reshape(codes.shape), colors
 
     @staticmethod
     def get_objects_coordinates(map, palette):
         """"
-        Checks coordinates of all objects
+        Checks coordinates of all objects. Map is scanned column by column, every not covered, not background pixel
+        starts new object; its rectangle is found by MapGenerator.searcher. All scans are NumPy array operations
 
         Parameters
         ----------
@@ -684,29 +2073,43 @@ class MapGenerator:
                     cointains type and vertices
         """
 
+        ids, colors = MapGenerator._colors_to_ids(map)
+        background = colors.index('#ffffff') if '#ffffff' in colors else -1
+        covered = np.zeros(ids.shape, dtype=bool)
+
         objects = []
 
-        for x in range(0, map.size[0], 1):
-            for y in range(0, map.size[1], 1):
-                if not MapGenerator.in_object(objects, x, y):
-                    this_pixel = map.getpixel((x, y))[0:3]
-                    if this_pixel != (255, 255, 255):
-                        tmp_coordinates = MapGenerator.searcher(
-                            x, y, objects, map)
-                        tmp_object = {
-                            "type": palette['#%02x%02x%02x' % this_pixel],
-                            "vertices": [
-                                {
-                                    "x": x,
-                                    "y": y
-                                },
-                                {
-                                    "x": tmp_coordinates[0],
-                                    "y": tmp_coordinates[1]
-                                }
-                            ]
-                        }
-                        objects.append(tmp_object)
+        # column by column, like x & y loops
+        candidates = np.flatnonzero((ids != background).T)
+        height = ids.shape[0]
+        i = 0
+        while i < len(candidates):
+            x, y = divmod(int(candidates[i]), height)
+            if covered[y, x]:
+                # skip to the first candidate not covered by any object
+                not_covered = ~covered.T.ravel()[candidates[i:]]
+                if not not_covered.any():
+                    break
+                i += int(np.argmax(not_covered))
+                continue
+
+            color = colors[ids[y, x]]
+            tmp_coordinates = MapGenerator.searcher(x, y, ids, covered)
+            objects.append({
+                "type": palette[color],
+                "vertices": [
+                    {
+                        "x": x,
+                        "y": y
+                    },
+                    {
+                        "x": tmp_coordinates[0],
+                        "y": tmp_coordinates[1]
+                    }
+                ]
+            })
+            covered[y:tmp_coordinates[1] + 1, x:tmp_coordinates[0] + 1] = True
+            i += 1
         return objects
 
     @staticmethod
@@ -735,53 +2138,252 @@ class MapGenerator:
         }
 
     @staticmethod
-    def searcher(x1, y1, objects, map):
+    def _run_length(mask):
+        """
+        Returns number of leading True values
+
+        Parameters
+        ----------
+        mask : np.array of bool, 1D
+
+        Returns
+        ----------
+        length : int
+        """
+
+        return int(np.argmin(mask)) if not mask.all() else len(mask)
+
+    @staticmethod
+    def searcher(x1, y1, ids, covered):
         """"
         Searcher looks for the ends of new object in map.
         It is used only when we start looking for a new object.
+        Object grows right along the first row, then down while all inner pixels of the row
+        have the same color and aren't covered by other objects
 
         Parameters
         ----------
         x1, y1 :    primary coordinates
 
-        objects :   list of objects
+        ids :       color id of every pixel, np.array of int, shape (height, width)
 
-        map :       picture, where algorithm looks for objects
+        covered :   pixels covered by already found objects, np.array of bool, shape (height, width)
 
         Returns
         ----------
         x2, y2 :    coordinates of the end of figure
         """
 
-        x2 = x1
-        y2 = y1
-        color = map.getpixel((x1, y1))[0:3]
+        color = ids[y1, x1]
 
         # ===================
         # check x
-        for x in range(x1 + 1, map.size[0], 1):
-            if not MapGenerator.in_object(objects, x, y1):
-                if map.getpixel((x, y1))[0:3] == color:
-                    x2 = x2 + 1
-                else:
-                    break
-            else:
-                break
+        x2 = x1 + MapGenerator._run_length(
+            (ids[y1, x1 + 1:] == color) & ~covered[y1, x1 + 1:])
 
         # ===================
         # check y
-        ended = False
-        for y in range(y1 + 1, map.size[1], 1):
-            if ended:
-                break
-            for x in range(x1 + 1, x2, 1):
-                if not MapGenerator.in_object(objects, x, y):
-                    if (map.getpixel((x, y))[0:3] != color):
-                        ended = True
-                        break
-                else:
-                    ended = True
-                    break
-            if (ended == False):
-                y2 = y2 + 1
+        rows = (ids[y1 + 1:, x1 + 1:x2] == color) & ~covered[y1 + 1:, x1 + 1:x2]
+        y2 = y1 + MapGenerator._run_length(rows.all(axis=1))
         return x2, y2
+
+
+class ProceduralMapGenerator:
+    """
+    Seeded procedural map generator, creates objects in the MapGenerator.get_objects_coordinates format
+    without drawing any picture. Map is a grid of cells (corridor_width wide) separated by grid lines; walls are
+    placed on grid lines, one by one, as long as every cell can still be reached from every other cell
+
+    Attributes
+    ----------
+        None
+
+    Methods
+    -------
+        @staticmethod
+        generate_objects(width, height, wall_density, corridor_width, spawn_separation, agent_size, wall_thickness, seed):
+            returns objects with their types and positions
+        @staticmethod
+        _rectangle(type_, x, y, width, height)
+            returns object dictionary
+        @staticmethod
+        _cells_connected(columns, rows, blocked)
+            returns if all cells are reachable
+    """
+
+    @staticmethod
+    def _rectangle(type_, x, y, width, height):
+        """"
+        Creates object dictionary; vertices are inclusive, like in the objects found in the bmp
+
+        Parameters
+        ----------
+        type_ :             object type (i.e. wall, seeker, hider)
+
+        x, y :              top left pixel
+
+        width, height :     object size in pixels
+
+        Returns
+        ----------
+        object :    dictionary with type and vertices
+        """
+
+        return {
+            "type": type_,
+            "vertices": [
+                {
+                    "x": x,
+                    "y": y
+                },
+                {
+                    "x": x + width - 1,
+                    "y": y + height - 1
+                }
+            ]
+        }
+
+    @staticmethod
+    def _cells_connected(columns, rows, blocked):
+        """"
+        Checks if every cell is reachable from the first one (BFS)
+
+        Parameters
+        ----------
+        columns, rows :     grid size
+
+        blocked :           set of blocked passages ((column, row), (column, row)), between neighbouring cells
+
+        Returns
+        ----------
+        connected : bool
+        """
+
+        visited = {(0, 0)}
+        queue = deque([(0, 0)])
+        while queue:
+            column, row = queue.popleft()
+            for neighbour in [(column + 1, row), (column - 1, row), (column, row + 1), (column, row - 1)]:
+                if (
+                    0 <= neighbour[0] < columns and 0 <= neighbour[1] < rows
+                    and neighbour not in visited
+                    and (min((column, row), neighbour), max((column, row), neighbour)) not in blocked
+                ):
+                    visited.add(neighbour)
+                    queue.append(neighbour)
+        return len(visited) == columns * rows
+
+    @staticmethod
+    def generate_objects(width=512, height=512, wall_density=.1, corridor_width=64, spawn_separation=256,
+                         agent_size=48, wall_thickness=8, seed=None):
+        """"
+        Generates map objects: border walls, inner walls, Seeker & Hiding spawn rectangles.
+        Every corridor is at least corridor_width wide and whole map stays connected
+
+        Parameters
+        ----------
+        width, height :     map size
+
+        wall_density :      part of the map (inside border walls) which should be covered by inner walls;
+                            upper bound, walls are never added if they would disconnect the map
+
+        corridor_width :    minimal distance between walls, at least agent_size
+
+        spawn_separation :  minimal distance between Seeker & Hiding spawn centers
+
+        agent_size :        Seeker & Hiding size
+
+        wall_thickness :    thickness of every wall
+
+        seed :              random seed, the same seed & parameters give the same map
+
+        Returns
+        ----------
+        objects :   dictionary of all objects
+                    cointains type and vertices
+        """
+
+        if agent_size > corridor_width:
+            raise Exception(
+                f"Agent (size {agent_size}) doesn't fit in corridor (width {corridor_width})")
+
+        rng = random.Random(seed)
+        pitch = corridor_width + wall_thickness
+        columns = (width - wall_thickness) // pitch
+        rows = (height - wall_thickness) // pitch
+        if columns < 1 or rows < 1:
+            raise Exception(
+                f"Map {width}x{height} is too small for corridor width {corridor_width}")
+
+        # last cells take what's left, so border walls are always at the map edges
+        def cell_start(i):
+            return wall_thickness + i * pitch
+
+        def cell_end(i, count, size):
+            return cell_start(i) + corridor_width if i < count - 1 else size - wall_thickness
+
+        objects = [
+            ProceduralMapGenerator._rectangle(
+                "wall", 0, 0, width, wall_thickness),
+            ProceduralMapGenerator._rectangle(
+                "wall", 0, wall_thickness, wall_thickness, height - 2 * wall_thickness),
+            ProceduralMapGenerator._rectangle(
+                "wall", width - wall_thickness, wall_thickness, wall_thickness, height - 2 * wall_thickness),
+            ProceduralMapGenerator._rectangle(
+                "wall", 0, height - wall_thickness, width, wall_thickness),
+        ]
+
+        inner_area = (width - 2 * wall_thickness) * \
+            (height - 2 * wall_thickness)
+        walls_area = 0
+        blocked = set()
+        attempts = 10 * columns * rows
+        while walls_area < wall_density * inner_area and attempts:
+            attempts -= 1
+            vertical = rng.random() < .5
+            # wall on the line between cell `line` and `line + 1`, along cells [start; end]
+            lines, cells = (columns, rows) if vertical else (rows, columns)
+            if lines < 2:
+                continue
+            line = rng.randrange(lines - 1)
+            start = rng.randrange(cells)
+            end = min(cells - 1, start + rng.randrange(max(cells // 2, 1)))
+
+            passages = set()
+            for cell in range(start, end + 1):
+                passage = ((line, cell), (line + 1, cell)) if vertical else (
+                    (cell, line), (cell, line + 1))
+                passages.add(passage)
+            if passages & blocked or not ProceduralMapGenerator._cells_connected(columns, rows, blocked | passages):
+                continue
+            blocked |= passages
+
+            along_start = cell_start(start) - (wall_thickness if start else 0)
+            along_end = cell_end(end, cells, height if vertical else width) + \
+                (wall_thickness if end < cells - 1 else 0)
+            across = cell_start(line) + corridor_width
+            if vertical:
+                objects.append(ProceduralMapGenerator._rectangle(
+                    "wall", across, along_start, wall_thickness, along_end - along_start))
+            else:
+                objects.append(ProceduralMapGenerator._rectangle(
+                    "wall", along_start, across, along_end - along_start, wall_thickness))
+            walls_area += wall_thickness * (along_end - along_start)
+
+        # spawn in the centers of 2 random cells, far enough from each other
+        centers = [((cell_start(column) + cell_end(column, columns, width)) // 2,
+                    (cell_start(row) + cell_end(row, rows, height)) // 2)
+                   for column in range(columns) for row in range(rows)]
+        pairs = [(seeker, hider) for seeker in centers for hider in centers
+                 if math.hypot(seeker[0] - hider[0], seeker[1] - hider[1]) >= spawn_separation]
+        if not pairs:
+            raise Exception(
+                f"There are no spawn points separated by at least {spawn_separation}")
+        seeker, hider = rng.choice(pairs)
+
+        objects.append(ProceduralMapGenerator._rectangle(
+            "seeker", seeker[0] - agent_size // 2, seeker[1] - agent_size // 2, agent_size + 1, agent_size + 1))
+        objects.append(ProceduralMapGenerator._rectangle(
+            "hider", hider[0] - agent_size // 2, hider[1] - agent_size // 2, agent_size + 1, agent_size + 1))
+
+        return objects
@@ -8,12 +8,14 @@ from pathlib import Path
 import random
 import shutil
 import statistics
+import threading
 
 import gym
 
 from game_env.hidenseek_gym import wrappers as multi_wrappers
+from game_env.hidenseek_gym.envs import HideNSeekSubprocVecEnv
 from game_env.hidenseek_gym.controllable import Seeker, Hiding
-from game_env.hidenseek_gym.supportive import Point, MapGenerator
+from game_env.hidenseek_gym.supportive import Point, MapGenerator, ProceduralMapGenerator, SpatialHash
 from game_env.hidenseek_gym.fixed import Wall
 from rl import A2C, PPO, DQN
 
@@ -58,12 +60,16 @@ class Helpers:
 
         # checkboxes
         tree['game']['reverse'] = True if 'game-reverse' in config_data else False
+        tree['game']['realtime'] = True if 'game-realtime' in config_data else False
         tree['game']['continuous_reward'] = True if 'game-continuous_reward' in config_data else False
+        tree['game']['actor_learner'] = True if 'game-actor_learner' in config_data else False
         tree['video']['draw_pov'] = True if 'video-draw_pov' in config_data else False
         tree['video']['monitoring'] = True if 'video-monitoring' in config_data else False
 
         tree['game']['graphics_path_wall'] = default_config['game']['graphics_path_wall']
         tree['game']['graphics_path_wall_owner'] = default_config['game']['graphics_path_wall_owner']
+        tree['game']['map_cache_path'] = default_config['game']['map_cache_path']
+        tree['video']['progress_interval'] = default_config['video']['progress_interval']
         tree['seeker']['graphics_path'] = default_config['seeker']['graphics_path']
         tree['hiding']['graphics_path'] = default_config['hiding']['graphics_path']
 
@@ -75,19 +81,27 @@ class Helpers:
         return new_cfg
 
     @staticmethod
-    def _generate_map(all_objects, map_bmp, cfg):
+    def _generate_map(all_objects, size, cfg, walls_edges=None):
         """
-        Generates map by using BMP File
+        Generates map by using objects parsed from BMP File
 
         Parameters
         ----------
             all_objects : dict
                 dictionary of objects to add into the game
+            size : tuple
+                map width & height
+            cfg : dict
+                game config
+            walls_edges : list, optional
+                precomputed edges of every wall object, in all_objects order (i.e. from compiled map)
 
         Returns
         -------
             walls_group : list
                 list of wall objects
+            walls_index : hidenseek_gym.supportive.SpatialHash
+                spatial index of wall objects
             player_seek : Object
                 Seeker object.
             player_hide : Object
@@ -101,7 +115,8 @@ class Helpers:
         walls_group = []
         player_seek = None
         player_hide = None
-        width, height = map_bmp.size
+        width, height = size
+        walls_edges = iter(walls_edges) if walls_edges is not None else None
 
         for obj in all_objects:
             center_x = (obj["vertices"][0]["x"] + obj["vertices"][1]["x"]) / 2
@@ -114,7 +129,8 @@ class Helpers:
             if obj["type"] == "wall":
                 wall_direction = math.pi / 2 if obj_width > obj_height else 0
                 walls_group.append(
-                    Wall(None, center_x, center_y, obj_size, cfg['game']['graphics_path_wall'], wall_direction))
+                    Wall(None, center_x, center_y, obj_size, cfg['game']['graphics_path_wall'], wall_direction,
+                         edges=next(walls_edges) if walls_edges is not None else None))
 
             elif obj["type"] == "seeker":
                 player_seek = Seeker(
@@ -124,23 +140,62 @@ class Helpers:
                 player_hide = Hiding(
                     cfg['hiding'], obj_size, (center_x, center_y), width, height)
 
-        return walls_group, player_seek, player_hide, width, height
+        # built once per map, cell size close to Agents vision, because it's the most common query
+        walls_index = SpatialHash(
+            max(player_seek.vision_radius, player_hide.vision_radius), walls_group)
+
+        return walls_group, walls_index, player_seek, player_hide, width, height
 
     @staticmethod
     def prepare_map(cfg):
-        map_bmp = MapGenerator.open_bmp(cfg['game']['map'])
-        all_objects = MapGenerator.get_objects_coordinates(
-            map_bmp, MapGenerator.get_predefined_palette())
+        # BMP is parsed only if it has changed since the last compilation
+        compiled_map = MapGenerator.get_compiled_map(
+            cfg['game']['map'], cfg['game']['map_cache_path'])
+
+        return Helpers._generate_map(
+            compiled_map['objects'], compiled_map['size'], cfg, compiled_map['walls_edges'])
+
+    @staticmethod
+    def generate_map(cfg, width=512, height=512, wall_density=.1, corridor_width=64, spawn_separation=256, seed=None):
+        """
+        Generates new procedural map (ProceduralMapGenerator), without any BMP file.
+        Returns the same objects as Helpers.prepare_map, so i.e. every episode may use fresh map
+
+        Parameters
+        ----------
+            cfg : dict
+                game config
+            width, height : int
+                map size
+            wall_density : float
+                part of the map covered by inner walls
+            corridor_width : int
+                minimal distance between walls
+            spawn_separation : float
+                minimal distance between Seeker & Hiding spawn points
+            seed : int
+                random seed, the same seed gives the same map
 
-        walls, seeker, hider, width, height = Helpers._generate_map(
-            all_objects, map_bmp, cfg)
+        Returns
+        -------
+            walls_group, walls_index, player_seek, player_hide, width, height
+                like Helpers._generate_map
+        """
 
-        map_bmp.close()  # memory management
+        all_objects = ProceduralMapGenerator.generate_objects(
+            width, height, wall_density, corridor_width, spawn_separation, seed=seed)
 
-        return walls, seeker, hider, width, height
+        return Helpers._generate_map(all_objects, (width, height), cfg)
 
     @staticmethod
     def pick_algorithm(cfg, **kwargs):
+        if kwargs.get('num_envs', 1) > 1 and cfg['game']['algorithm'] != 'ppo':
+            raise NotImplementedError(
+                f"Given algorithm (`{cfg['game']['algorithm']}`) can't be trained on many environments at once yet, use PPO or 1 worker")
+        if kwargs.get('actor_learner', False) and cfg['game']['algorithm'] != 'ppo':
+            raise NotImplementedError(
+                f"Given algorithm (`{cfg['game']['algorithm']}`) doesn't support Actor-Learner topology yet, use PPO")
+
         if cfg['game']['algorithm'] == 'a2c':
             return A2C(
                 env=kwargs['env'],
@@ -165,7 +220,12 @@ class Helpers:
                 betas=(0.9, 0.999),
                 K_epochs=4,
                 eps_clip=0.2,
-                update_timestep=round(kwargs['env'].cfg['duration'] * 0.04)
+                update_timestep=round(cfg['game']['duration'] * 0.04),
+                minibatch_size=64,
+                gae_lambda=0.95,
+                value_clip=0.2,
+                target_kl=0.015,
+                num_envs=kwargs.get('num_envs', 1),
             )
         elif cfg['game']['algorithm'] == 'dqn':
             return DQN(
@@ -179,6 +239,7 @@ class Helpers:
                 n_inputs_n=[kwargs['env'].flatten_observation_space_n[j].shape[0]
                             for j in range(kwargs['agents'])],
                 n_outputs=kwargs['env'].action_space.n,
+                replay=cfg['game']['replay'],
             )
         else:
             raise NotImplementedError(
@@ -196,7 +257,7 @@ class Helpers:
         )
 
     @staticmethod
-    def create_env(config, width, height, hiding, seeker, walls, start_date, core_id):
+    def create_env(config, width, height, hiding, seeker, walls, walls_index, start_date, core_id):
         render_mode = 'rgb_array'
         env = gym.make(
             'hidenseek-v1',
@@ -205,7 +266,8 @@ class Helpers:
             height=height,
             seeker=seeker,
             hiding=hiding,
-            walls=walls
+            walls=walls,
+            walls_index=walls_index,
         )
 
         monitor_folder = 'monitor/' + start_date + '/core-' + str(core_id)
@@ -221,6 +283,101 @@ class Helpers:
 
         return env, step_img_path, [], render_mode, [[], []]
 
+    @staticmethod
+    def env_fn(config, width, height, hiding, seeker, walls, walls_index):
+        """
+        Creates factory of HideNSeekEnv, called in forked worker processes,
+        so every worker has its own copy of Agents & Walls
+
+        Parameters
+        ----------
+            config : dict
+                game config
+            width : int
+                map width
+            height : int
+                map height
+            hiding : hidenseek_gym.controllable.Hiding
+                Hiding Agent
+            seeker : hidenseek_gym.controllable.Seeker
+                Seeker Agent
+            walls : list of hidenseek_gym.fixed.Wall
+                map walls
+            walls_index : hidenseek_gym.supportive.SpatialHash
+                spatial index of map walls
+
+        Returns
+        -------
+            env_fn : callable
+                creates HideNSeekEnv
+        """
+
+        def env_fn():
+            return gym.make(
+                'hidenseek-v1',
+                config=config,
+                width=width,
+                height=height,
+                seeker=seeker,
+                hiding=hiding,
+                walls=walls,
+                walls_index=walls_index,
+            )
+
+        return env_fn
+
+    @staticmethod
+    def create_vec_env(config, width, height, hiding, seeker, walls, walls_index, core_id, num_envs, context=None):
+        """
+        Creates Subprocess Vectorized Environment, every game is stepped in its own worker process;
+        games aren't recorded by Monitor, status image is rendered from the first one
+
+        Parameters
+        ----------
+            config : dict
+                game config
+            width : int
+                map width
+            height : int
+                map height
+            hiding : hidenseek_gym.controllable.Hiding
+                Hiding Agent, copied to every worker
+            seeker : hidenseek_gym.controllable.Seeker
+                Seeker Agent, copied to every worker
+            walls : list of hidenseek_gym.fixed.Wall
+                map walls, copied to every worker
+            walls_index : hidenseek_gym.supportive.SpatialHash
+                spatial index of map walls, copied to every worker
+            core_id : int
+                Celery task core id
+            num_envs : int
+                number of worker processes
+            context : multiprocessing context, optional
+                context used to start worker processes
+
+        Returns
+        -------
+            env : hidenseek_gym.envs.HideNSeekSubprocVecEnv
+                vectorized environment
+            step_img_path : str
+                path to status image
+            fps_batch : list
+                empty list for FPS of every episode
+            render_mode : str
+                render mode of status image
+            wins_l : list of list
+                empty lists of Seeker & Hiding wins
+        """
+
+        env_fn = Helpers.env_fn(config, width, height, hiding, seeker, walls, walls_index)
+
+        # dead workers are detected by process sentinels, timeout covers the ones which are alive but stuck
+        env = HideNSeekSubprocVecEnv([env_fn] * num_envs, context=context, timeout=60)
+        step_img_path = '/opt/app/static/images/core-' + \
+            str(core_id) + '/last_frame.jpg'
+
+        return env, step_img_path, [], 'rgb_array', [[], []]
+
     @staticmethod
     def new_ep(env):
         # obs_n, reward_n, rewards_ep, done, fps_episode
@@ -296,3 +453,82 @@ class Helpers:
             'fps_quantiles': [round(quantile) for quantile in statistics.quantiles(fps_batch)],
             'wins': wins,
         }
+
+
+class ProgressPublisher:
+    """
+    Publishes training progress from background thread; training loop only stores the latest counters,
+    which are turned into metadata and sent at most once per interval, or right away when flushed (episode boundaries).
+    Updates between two publications are coalesced, only the newest one is sent
+
+    Attributes
+    ----------
+        publish : callable
+            sends metadata, e.g. Celery `update_state`
+        build : callable
+            turns arguments passed to `update` into metadata, called on background thread
+        interval : float
+            minimal time between two publications (in seconds), unless flushed
+
+    Methods
+    -------
+        update(*args):
+            stores the latest counters, cheap enough to be called every frame
+        flush():
+            publishes the latest counters as soon as possible
+        start():
+            starts background thread
+        stop():
+            publishes what is left and stops background thread
+    """
+
+    def __init__(self, publish, build, interval):
+        self.publish = publish
+        self.build = build
+        self.interval = interval
+
+        self._version = 0
+        self._latest = (0, None)  # (version, args), swapped as a whole so background thread never sees half of update
+        self._published_version = 0
+
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='progress-publisher', daemon=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def update(self, *args):
+        self._version += 1
+        self._latest = (self._version, args)
+
+    def flush(self):
+        self._wake.set()
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stopped.set()
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._publish_latest()
+
+        self._publish_latest()
+
+    def _publish_latest(self):
+        version, args = self._latest
+        if version == self._published_version:
+            return
+
+        self.publish(self.build(*args))
+        self._published_version = version
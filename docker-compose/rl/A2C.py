@@ -1,4 +1,5 @@
 from . import TrainingAlgorithm
+from .returns import discounted_returns
 
 import torch
 import torch.nn as nn
@@ -20,7 +21,10 @@ class ActorCritic(nn.Module):
         self.actor_linear2 = nn.Linear(hidden_size, num_actions)
 
     def forward(self, state):
-        state = Variable(torch.from_numpy(state).float().unsqueeze(0))
+        # single observation (n_inputs, ) or batch of observations (B, n_inputs)
+        state = torch.as_tensor(np.asarray(state, dtype=np.float32))
+        if state.dim() == 1:
+            state = state.unsqueeze(0)
         value = F.relu(self.critic_linear1(state))
         value = self.critic_linear2(value)
 
@@ -58,13 +62,7 @@ class A2C(TrainingAlgorithm):
 
         # before_action, changes every frame
         self.value_n = None
-        self.policy_dist_n = None
-        self.dist_n = None
-
-        # take_action
         self.action_n = None
-
-        # before_step
         self.log_prob_n = None
         self.entropy_n = None
 
@@ -91,22 +89,60 @@ class A2C(TrainingAlgorithm):
         self.values_n = [[], []]
         self.rewards_n =  [[], []]
 
-    def before_action(self, *args, **kwargs):
-        self.value_n = [None, None]
-        self.policy_dist_n = [None, None]
-
+    def select_actions(self, obs_n):
+        """
+        Batched action selection: observations of every agent are stacked across environments,
+        so every policy runs only one forward per frame
+
+        Parameters
+        ----------
+            obs_n : list of np.array, shape (B, n_inputs)
+                observations of every agent in B environments
+
+        Returns
+        -------
+            action_n : np.array of int, shape (B, num_agents)
+                sampled actions
+            log_prob_n : list of torch.Tensor, shape (B, )
+                log-probabilities of sampled actions, with gradient; not stacked across agents,
+                so the graph of every agent stays separate (every agent is updated by its own backward)
+            value_n : np.array, shape (B, num_agents)
+                critic values
+            entropy_n : np.array, shape (B, num_agents)
+                policy entropy terms
+        """
+
+        action_n, log_prob_n, value_n, entropy_n = [], [], [], []
         for j in range(self.num_agents):
-            self.value_n[j], self.policy_dist_n[j] = self.actor_critic_n[j].forward(kwargs['obs_n'][j])
+            value, policy_dist = self.actor_critic_n[j].forward(obs_n[j])
+            dist = policy_dist.detach().numpy()
+
+            # inverse CDF sampling, for every environment at once
+            uniform = np.random.rand(dist.shape[0], 1)
+            action = np.minimum((dist.cumsum(axis=1) < uniform).sum(axis=1), self.num_outputs - 1)
 
-        self.value_n = [val.detach().numpy()[0, 0] for val in self.value_n]
-        self.dist_n = [pol_dist.detach().numpy() for pol_dist in self.policy_dist_n]
+            action_n.append(action)
+            log_prob_n.append(torch.log(policy_dist.gather(1, torch.from_numpy(action).unsqueeze(1)).squeeze(1)))
+            value_n.append(value.detach().numpy()[:, 0])
+            entropy_n.append(-np.sum(np.mean(dist, axis=1, keepdims=True) * np.log(dist), axis=1))
+
+        return np.stack(action_n, axis=1), log_prob_n, np.stack(value_n, axis=1), np.stack(entropy_n, axis=1)
+
+    def before_action(self, *args, **kwargs):
+        # one environment, so batch of size 1
+        action_n, log_prob_n, value_n, entropy_n = self.select_actions(
+            [np.asarray(kwargs['obs_n'][j])[None] for j in range(self.num_agents)])
+
+        self.action_n = action_n[0].tolist()
+        self.log_prob_n = [log_prob_n[j][0] for j in range(self.num_agents)]
+        self.value_n = value_n[0].tolist()
+        self.entropy_n = entropy_n[0].tolist()
 
     def take_action(self, *args, **kwargs):
-        return [np.random.choice(self.num_outputs, p=np.squeeze(self.dist_n[j])) for j in range(self.num_agents)]
+        return self.action_n
 
     def before_step(self, *args, **kwargs):
-        self.log_prob_n = [torch.log(self.policy_dist_n[j].squeeze(0)[kwargs['action_n'][j]]) for j in range(self.num_agents)]
-        self.entropy_n = [-np.sum(np.mean(self.dist_n[j]) * np.log(self.dist_n[j])) for j in range(self.num_agents)]
+        pass
 
     def after_step(self, *args, **kwargs):
         for j in range(self.num_agents):
@@ -128,10 +164,7 @@ class A2C(TrainingAlgorithm):
     def after_episode(self, *args, **kwargs):
         self.qvals_n = [None, None]
         for j in range(self.num_agents):
-            self.qvals_n[j] = np.zeros_like(self.values_n[j])
-            for t in reversed(range(len(self.rewards_n[j]))):
-                self.qval_n[j] = self.rewards_n[j][t] + self.gamma * self.qval_n[j]
-                self.qvals_n[j][t] = self.qval_n[j]
+            self.qvals_n[j] = discounted_returns(self.rewards_n[j], self.gamma, last_values=self.qval_n[j])
             self.values_n[j] = torch.FloatTensor(self.values_n[j])
             self.qvals_n[j] = torch.FloatTensor(self.qvals_n[j])
             self.log_probs_n[j] = torch.stack(self.log_probs_n[j])
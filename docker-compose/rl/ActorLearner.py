@@ -0,0 +1,373 @@
+import multiprocessing
+import queue
+import random
+import numpy as np
+
+
+def _inference_server(algorithm, requests, replies, weights, stop, max_batch):
+    """
+    Inference process loop; gathers observation requests of many actors into one batch,
+    runs `algorithm.act` once per batch and sends actions back. The newest broadcast weights
+    are loaded between batches
+
+    Parameters
+    ----------
+        algorithm : TrainingAlgorithm
+            copy of the learner algorithm (forked), used only for acting
+        requests : multiprocessing.Queue
+            (actor index, obs_n) requests
+        replies : list of multiprocessing.Queue
+            (action_n, extras) replies, one queue per actor
+        weights : multiprocessing.Queue
+            weights broadcast by the learner
+        stop : multiprocessing.Event
+            set when training is finished
+        max_batch : int
+            maximal number of requests in one batch
+
+    Returns
+    -------
+        None
+    """
+
+    # actors may be gone before they read their replies
+    for reply in replies:
+        reply.cancel_join_thread()
+
+    while not stop.is_set():
+        try:
+            batch = [requests.get(timeout=.1)]
+        except queue.Empty:
+            continue
+        while len(batch) < max_batch:
+            try:
+                batch.append(requests.get_nowait())
+            except queue.Empty:
+                break
+
+        latest = None
+        while True:
+            try:
+                latest = weights.get_nowait()
+            except queue.Empty:
+                break
+        if latest is not None:
+            algorithm.set_weights(latest)
+
+        indices = [index for index, _ in batch]
+        obs_n = [np.stack([obs[j] for _, obs in batch]) for j in range(len(batch[0][1]))]
+        action_n, extras = algorithm.act(obs_n)
+        for b, index in enumerate(indices):
+            replies[index].put((action_n[b], {key: value[b] for key, value in extras.items()}))
+
+
+def _actor(index, env_fn, requests, reply, trajectories, stop, unroll_length):
+    """
+    Actor process loop; plays HideNSeekEnv games with actions from inference server and streams
+    segments of `unroll_length` steps to the learner
+
+    Parameters
+    ----------
+        index : int
+            actor index
+        env_fn : callable
+            creates HideNSeekEnv
+        requests : multiprocessing.Queue
+            (actor index, obs_n) requests to inference server
+        reply : multiprocessing.Queue
+            (action_n, extras) replies from inference server
+        trajectories : multiprocessing.Queue
+            segments sent to the learner
+        stop : multiprocessing.Event
+            set when training is finished
+        unroll_length : int
+            number of steps in one segment
+
+    Returns
+    -------
+        None
+    """
+
+    # forked actors inherit parent random state, every one should play its own game
+    random.seed()
+    np.random.seed()
+    # learner may stop before it reads every segment, process shouldn't wait for the queue to be flushed
+    trajectories.cancel_join_thread()
+    requests.cancel_join_thread()
+
+    env = env_fn()
+    obs_n = env.reset()
+    segment = Segment(unroll_length, [len(obs) for obs in obs_n])
+    ep_length, ep_rewards = 0, np.zeros(len(obs_n))
+
+    while not stop.is_set():
+        requests.put((index, obs_n))
+        while True:
+            try:
+                action_n, extras = reply.get(timeout=.1)
+                break
+            except queue.Empty:
+                if stop.is_set():
+                    return
+
+        obs_next_n, reward_n, done, _ = env.step(action_n.tolist())
+        segment.append(obs_n, action_n, extras, reward_n, done[0])
+        ep_length += 1
+        ep_rewards += reward_n
+
+        if done[0]:
+            segment.episodes.append({'winner': done[1], 'length': ep_length, 'rewards': ep_rewards.tolist()})
+            ep_length, ep_rewards = 0, np.zeros(len(obs_n))
+            obs_next_n = env.reset()
+        obs_n = obs_next_n
+
+        if segment.full:
+            trajectories.put(segment.finish(obs_n))
+            segment = Segment(unroll_length, [len(obs) for obs in obs_n])
+
+    env.close()
+
+
+class Segment:
+    """
+    Fixed-length part of actor trajectory, preallocated NumPy arrays
+
+    Attributes
+    ----------
+        obs_n : list of np.array, shape (T, n_inputs)
+            observations of every agent
+        action_n : np.array of int, shape (T, num_agents)
+            actions
+        extras : dict of np.array, shape (T, num_agents)
+            acting outputs needed by learner (e.g. log-probabilities), created by the first step
+        reward_n : np.array, shape (T, num_agents)
+            rewards
+        done : np.array of bool, shape (T, )
+            game over flags
+        episodes : list of dict
+            games finished in this segment, their winner, length & rewards
+        size : int
+            number of stored steps
+
+    Methods
+    -------
+        append(obs_n, action_n, extras, reward_n, done):
+            stores one step
+        finish(last_obs_n):
+            returns segment as dict of arrays
+    """
+
+    def __init__(self, length, n_inputs_n):
+        self.length = length
+        self.obs_n = [np.zeros((length, n_inputs), dtype=np.float32) for n_inputs in n_inputs_n]
+        self.action_n = np.zeros((length, len(n_inputs_n)), dtype=np.int64)
+        self.extras = None
+        self.reward_n = np.zeros((length, len(n_inputs_n)), dtype=np.float32)
+        self.done = np.zeros(length, dtype=bool)
+        self.episodes = []
+        self.size = 0
+
+    @property
+    def full(self):
+        return self.size == self.length
+
+    def append(self, obs_n, action_n, extras, reward_n, done):
+        if self.extras is None:
+            self.extras = {key: np.zeros((self.length, ) + np.shape(value), dtype=np.asarray(value).dtype)
+                           for key, value in extras.items()}
+
+        for j, obs in enumerate(obs_n):
+            self.obs_n[j][self.size] = obs
+        self.action_n[self.size] = action_n
+        for key, value in extras.items():
+            self.extras[key][self.size] = value
+        self.reward_n[self.size] = reward_n
+        self.done[self.size] = done
+        self.size += 1
+
+    def finish(self, last_obs_n):
+        return {
+            'obs_n': self.obs_n,
+            'action_n': self.action_n,
+            'reward_n': self.reward_n,
+            'done': self.done,
+            'last_obs_n': [np.asarray(obs, dtype=np.float32) for obs in last_obs_n],
+            'episodes': self.episodes,
+            **self.extras,
+        }
+
+
+class ActorLearner:
+    """
+    Actor-Learner training topology on one machine. Actor processes play games, one inference process
+    batches their observations and runs the policy once per batch, the learner (calling process) updates
+    the model on segments streamed by actors and periodically broadcasts weights to the inference process.
+    One model is trained, every core is used either by game simulation or by the network
+
+    Attributes
+    ----------
+        algorithm : TrainingAlgorithm
+            learner algorithm, implementing `act`, `learn`, `get_weights` & `set_weights`
+        num_actors : int
+            number of actor processes
+        unroll_length : int
+            number of steps in one actor segment
+        batch_segments : int
+            number of segments in one learner batch
+        broadcast_interval : int
+            weights are sent to inference process every broadcast_interval updates
+        updates : int
+            number of learner updates
+        episodes : int
+            number of finished games
+
+    Methods
+    -------
+        start():
+            starts inference & actor processes
+        run(episodes, on_episode=None):
+            trains until given number of games is finished
+        close():
+            stops every process
+    """
+
+    def __init__(self, algorithm, env_fns, unroll_length, batch_segments=None, broadcast_interval=1, context=None):
+        """
+        Constructs all neccesary attributes for the Actor-Learner topology
+
+        Parameters
+        ----------
+            algorithm : TrainingAlgorithm
+                prepared learner algorithm (after `prepare_model`), inference process gets its forked copy
+            env_fns : list of callable
+                every callable creates one HideNSeekEnv, called in actor process
+            unroll_length : int
+                number of steps in one actor segment
+            batch_segments : int, optional
+                number of segments in one learner batch, number of actors by default
+            broadcast_interval : int, default=1
+                weights are sent to inference process every broadcast_interval updates
+            context : multiprocessing context, optional
+                context used to start processes, 'fork' by default; inside Celery task it should be `billiard` context
+        """
+
+        self.algorithm = algorithm
+        self.env_fns = env_fns
+        self.num_actors = len(env_fns)
+        self.unroll_length = unroll_length
+        self.batch_segments = batch_segments if batch_segments is not None else self.num_actors
+        self.broadcast_interval = broadcast_interval
+        self.context = context if context is not None else multiprocessing.get_context('fork')
+
+        self.updates = 0
+        self.episodes = 0
+        self.processes = []
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def start(self):
+        self.stop = self.context.Event()
+        self.requests = self.context.Queue()
+        self.replies = [self.context.Queue() for _ in range(self.num_actors)]
+        self.weights = self.context.Queue()
+        self.trajectories = self.context.Queue()
+
+        self.processes = [self.context.Process(
+            target=_inference_server,
+            args=(self.algorithm, self.requests, self.replies, self.weights, self.stop, self.num_actors),
+            daemon=True,
+        )]
+        for index, env_fn in enumerate(self.env_fns):
+            self.processes.append(self.context.Process(
+                target=_actor,
+                args=(index, env_fn, self.requests, self.replies[index], self.trajectories, self.stop, self.unroll_length),
+                daemon=True,
+            ))
+        for process in self.processes:
+            process.start()
+
+        return self
+
+    @staticmethod
+    def _stack(segments):
+        """
+        Stacks actor segments into learner batch, segments become the second (B) dimension
+
+        Parameters
+        ----------
+            segments : list of dict
+                segments returned by actors
+
+        Returns
+        -------
+            batch : dict
+                arrays of shape (T, B, ...), 'last_obs_n' of shape (B, n_inputs)
+        """
+
+        batch = {
+            'obs_n': [np.stack([segment['obs_n'][j] for segment in segments], axis=1)
+                      for j in range(len(segments[0]['obs_n']))],
+            'last_obs_n': [np.stack([segment['last_obs_n'][j] for segment in segments])
+                           for j in range(len(segments[0]['last_obs_n']))],
+        }
+        for key, value in segments[0].items():
+            if key not in batch and key != 'episodes':
+                batch[key] = np.stack([segment[key] for segment in segments], axis=1)
+
+        return batch
+
+    def _get_segment(self):
+        # waits for the next segment, but doesn't hang forever if some process has crashed
+        while True:
+            try:
+                return self.trajectories.get(timeout=1)
+            except queue.Empty:
+                dead = [process.name for process in self.processes if not process.is_alive()]
+                if dead:
+                    raise Exception(f"Actor-Learner processes stopped unexpectedly: {dead}")
+
+    def run(self, episodes, on_episode=None):
+        """
+        Learner loop, trains until given number of games is finished
+
+        Parameters
+        ----------
+            episodes : int
+                number of games to finish
+            on_episode : callable, optional
+                called with (winner, length, rewards) of every finished game
+
+        Returns
+        -------
+            None
+        """
+
+        while self.episodes < episodes:
+            segments = [self._get_segment() for _ in range(self.batch_segments)]
+            for segment in segments:
+                for episode in segment['episodes']:
+                    self.episodes += 1
+                    if on_episode is not None:
+                        on_episode(episode['winner'], episode['length'], episode['rewards'])
+
+            self.algorithm.learn(self._stack(segments))
+            self.updates += 1
+            if self.updates % self.broadcast_interval == 0:
+                self.weights.put(self.algorithm.get_weights())
+
+    def close(self):
+        if not self.processes:
+            return
+
+        self.stop.set()
+        # inference process may be gone before it reads broadcast weights
+        self.weights.cancel_join_thread()
+        for process in self.processes:
+            process.join(timeout=5)
+            if process.is_alive():
+                process.terminate()
+        self.processes = []
@@ -6,6 +6,136 @@ from tensorflow.keras import layers
 import numpy as np
 
 
+class ReplayBuffer:
+    """
+    Circular replay buffer, preallocated NumPy arrays; the oldest transition is overwritten once buffer is full
+    """
+
+    def __init__(self, capacity, n_inputs):
+        self.capacity = capacity
+        self.states = np.zeros((capacity, n_inputs), dtype=np.float32)
+        self.states_next = np.zeros((capacity, n_inputs), dtype=np.float32)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.float32)
+
+        self.index = 0  # where next transition is written
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    def append(self, state, action, reward, state_next, done):
+        self.states[self.index] = state
+        self.states_next[self.index] = state_next
+        self.actions[self.index] = action
+        self.rewards[self.index] = reward
+        self.dones[self.index] = done
+
+        self.index = (self.index + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def sample(self, batch_size):
+        # uniform, with replacement; every transition has the same importance-sampling weight
+        indices = np.random.randint(0, self.size, size=batch_size)
+        return (
+            self.states[indices],
+            self.actions[indices],
+            self.rewards[indices],
+            self.states_next[indices],
+            self.dones[indices],
+            indices,
+            np.ones(batch_size, dtype=np.float32),
+        )
+
+    def update_priorities(self, indices, td_errors):
+        pass
+
+
+class SumTree:
+    """
+    Binary tree stored in one array, every node keeps sum of its children priorities; leaves are transitions.
+    Both priority update and sampling are O(log n), done for the whole batch at once
+    """
+
+    def __init__(self, capacity):
+        # leaves count is a power of 2, so every leaf has the same depth
+        self.depth = max(int(np.ceil(np.log2(capacity))), 1)
+        self.leaves = 2 ** self.depth
+        self.tree = np.zeros(2 * self.leaves, dtype=np.float64)  # root at 1, leaves at [leaves; 2 * leaves)
+
+    @property
+    def total(self):
+        return self.tree[1]
+
+    def update(self, indices, priorities):
+        nodes = np.asarray(indices) + self.leaves
+        self.tree[nodes] = priorities
+        for _ in range(self.depth):
+            nodes = np.unique(nodes // 2)
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+
+    def get(self, indices):
+        return self.tree[np.asarray(indices) + self.leaves]
+
+    def find(self, values):
+        # descends from the root, the leaf where cumulative priority reaches value is found for every value
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+        for _ in range(self.depth):
+            left = 2 * nodes
+            go_right = (values > self.tree[left]) & (self.tree[left + 1] > 0)
+            values -= np.where(go_right, self.tree[left], 0)
+            nodes = left + go_right
+        return nodes - self.leaves
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    """
+    Replay buffer sampling transitions proportionally to (|TD error| + eps) ** alpha, stored in SumTree.
+    Bias is corrected by importance-sampling weights, beta is annealed to 1
+    """
+
+    def __init__(self, capacity, n_inputs, alpha=0.6, beta=0.4, beta_increment=1e-4, eps=1e-6):
+        super().__init__(capacity, n_inputs)
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = beta_increment
+        self.eps = eps
+        self.max_priority = 1.0  # new transitions are sampled at least once
+        self.sum_tree = SumTree(capacity)
+
+    def append(self, state, action, reward, state_next, done):
+        self.sum_tree.update([self.index], [self.max_priority ** self.alpha])
+        super().append(state, action, reward, state_next, done)
+
+    def sample(self, batch_size):
+        # stratified: one value from every of batch_size equal priority segments
+        segment = self.sum_tree.total / batch_size
+        values = (np.arange(batch_size) + np.random.uniform(size=batch_size)) * segment
+        indices = np.minimum(self.sum_tree.find(values), self.size - 1)
+
+        probabilities = self.sum_tree.get(indices) / self.sum_tree.total
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        return (
+            self.states[indices],
+            self.actions[indices],
+            self.rewards[indices],
+            self.states_next[indices],
+            self.dones[indices],
+            indices,
+            weights.astype(np.float32),
+        )
+
+    def update_priorities(self, indices, td_errors):
+        priorities = np.abs(td_errors) + self.eps
+        self.max_priority = max(self.max_priority, float(priorities.max()))
+        self.sum_tree.update(indices, priorities ** self.alpha)
+
+
 def create_q_model(n_inputs, n_outputs):
     # Network defined by the Deepmind paper
     inputs = layers.Input(n_inputs)
@@ -23,7 +153,7 @@ def create_q_model(n_inputs, n_outputs):
 
 class DQN(TrainingAlgorithm):
     def __init__(self, env, num_agents, gamma, epsilon, epsilon_min,
-                 epsilon_max, batch_size, n_inputs_n, n_outputs):
+                 epsilon_max, batch_size, n_inputs_n, n_outputs, replay='uniform'):
         super().__init__()
         self.env = env
 
@@ -39,6 +169,7 @@ class DQN(TrainingAlgorithm):
         self.batch_size = batch_size  # Size of batch taken from replay buffer
         self.n_inputs_n = n_inputs_n  # observation space
         self.n_outputs = n_outputs  # action space
+        self.replay = replay  # replay buffer type, 'uniform' or 'prioritized'
 
         # prepare_model
         self.model_n = None
@@ -50,10 +181,8 @@ class DQN(TrainingAlgorithm):
         self.optimizer_n = None
 
         # Experience replay buffers
-        self.action_history_n = None
-        self.rewards_history_n = None
-        self.state_history_n = None
-        self.done_history_n = None
+        self.replay_buffer_n = None
+        self.action_n = None  # last actions, stored in replay buffer after step
         self.episode_reward_history_n = None
         # Number of frames to take random action and observe output
         self.epsilon_random_frames = None
@@ -68,12 +197,13 @@ class DQN(TrainingAlgorithm):
         self.update_target_network_n = None
         # Using huber loss for stability
         self.loss_function_n = None
+        # graph-compiled action selection & training step, one per agent
+        self.act_function_n = None
+        self.train_function_n = None
 
         # before episode
         self.episode_reward_n = None
 
-        self.state_next_history_n = None
-
     def prepare_model(self, *args, **kwargs):
         # The first model makes the predictions for Q-values which are used to
         # make a action.
@@ -97,15 +227,83 @@ class DQN(TrainingAlgorithm):
         self.loss_function_n = \
             [keras.losses.Huber() for _ in range(self.num_agents)]
         # ---
-        self.state_history_n = [[] for _ in range(self.num_agents)]
-        self.state_next_history_n = [[] for _ in range(self.num_agents)]
+        if self.replay == 'uniform':
+            self.replay_buffer_n = [ReplayBuffer(self.max_memory_length_n[j], self.n_inputs_n[j]) for j in range(self.num_agents)]
+        elif self.replay == 'prioritized':
+            self.replay_buffer_n = [PrioritizedReplayBuffer(self.max_memory_length_n[j], self.n_inputs_n[j]) for j in range(self.num_agents)]
+        else:
+            raise NotImplementedError(
+                f"Given replay (`{self.replay}`) is not implemeneted yet!")
 
         self.optimizer_n = [keras.optimizers.Adam(learning_rate=0.00025, clipnorm=1.0) for _ in range(self.num_agents)]
-        self.action_history_n = [[] for _ in range(self.num_agents)]
-        self.rewards_history_n = [[] for _ in range(self.num_agents)]
-        self.done_history_n = [[] for _ in range(self.num_agents)]
         self.episode_reward_history_n = [[] for _ in range(self.num_agents)]
 
+        # traced once (fixed input signatures), then reused by every call
+        self.act_function_n = [self._compile_act(j) for j in range(self.num_agents)]
+        self.train_function_n = [self._compile_train(j) for j in range(self.num_agents)]
+
+    def _compile_act(self, j):
+        model = self.model_n[j]
+
+        @tf.function(input_signature=[tf.TensorSpec(shape=(self.n_inputs_n[j], ), dtype=tf.float32)])
+        def act(state):
+            # Predict action Q-values & take best action
+            action_probs = model(tf.expand_dims(state, 0), training=False)
+            return tf.argmax(action_probs[0])
+
+        return act
+
+    def _compile_train(self, j):
+        model = self.model_n[j]
+        model_target = self.model_target_n[j]
+        optimizer = self.optimizer_n[j]
+        loss_function = self.loss_function_n[j]
+        gamma = self.gamma
+        n_outputs = self.n_outputs
+
+        @tf.function(input_signature=[
+            tf.TensorSpec(shape=(None, self.n_inputs_n[j]), dtype=tf.float32),  # states
+            tf.TensorSpec(shape=(None, ), dtype=tf.int64),  # actions
+            tf.TensorSpec(shape=(None, ), dtype=tf.float32),  # rewards
+            tf.TensorSpec(shape=(None, self.n_inputs_n[j]), dtype=tf.float32),  # next states
+            tf.TensorSpec(shape=(None, ), dtype=tf.float32),  # dones
+            tf.TensorSpec(shape=(None, ), dtype=tf.float32),  # importance-sampling weights
+        ])
+        def train(state_sample, action_sample, rewards_sample, state_next_sample, done_sample, weights):
+            # Build the updated Q-values for the sampled future states
+            # Use the target model for stability
+            future_rewards = model_target(state_next_sample, training=False)
+            # Q value = reward + discount factor * expected future reward
+            updated_q_values = rewards_sample + gamma * tf.reduce_max(
+                future_rewards, axis=1
+            )
+
+            # If final frame set the last value to -1
+            updated_q_values = updated_q_values * (1 - done_sample) - done_sample
+
+            # Create a mask so we only calculate loss on the updated Q-values
+            masks = tf.one_hot(action_sample, n_outputs)
+
+            with tf.GradientTape() as tape:
+                # Train the model on the states and updated Q-values
+                q_values = model(state_sample, training=True)
+
+                # Apply the masks to the Q-values to get the Q-value for action taken
+                q_action = tf.reduce_sum(tf.multiply(q_values, masks), axis=1)
+                # Calculate loss between new Q-value and old Q-value, weighted by importance-sampling weights
+                # (one loss per sample, so weights are applied per transition)
+                loss = loss_function(tf.expand_dims(updated_q_values, -1), tf.expand_dims(q_action, -1),
+                                     sample_weight=weights)
+
+            # Backpropagation
+            grads = tape.gradient(loss, model.trainable_variables)
+            optimizer.apply_gradients(zip(grads, model.trainable_variables))
+
+            # TD errors
+            return updated_q_values - q_action
+
+        return train
+
     def before_episode(self, *args, **kwargs):
         self.episode_reward_n = [0 for _ in range(self.num_agents)]
 
@@ -117,22 +315,15 @@ class DQN(TrainingAlgorithm):
         if self.env.cfg['duration'] - self.env.duration < self.epsilon_random_frames \
                 or self.epsilon > np.random.rand(1)[0]:
             # Take random action
-            action_n = [np.random.choice(self.n_outputs) for _ in range(self.num_agents)]
-            _ = [self.action_history_n[j].append(action_n[j]) for j in range(self.num_agents)]
+            self.action_n = [np.random.choice(self.n_outputs) for _ in range(self.num_agents)]
 
-            return action_n
+            return self.action_n
         else:
             # Predict action Q-values
             # From environment state
-            action_n = []
-            for j in range(self.num_agents):
-                state_tensor = tf.convert_to_tensor(kwargs['obs_n'][j])
-                state_tensor = tf.expand_dims(state_tensor, 0)
-                action_probs = self.model_n[j](state_tensor, training=False)
-                # Take best action
-                action_n.append(tf.argmax(action_probs[0]).numpy())
-                self.action_history_n[j].append(action_n[j])
-            return action_n
+            self.action_n = [int(self.act_function_n[j](np.asarray(kwargs['obs_n'][j], dtype=np.float32)))
+                             for j in range(self.num_agents)]
+            return self.action_n
 
     def before_step(self, *args, **kwargs):
         # Decay probability of taking random action
@@ -145,64 +336,27 @@ class DQN(TrainingAlgorithm):
 
             # =====================================================================
             # Save actions and states in replay buffer
-            self.rewards_history_n[j].append(kwargs['reward_n'][j])
-            self.state_history_n.append(kwargs['obs_old_n'][j])
-            self.state_next_history_n.append(kwargs['obs_n'][j])
-            self.done_history_n.append(kwargs['done'][0])
+            replay_buffer = self.replay_buffer_n[j]
+            replay_buffer.append(kwargs['obs_old_n'][j], self.action_n[j], kwargs['reward_n'][j],
+                                 kwargs['obs_n'][j], kwargs['done'][0])
 
             # Update every fourth frame and once batch size is over 32
             if (self.env.cfg['duration'] - self.env.duration) % self.update_after_actions_n[j] == 0 \
-                    and len(self.done_history_n[j]) > self.batch_size:
-                # Get indices of samples for replay buffers
-                indices = np.random.choice(range(len(self.done_history_n[j])), size=self.batch_size)
-
-                # Using list comprehension to sample from replay buffer
-                state_sample = np.array([self.state_history_n[j][i] for i in indices])
-                state_next_sample = np.array([self.state_next_history_n[j][i] for i in indices])
-                rewards_sample = [self.rewards_history_n[j][i] for i in indices]
-                action_sample = [self.action_history_n[j][i] for i in indices]
-                done_sample = tf.convert_to_tensor(
-                    [float(self.done_history_n[j][i]) for i in indices]
-                )
-
-                # Build the updated Q-values for the sampled future states
-                # Use the target model for stability
-                future_rewards = self.model_target_n[j].predict(state_next_sample)
-                # Q value = reward + discount factor * expected future reward
-                updated_q_values = rewards_sample + self.gamma * tf.reduce_max(
-                    future_rewards, axis=1
-                )
-
-                # If final frame set the last value to -1
-                updated_q_values = updated_q_values * (1 - done_sample) - done_sample
-
-                # Create a mask so we only calculate loss on the updated Q-values
-                masks = tf.one_hot(action_sample, self.n_outputs)
-
-                with tf.GradientTape() as tape:
-                    # Train the model on the states and updated Q-values
-                    q_values = self.model_n[j](state_sample)
-
-                    # Apply the masks to the Q-values to get the Q-value for action taken
-                    q_action = tf.reduce_sum(tf.multiply(q_values, masks), axis=1)
-                    # Calculate loss between new Q-value and old Q-value
-                    loss = self.loss_function_n(updated_q_values, q_action)
-
-                # Backpropagation
-                grads = tape.gradient(loss, self.model_n[j].trainable_variables)
-                self.optimizer_n[j].apply_gradients(zip(grads, self.model_n[j].trainable_variables))
+                    and len(replay_buffer) > self.batch_size:
+                # Gather batch from replay buffer arrays
+                state_sample, action_sample, rewards_sample, state_next_sample, done_sample, indices, weights = \
+                    replay_buffer.sample(self.batch_size)
+
+                td_errors = self.train_function_n[j](
+                    state_sample, action_sample, rewards_sample, state_next_sample, done_sample, weights)
+
+                # TD errors become new priorities (only for prioritized replay)
+                replay_buffer.update_priorities(indices, td_errors.numpy())
 
             if (self.env.cfg['duration'] - self.env.duration) % self.update_target_network_n[j] == 0:
                 # update the the target network with new weights
                 self.model_target_n[j].set_weights(self.model_n[j].get_weights())
 
-            # Limit the state and reward history
-            if len(self.rewards_history_n[j]) > self.max_memory_length_n[j]:
-                del self.rewards_history_n[j][:1]
-                del self.state_history_n[j][:1]
-                del self.action_history_n[j][:1]
-                del self.done_history_n[j][:1]
-
     def handle_gameover(self, *args, **kwargs):
         pass
 
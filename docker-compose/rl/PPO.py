@@ -1,4 +1,5 @@
 from . import TrainingAlgorithm
+from .returns import gae
 
 
 import torch.optim as optim
@@ -9,24 +10,200 @@ import torch
 import torch.nn as nn
 from torch.distributions import Categorical
 
+import numpy as np
+
 
 device = "cpu"
 
 
 class Memory:
-    def __init__(self):
-        self.actions = []
-        self.states = []
-        self.logprobs = []
-        self.rewards = []
-        self.is_terminals = []
+    """
+    Rollout buffer, preallocated contiguous tensors of update_timestep x num_envs steps written by index;
+    nothing is stacked on update, flat and minibatch tensors are views of the storage
+
+    Attributes
+    ----------
+        capacity : int
+            number of steps stored before update
+        num_envs : int
+            number of environments stepped together
+        states : torch.Tensor, shape (capacity, num_envs, n_inputs)
+        actions : torch.Tensor of int, shape (capacity, num_envs)
+        logprobs : torch.Tensor, shape (capacity, num_envs)
+        rewards : torch.Tensor, shape (capacity, num_envs)
+        values : torch.Tensor, shape (capacity, num_envs)
+        is_terminals : torch.Tensor, shape (capacity, num_envs)
+        size : int
+            number of finished steps (with reward)
+
+    Methods
+    -------
+        add_action(states, actions, logprobs, values):
+            writes policy output of current step
+        add_outcome(rewards, is_terminals):
+            writes reward of current step and moves to the next one
+        flat():
+            returns finished steps as (size * num_envs, ...) views
+        minibatches(batch_size, *tensors, shuffle=True):
+            yields minibatches of finished steps
+        load(states, actions, logprobs, values, rewards, is_terminals):
+            writes whole rollout at once
+        clear_memory():
+            forgets stored steps
+    """
+
+    def __init__(self, capacity, n_inputs, num_envs=1):
+        self.capacity = capacity
+        self.num_envs = num_envs
+        self.states = torch.zeros((capacity, num_envs, n_inputs), dtype=torch.float32, device=device)
+        self.actions = torch.zeros((capacity, num_envs), dtype=torch.int64, device=device)
+        self.logprobs = torch.zeros((capacity, num_envs), dtype=torch.float32, device=device)
+        self.rewards = torch.zeros((capacity, num_envs), dtype=torch.float32, device=device)
+        self.values = torch.zeros((capacity, num_envs), dtype=torch.float32, device=device)
+        self.is_terminals = torch.zeros((capacity, num_envs), dtype=torch.float32, device=device)
+
+        self.size = 0
+
+    def __len__(self):
+        return self.size
+
+    @property
+    def full(self):
+        return self.size == self.capacity
+
+    def add_action(self, states, actions, logprobs, values):
+        """
+        Writes policy output of current step, for every environment
+
+        Parameters
+        ----------
+            states : array-like, shape (num_envs, n_inputs)
+                observations
+            actions : array-like of int, shape (num_envs, )
+                sampled actions
+            logprobs : array-like, shape (num_envs, )
+                log-probabilities of sampled actions
+            values : array-like, shape (num_envs, )
+                critic values
+
+        Returns
+        -------
+            None
+        """
+
+        if self.full:
+            raise Exception(f"Memory is full ({self.capacity} steps), update the policy and clear memory first")
+
+        self.states[self.size] = torch.as_tensor(states, dtype=torch.float32)
+        self.actions[self.size] = torch.as_tensor(actions, dtype=torch.int64)
+        self.logprobs[self.size] = torch.as_tensor(logprobs, dtype=torch.float32)
+        self.values[self.size] = torch.as_tensor(values, dtype=torch.float32)
+
+    def add_outcome(self, rewards, is_terminals):
+        """
+        Writes reward of current step, for every environment, and moves to the next step
+
+        Parameters
+        ----------
+            rewards : array-like, shape (num_envs, )
+                rewards
+            is_terminals : array-like of bool, shape (num_envs, )
+                True if episode ended in this step
+
+        Returns
+        -------
+            None
+        """
+
+        self.rewards[self.size] = torch.as_tensor(rewards, dtype=torch.float32)
+        self.is_terminals[self.size] = torch.as_tensor(is_terminals, dtype=torch.float32)
+        self.size += 1
+
+    def flat(self):
+        """
+        Finished steps with time and environment dimensions merged, views of storage (no copy)
+
+        Returns
+        -------
+            states : torch.Tensor, shape (size * num_envs, n_inputs)
+            actions : torch.Tensor of int, shape (size * num_envs, )
+            logprobs : torch.Tensor, shape (size * num_envs, )
+            rewards : torch.Tensor, shape (size * num_envs, )
+            values : torch.Tensor, shape (size * num_envs, )
+            is_terminals : torch.Tensor, shape (size * num_envs, )
+        """
+
+        return (
+            self.states[:self.size].flatten(0, 1),
+            self.actions[:self.size].flatten(),
+            self.logprobs[:self.size].flatten(),
+            self.rewards[:self.size].flatten(),
+            self.values[:self.size].flatten(),
+            self.is_terminals[:self.size].flatten(),
+        )
+
+    def minibatches(self, batch_size, *tensors, shuffle=True):
+        """
+        Splits finished steps into minibatches
+
+        Without shuffling minibatches are views of storage; shuffling gathers every tensor once per call,
+        minibatches are views of the shuffled copy
+
+        Parameters
+        ----------
+            batch_size : int
+                number of samples in minibatch, the last one may be smaller
+            tensors : torch.Tensor, shape (size * num_envs, ...)
+                extra per-sample tensors (e.g. advantages, returns) split together with stored ones
+            shuffle : bool, default=True
+                permute samples before splitting
+
+        Yields
+        -------
+            minibatch : tuple of torch.Tensor
+                states, actions, logprobs, rewards, values, is_terminals and extra tensors
+        """
+
+        data = self.flat() + tuple(tensors)
+        if shuffle:
+            permutation = torch.randperm(len(data[0]), device=device)
+            data = tuple(tensor[permutation] for tensor in data)
+
+        for start in range(0, len(data[0]), batch_size):
+            yield tuple(tensor[start:start + batch_size] for tensor in data)
+
+    def load(self, states, actions, logprobs, values, rewards, is_terminals):
+        """
+        Writes whole rollout at once (e.g. collected by actor processes), replacing stored steps
+
+        Parameters
+        ----------
+            states : array-like, shape (T, num_envs, n_inputs)
+            actions : array-like of int, shape (T, num_envs)
+            logprobs : array-like, shape (T, num_envs)
+            values : array-like, shape (T, num_envs)
+            rewards : array-like, shape (T, num_envs)
+            is_terminals : array-like of bool, shape (T, num_envs)
+
+        Returns
+        -------
+            None
+        """
+
+        size = len(states)
+        if size > self.capacity:
+            raise Exception(f"Rollout of {size} steps doesn't fit in memory ({self.capacity} steps)")
+
+        self.states[:size] = torch.as_tensor(states, dtype=torch.float32)
+        self.actions[:size] = torch.as_tensor(actions, dtype=torch.int64)
+        self.logprobs[:size] = torch.as_tensor(logprobs, dtype=torch.float32)
+        self.values[:size] = torch.as_tensor(values, dtype=torch.float32)
+        self.rewards[:size] = torch.as_tensor(rewards, dtype=torch.float32)
+        self.is_terminals[:size] = torch.as_tensor(is_terminals, dtype=torch.float32)
+        self.size = size
 
     def clear_memory(self):
-        del self.actions[:]
-        del self.states[:]
-        del self.logprobs[:]
-        del self.rewards[:]
-        del self.is_terminals[:]
+        self.size = 0
 
 
 class ActorCritic(nn.Module):
@@ -57,16 +234,21 @@ class ActorCritic(nn.Module):
         raise NotImplementedError
 
     def act(self, state, memory):
-        state = torch.from_numpy(state).float().to(device)
-        action_probs = self.action_layer(state)
-        dist = Categorical(action_probs)
-        action = dist.sample()
+        states, actions, logprobs, state_values = self.act_batch(np.asarray(state)[None])
+        memory.add_action(states, actions, logprobs, state_values)
+
+        return actions.item()
 
-        memory.states.append(state)
-        memory.actions.append(action)
-        memory.logprobs.append(dist.log_prob(action))
+    def act_batch(self, states):
+        # one forward for observations stacked across environments (B, n_inputs)
+        states = torch.as_tensor(states, dtype=torch.float32).to(device)
+        with torch.no_grad():
+            action_probs = self.action_layer(states)
+            dist = Categorical(action_probs)
+            actions = dist.sample()
+            state_values = self.value_layer(states).squeeze(-1)
 
-        return action.item()
+        return states, actions, dist.log_prob(actions), state_values
 
     def evaluate(self, state, action):
         action_probs = self.action_layer(state)
@@ -77,11 +259,18 @@ class ActorCritic(nn.Module):
 
         state_value = self.value_layer(state)
 
-        return action_logprobs, torch.squeeze(state_value), dist_entropy
+        return action_logprobs, state_value.squeeze(-1), dist_entropy
+
+    def value(self, states):
+        # critic only, for bootstrapping unfinished rollout (B, n_inputs)
+        states = torch.as_tensor(states, dtype=torch.float32).to(device)
+        with torch.no_grad():
+            return self.value_layer(states).squeeze(-1)
 
 
 class PPO(TrainingAlgorithm):
-    def __init__(self, env, num_agents, gamma, hidden_size, l_rate, n_inputs_n, n_outputs, betas, K_epochs, eps_clip, update_timestep):
+    def __init__(self, env, num_agents, gamma, hidden_size, l_rate, n_inputs_n, n_outputs, betas, K_epochs, eps_clip, update_timestep,
+                 minibatch_size=64, gae_lambda=0.95, value_clip=0.2, target_kl=0.015, value_coef=0.5, entropy_coef=0.01, num_envs=1):
         super().__init__()
 
         # https://github.com/nikhilbarhate99/PPO-PyTorch/blob/master/PPO.py
@@ -93,7 +282,14 @@ class PPO(TrainingAlgorithm):
         self.gamma = gamma
         self.eps_clip = eps_clip
         self.K_epochs = K_epochs
+        self.minibatch_size = minibatch_size
+        self.gae_lambda = gae_lambda
+        self.value_clip = value_clip  # None disables value clipping
+        self.target_kl = target_kl  # None disables early stopping
+        self.value_coef = value_coef
+        self.entropy_coef = entropy_coef
         self.num_agents = num_agents
+        self.num_envs = num_envs  # games stepped together, e.g. by HideNSeekSubprocVecEnv
         self.num_inputs_n = n_inputs_n  # observation space
         self.num_outputs = n_outputs  # action space
         self.hidden_size = hidden_size
@@ -117,10 +313,11 @@ class PPO(TrainingAlgorithm):
         self.update_timestep = update_timestep
 
     def prepare_model(self, *args, **kwargs):
-        self.memory_n = [Memory() for _ in range(self.num_agents)]
+        self.memory_n = [Memory(self.update_timestep, self.num_inputs_n[j], self.num_envs) for j in range(self.num_agents)]
         self.policy_n = [ActorCritic(self.num_inputs_n[j], self.num_outputs, self.hidden_size).to(device) for j in range(self.num_agents)]
         self.optimizer_n = [optim.Adam(self.policy_n[j].parameters(), lr=self.l_rate, betas=self.betas) for j in range(self.num_agents)]
-        self.policy_old_n = self.policy_n
+        # frozen behaviour policy, a separate network synchronized after every update
+        self.policy_old_n = [ActorCritic(self.num_inputs_n[j], self.num_outputs, self.hidden_size).to(device) for j in range(self.num_agents)]
         _ = [self.policy_old_n[j].load_state_dict(self.policy_n[j].state_dict()) for j in range(self.num_agents)]
         self.MseLoss = nn.MSELoss()
 
@@ -130,19 +327,58 @@ class PPO(TrainingAlgorithm):
     def before_action(self, *args, **kwargs):
         pass
 
+    def select_actions(self, obs_n):
+        """
+        Batched action selection: observations of every agent are stacked across environments,
+        so every (old) policy runs only one forward per frame
+
+        Parameters
+        ----------
+            obs_n : list of np.array, shape (B, n_inputs)
+                observations of every agent in B environments
+
+        Returns
+        -------
+            states_n : list of torch.Tensor, shape (B, n_inputs)
+                observations as tensors, ready to be stored in memory
+            action_n : np.array of int, shape (B, num_agents)
+                sampled actions
+            log_prob_n : torch.Tensor, shape (B, num_agents)
+                log-probabilities of sampled actions
+            value_n : np.array, shape (B, num_agents)
+                critic values
+        """
+
+        states_n, action_n, log_prob_n, value_n = [], [], [], []
+        for j in range(self.num_agents):
+            states, actions, log_probs, state_values = self.policy_old_n[j].act_batch(obs_n[j])
+            states_n.append(states)
+            action_n.append(actions)
+            log_prob_n.append(log_probs)
+            value_n.append(state_values)
+
+        return states_n, torch.stack(action_n, dim=1).numpy(), torch.stack(log_prob_n, dim=1), torch.stack(value_n, dim=1).numpy()
+
     def take_action(self, *args, **kwargs):
-        return [self.policy_old_n[j].act(kwargs['obs_n'][j], self.memory_n[j])  for j in range(self.num_agents)]
+        # observations of one environment (n_inputs, ) or of num_envs environments (num_envs, n_inputs)
+        states_n, action_n, log_prob_n, value_n = self.select_actions(
+            [np.atleast_2d(kwargs['obs_n'][j]) for j in range(self.num_agents)])
+
+        for j in range(self.num_agents):
+            self.memory_n[j].add_action(states_n[j], action_n[:, j], log_prob_n[:, j], value_n[:, j])
+
+        return action_n[0].tolist() if self.num_envs == 1 else action_n
 
     def before_step(self, *args, **kwargs):
         pass
 
     def after_step(self, *args, **kwargs):
-        cur_frame = self.env.cfg['duration'] - self.env.duration
         for j in range(self.num_agents):
-            self.memory_n[j].rewards.append(kwargs['reward_n'][j])
-            self.memory_n[j].is_terminals.append(kwargs['done'][0])
-            if cur_frame % self.update_timestep == 0:
-                self._update(self.memory_n[j], self.policy_n[j], self.policy_old_n[j], self.optimizer_n[j])
+            # reward_n[j] & done[0] are scalars for one environment, arrays of shape (num_envs, ) for vectorized one
+            self.memory_n[j].add_outcome(np.atleast_1d(kwargs['reward_n'][j]), np.atleast_1d(kwargs['done'][0]))
+            if self.memory_n[j].full:
+                last_values = self.policy_old_n[j].value(np.atleast_2d(kwargs['obs_n'][j])).cpu().numpy()
+                self._update(self.memory_n[j], self.policy_n[j], self.policy_old_n[j], self.optimizer_n[j], last_values)
                 self.memory_n[j].clear_memory()
 
     def handle_gameover(self, *args, **kwargs):
@@ -154,43 +390,136 @@ class PPO(TrainingAlgorithm):
     def before_cleanup(self, *args, **kwargs):
         pass
 
-    def _update(self, memory, policy, policy_old, optimizer):
-        # Monte Carlo estimate of state rewards:
-        rewards = []
-        discounted_reward = 0
-        for reward, is_terminal in zip(reversed(memory.rewards), reversed(memory.is_terminals)):
-            if is_terminal:
-                discounted_reward = 0
-            discounted_reward = reward + (self.gamma * discounted_reward)
-            rewards.insert(0, discounted_reward)
-
-        # Normalizing the rewards:
-        rewards = torch.tensor(rewards, dtype=torch.float32).to(device)
-        rewards = (rewards - rewards.mean()) / (rewards.std() + 1e-5)
-
-        # convert list to tensor
-        old_states = torch.stack(memory.states).to(device).detach()
-        old_actions = torch.stack(memory.actions).to(device).detach()
-        old_logprobs = torch.stack(memory.logprobs).to(device).detach()
-
-        # Optimize policy for K epochs:
+    def act(self, obs_n):
+        """
+        Actor-Learner: batched action selection by behaviour policy, without storing anything
+
+        Parameters
+        ----------
+            obs_n : list of np.array, shape (B, n_inputs)
+                observations of every agent in B games
+
+        Returns
+        -------
+            action_n : np.array of int, shape (B, num_agents)
+                sampled actions
+            extras : dict of np.array, shape (B, num_agents)
+                'logprobs' & 'values' of behaviour policy, needed by `learn`
+        """
+
+        _, action_n, log_prob_n, value_n = self.select_actions(obs_n)
+        return action_n, {'logprobs': log_prob_n.numpy(), 'values': value_n}
+
+    def learn(self, batch):
+        """
+        Actor-Learner: PPO update on rollout segments collected by actors with (possibly slightly older) behaviour policy
+
+        Parameters
+        ----------
+            batch : dict
+                'obs_n' - list of np.array, shape (T, B, n_inputs), observations of every agent
+                'action_n' - np.array of int, shape (T, B, num_agents)
+                'logprobs', 'values' - np.array, shape (T, B, num_agents), returned by `act`
+                'reward_n' - np.array, shape (T, B, num_agents)
+                'done' - np.array of bool, shape (T, B)
+                'last_obs_n' - list of np.array, shape (B, n_inputs), observations after the last step
+
+        Returns
+        -------
+            None
+        """
+
+        T, B = batch['done'].shape
+        if self.memory_n[0].capacity < T or self.memory_n[0].num_envs != B:
+            self.memory_n = [Memory(T, self.num_inputs_n[j], B) for j in range(self.num_agents)]
+
+        for j in range(self.num_agents):
+            memory = self.memory_n[j]
+            memory.load(batch['obs_n'][j], batch['action_n'][..., j], batch['logprobs'][..., j],
+                        batch['values'][..., j], batch['reward_n'][..., j], batch['done'])
+
+            last_values = self.policy_n[j].value(batch['last_obs_n'][j]).cpu().numpy()
+            self._update(memory, self.policy_n[j], self.policy_old_n[j], self.optimizer_n[j], last_values)
+            memory.clear_memory()
+
+    def get_weights(self):
+        return [{name: tensor.cpu() for name, tensor in self.policy_n[j].state_dict().items()}
+                for j in range(self.num_agents)]
+
+    def set_weights(self, weights):
+        for j in range(self.num_agents):
+            self.policy_n[j].load_state_dict(weights[j])
+            self.policy_old_n[j].load_state_dict(weights[j])
+
+    def _update(self, memory, policy, policy_old, optimizer, last_values):
+        """
+        PPO-Clip update on the stored rollout: K_epochs passes of shuffled minibatches against frozen behaviour
+        policy, with clipped value loss; stops early once approximate KL to behaviour policy exceeds 1.5 * target_kl
+
+        Parameters
+        ----------
+            memory : Memory
+                full rollout buffer
+            policy : ActorCritic
+                trained policy
+            policy_old : ActorCritic
+                behaviour policy which collected the rollout, synchronized with policy at the end
+            optimizer : torch.optim.Optimizer
+                optimizer of policy parameters
+            last_values : np.array, shape (num_envs, )
+                critic values of states after the last step, bootstrap for unfinished episodes
+
+        Returns
+        -------
+            None
+        """
+
+        # GAE(lambda) advantages and value targets, (T, num_envs)
+        advantages, returns = gae(
+            memory.rewards[:len(memory)].cpu().numpy(),
+            memory.values[:len(memory)].cpu().numpy(),
+            self.gamma,
+            self.gae_lambda,
+            dones=memory.is_terminals[:len(memory)].cpu().numpy(),
+            last_values=last_values,
+        )
+        advantages = torch.tensor(advantages, dtype=torch.float32).flatten().to(device)
+        returns = torch.tensor(returns, dtype=torch.float32).flatten().to(device)
+        if advantages.numel() > 1:  # std of one step is NaN, e.g. update_timestep=1 with one environment
+            advantages = (advantages - advantages.mean()) / (advantages.std() + 1e-5)
+
         for _ in range(self.K_epochs):
-            # Evaluating old actions and values :
-            logprobs, state_values, dist_entropy = policy.evaluate(old_states, old_actions)
+            approx_kl_n = []
+            for states, actions, old_logprobs, _, old_values, _, advantages_mb, returns_mb in memory.minibatches(
+                    self.minibatch_size, advantages, returns):
+                logprobs, state_values, dist_entropy = policy.evaluate(states, actions)
+
+                # Finding the ratio (pi_theta / pi_theta__old):
+                ratios = torch.exp(logprobs - old_logprobs)
+
+                # Finding Surrogate Loss:
+                surr1 = ratios * advantages_mb
+                surr2 = torch.clamp(ratios, 1 - self.eps_clip, 1 + self.eps_clip) * advantages_mb
+                policy_loss = -torch.min(surr1, surr2).mean()
+
+                if self.value_clip is None:
+                    value_loss = self.MseLoss(state_values, returns_mb)
+                else:
+                    # critic is not allowed to move further than value_clip from behaviour critic
+                    values_clipped = old_values + torch.clamp(state_values - old_values, -self.value_clip, self.value_clip)
+                    value_loss = torch.max((state_values - returns_mb) ** 2, (values_clipped - returns_mb) ** 2).mean()
+
+                loss = policy_loss + self.value_coef * value_loss - self.entropy_coef * dist_entropy.mean()
 
-            # Finding the ratio (pi_theta / pi_theta__old):
-            ratios = torch.exp(logprobs - old_logprobs.detach())
+                # take gradient step
+                optimizer.zero_grad()
+                loss.backward()
+                optimizer.step()
 
-            # Finding Surrogate Loss:
-            advantages = rewards - state_values.detach()
-            surr1 = ratios * advantages
-            surr2 = torch.clamp(ratios, 1 - self.eps_clip, 1 + self.eps_clip) * advantages
-            loss = -torch.min(surr1, surr2) + 0.5 * self.MseLoss(state_values, rewards) - 0.01 * dist_entropy
+                approx_kl_n.append((old_logprobs - logprobs).mean().item())
 
-            # take gradient step
-            optimizer.zero_grad()
-            loss.mean().backward()
-            optimizer.step()
+            if self.target_kl is not None and np.mean(approx_kl_n) > 1.5 * self.target_kl:
+                break
 
         # Copy new weights into old policy:
-        policy_old.load_state_dict(policy.state_dict())
\ No newline at end of file
+        policy_old.load_state_dict(policy.state_dict())
@@ -29,6 +29,20 @@ class TrainingAlgorithm:
     def before_cleanup(self, *args, **kwargs):
         raise NotImplementedError(f"You need to implement method `before_cleanup` in {self}")
 
+    # actor-learner topology (rl.ActorLearner), acting & learning happen in different processes
+
+    def act(self, *args, **kwargs):
+        raise NotImplementedError(f"You need to implement method `act` in {self} to use it in Actor-Learner topology")
+
+    def learn(self, *args, **kwargs):
+        raise NotImplementedError(f"You need to implement method `learn` in {self} to use it in Actor-Learner topology")
+
+    def get_weights(self, *args, **kwargs):
+        raise NotImplementedError(f"You need to implement method `get_weights` in {self} to use it in Actor-Learner topology")
+
+    def set_weights(self, *args, **kwargs):
+        raise NotImplementedError(f"You need to implement method `set_weights` in {self} to use it in Actor-Learner topology")
+
     def __str__(self):
         return "TrainingAlgorithm Abstract Class"
     
\ No newline at end of file
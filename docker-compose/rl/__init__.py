@@ -2,3 +2,4 @@ from .TrainingAlgorithm import *
 from .A2C import A2C
 from .PPO import PPO
 from .DQN import DQN
+from .ActorLearner import ActorLearner
@@ -0,0 +1,183 @@
+import numpy as np
+from scipy.signal import lfilter
+
+
+def _as_2d(array):
+    """
+    Views 1-D time series (T, ) as (T, 1), so every function works on (T, N) arrays
+
+    Parameters
+    ----------
+        array : array-like, shape (T, ) or (T, N)
+            time series
+
+    Returns
+    -------
+        array : np.array of float, shape (T, N)
+            time series as float64 2-D array
+        squeeze : bool
+            True if input was 1-D and result should be flattened back
+    """
+
+    array = np.asarray(array, dtype=np.float64)
+    if array.ndim == 1:
+        return array[:, None], True
+    return array, False
+
+
+def _masks(dones, shape):
+    """
+    Converts terminal flags to 'not done' masks
+
+    Parameters
+    ----------
+        dones : array-like of bool or None, shape (T, ) or (T, N)
+            terminal flags, None if no step is terminal
+        shape : tuple
+            (T, N) shape of rewards
+
+    Returns
+    -------
+        masks : np.array of float, shape (T, N)
+            0. for terminal steps, 1. otherwise
+    """
+
+    if dones is None:
+        return np.ones(shape)
+    return 1. - np.asarray(dones, dtype=np.float64).reshape(shape)
+
+
+def _bootstrap(last_values, n):
+    """
+    Value used after the last step of rollout
+
+    Parameters
+    ----------
+        last_values : float, array-like of float, shape (N, ) or None
+            estimated value of state after the last step, None means 0
+        n : int
+            number of series
+
+    Returns
+    -------
+        last_values : np.array of float, shape (N, )
+            bootstrap value for every series
+    """
+
+    if last_values is None:
+        return np.zeros(n)
+    return np.broadcast_to(np.asarray(last_values, dtype=np.float64).ravel(), (n, )).copy()
+
+
+def _discounted_cumsum(x, discount, masks, last_values):
+    """
+    Reverse discounted cumulative sum y_t = x_t + discount * mask_t * y_{t+1}
+
+    Every series is cut into segments that end with terminal step, discount is constant inside segment,
+    so every segment is filtered at once by `lfilter` instead of Python loop over steps
+
+    Parameters
+    ----------
+        x : np.array of float, shape (T, N)
+            values to accumulate
+        discount : float
+            discount factor
+        masks : np.array of float, shape (T, N)
+            0. for terminal steps, 1. otherwise
+        last_values : np.array of float, shape (N, )
+            y_T, value carried into the last step
+
+    Returns
+    -------
+        y : np.array of float, shape (T, N)
+            discounted cumulative sums
+    """
+
+    x = x.copy()
+    if len(x):
+        x[-1] += discount * masks[-1] * last_values
+
+    y = np.empty_like(x)
+    for n in range(x.shape[1]):
+        ends = np.flatnonzero(masks[:, n] == 0) + 1
+        for start, end in zip(np.concatenate([[0], ends]), np.concatenate([ends, [len(x)]])):
+            if start < end:
+                y[start:end, n] = lfilter([1.], [1., -discount], x[end - 1 : start - 1 if start else None : -1, n])[::-1]
+
+    return y
+
+
+def discounted_returns(rewards, gamma, dones=None, last_values=None):
+    """
+    Discounted returns G_t = r_t + gamma * (1 - done_t) * G_{t+1} of whole rollout
+
+    Whole episodes are filtered at once, so cost is O(T) without Python loop over steps,
+    instead of O(T^2) from building list with `insert(0, ...)`
+
+    Parameters
+    ----------
+        rewards : array-like of float, shape (T, ) or (T, N)
+            rewards of N series (agents, environments) over T steps
+        gamma : float
+            discount factor
+        dones : array-like of bool, shape like rewards, default=None
+            terminal flags, return is not carried over from next step if step is terminal
+        last_values : float or array-like of float, shape (N, ), default=None
+            value of state after the last step, used to bootstrap unfinished rollout
+
+    Returns
+    -------
+        returns : np.array of float, shape like rewards
+            discounted returns
+    """
+
+    rewards, squeeze = _as_2d(rewards)
+    returns = _discounted_cumsum(rewards, gamma, _masks(dones, rewards.shape), _bootstrap(last_values, rewards.shape[1]))
+
+    return returns[:, 0] if squeeze else returns
+
+
+def gae(rewards, values, gamma, lam, dones=None, last_values=None):
+    """
+    Generalized Advantage Estimation, GAE(lambda), of whole rollout
+
+    delta_t = r_t + gamma * (1 - done_t) * V_{t+1} - V_t
+    A_t = delta_t + gamma * lam * (1 - done_t) * A_{t+1}
+
+    TD errors are computed at once for all steps, advantages are their discounted cumulative sums
+
+    Parameters
+    ----------
+        rewards : array-like of float, shape (T, ) or (T, N)
+            rewards of N series (agents, environments) over T steps
+        values : array-like of float, shape like rewards
+            critic estimates V(s_t)
+        gamma : float
+            discount factor
+        lam : float
+            GAE lambda, 0 gives one-step TD advantage, 1 gives Monte Carlo advantage
+        dones : array-like of bool, shape like rewards, default=None
+            terminal flags
+        last_values : float or array-like of float, shape (N, ), default=None
+            value of state after the last step, used to bootstrap unfinished rollout
+
+    Returns
+    -------
+        advantages : np.array of float, shape like rewards
+            GAE(lambda) advantages
+        returns : np.array of float, shape like rewards
+            critic targets, advantages + values
+    """
+
+    rewards, squeeze = _as_2d(rewards)
+    values = np.asarray(values, dtype=np.float64).reshape(rewards.shape)
+    masks = _masks(dones, rewards.shape)
+
+    next_values = np.concatenate([values[1:], _bootstrap(last_values, rewards.shape[1])[None]])[:len(values)]
+    deltas = rewards + gamma * masks * next_values - values
+    advantages = _discounted_cumsum(deltas, gamma * lam, masks, np.zeros(rewards.shape[1]))
+
+    returns = advantages + values
+    if squeeze:
+        return advantages[:, 0], returns[:, 0]
+    return advantages, returns